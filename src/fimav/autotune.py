@@ -0,0 +1,336 @@
+import argparse
+import logging
+import statistics
+import sys
+import time
+import cv2
+import ncnn
+import numpy as np
+from fimav import __version__
+from fimav.processing.face_emotion_detector import FaceEmotionDetector
+from fimav.processing.model_store import ModelStore
+from fimav.processing.tuning import (
+    PRECISIONS,
+    cpu_model,
+    net_configurator,
+    save_tuning,
+)
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+# UltraFace input sizes, the first one is the size the model was exported for
+FACE_SIZES = [(320, 240), (240, 180), (160, 120)]
+EMO_SIZE = (64, 64)
+# Share of a loop period a single inference may use
+HEADROOM = 0.5
+# Minimum overlap with the reference face box for a candidate to be kept
+MIN_IOU = 0.8
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the nets on this host and save the best settings"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "--image", default="models/man.png", help="Benchmark image with one face"
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Use random input instead of the image (keeps the default face size)",
+    )
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per candidate")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        help="Thread counts to try (default: 1 up to the CPU count)",
+    )
+    parser.add_argument(
+        "--precisions",
+        nargs="+",
+        choices=list(PRECISIONS),
+        default=list(PRECISIONS),
+        help="Precisions to try",
+    )
+    parser.add_argument(
+        "--face-target-ms",
+        type=float,
+        default=1000.0 / FaceEmotionDetector.FACE_FPS * HEADROOM,
+        help="Face detection latency to meet",
+    )
+    parser.add_argument(
+        "--emotion-target-ms",
+        type=float,
+        default=1000.0 / FaceEmotionDetector.EMOTION_FPS * HEADROOM,
+        help="Emotion classification latency to meet",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Print the result without saving it"
+    )
+    parser.add_argument(
+        "--face-param", default="models/face/ultraface_12.param", help="Face net"
+    )
+    parser.add_argument(
+        "--face-bin", default="models/face/ultraface_12.bin", help="Face weights"
+    )
+    parser.add_argument(
+        "--emo-param",
+        default="models/emotion/emotion_ferplus_12.param",
+        help="Emotion net",
+    )
+    parser.add_argument(
+        "--emo-bin",
+        default="models/emotion/emotion_ferplus_12.bin",
+        help="Emotion weights",
+    )
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def time_runs(fn, runs, warmup=3):
+    """Return the median duration of ``fn()`` in milliseconds and its last result."""
+    for _ in range(warmup):
+        result = fn()
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), result
+
+
+def run_face(net, image, face_size):
+    """Detect on ``image`` and return ``(score, box)`` of the best face.
+
+    The box is normalised to the image size.
+    """
+    height, width = image.shape[:2]
+    mat = ncnn.Mat.from_pixels_resize(
+        image, ncnn.Mat.PixelType.PIXEL_BGR2RGB, width, height, *face_size
+    )
+    mat.substract_mean_normalize([127, 127, 127], [1.0 / 128] * 3)
+    ex = net.create_extractor()
+    ex.input("in0", mat)
+    _, scores = ex.extract("out0")
+    _, boxes = ex.extract("out1")
+    scores = np.array(scores)[:, 1]
+    best = int(np.argmax(scores))
+    return float(scores[best]), np.array(boxes)[best]
+
+
+def run_emotion(net, gray):
+    mat = ncnn.Mat.from_pixels_resize(
+        gray, ncnn.Mat.PixelType.PIXEL_GRAY, *gray.shape[::-1], *EMO_SIZE
+    )
+    ex = net.create_extractor()
+    ex.input("in0", mat)
+    _, out = ex.extract("out0")
+    return np.array(out)
+
+
+def box_iou(a, b):
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def pick(results, target_ms):
+    """Pick the cheapest candidate meeting ``target_ms``.
+
+    Both nets and every camera share the cores, so among the candidates fast
+    enough the one using the fewest threads wins, then the fastest. When none
+    meets the target the fastest one is returned.
+    """
+    valid = [r for r in results if r["valid"]]
+    meeting = [r for r in valid if r["latency_ms"] <= target_ms]
+    if meeting:
+        return min(meeting, key=lambda r: (r["num_threads"], r["latency_ms"]))
+    if valid:
+        best = min(valid, key=lambda r: r["latency_ms"])
+        print(f"No candidate meets {target_ms:.1f} ms, using the fastest one")
+        return best
+    return None
+
+
+def loop_rate(latency_ms, max_fps):
+    return max(1, min(max_fps, int(1000.0 * HEADROOM / latency_ms)))
+
+
+def tune_face(store, args, image, thread_counts):
+    sizes = FACE_SIZES[:1] if args.synthetic else FACE_SIZES
+    reference = None
+    results = []
+    for precision in args.precisions:
+        for num_threads in thread_counts:
+            options = {"num_threads": num_threads, "precision": precision}
+            net = store.load_net(
+                args.face_param, args.face_bin, net_configurator(options)
+            )
+            for face_size in sizes:
+                latency, (score, box) = time_runs(
+                    lambda: run_face(net, image, face_size), args.runs
+                )
+                if reference is None:
+                    # The first candidate (fp32 at the export size by default) is
+                    # the reference
+                    reference = (score, box)
+                if args.synthetic:
+                    valid = abs(score - reference[0]) < 0.05
+                else:
+                    valid = box_iou(box, reference[1]) >= MIN_IOU
+                result = dict(
+                    options, face_size=list(face_size), latency_ms=latency, valid=valid
+                )
+                results.append(result)
+                print(
+                    f"  face    {face_size[0]}x{face_size[1]} {precision} "
+                    f"{num_threads:2d} threads {latency:8.2f} ms"
+                    f"{'' if valid else '  (rejected: results differ)'}"
+                )
+    return reference, results
+
+
+def tune_emotion(store, args, gray, thread_counts):
+    reference = None
+    results = []
+    for precision in args.precisions:
+        for num_threads in thread_counts:
+            options = {"num_threads": num_threads, "precision": precision}
+            net = store.load_net(
+                args.emo_param, args.emo_bin, net_configurator(options)
+            )
+            latency, out = time_runs(lambda: run_emotion(net, gray), args.runs)
+            if reference is None:
+                reference = out
+            valid = int(np.argmax(out)) == int(np.argmax(reference))
+            results.append(dict(options, latency_ms=latency, valid=valid))
+            print(
+                f"  emotion {precision} {num_threads:2d} threads {latency:8.2f} ms"
+                f"{'' if valid else '  (rejected: results differ)'}"
+            )
+    return results
+
+
+def face_crop(image, box):
+    """Return the grey crop of the normalised ``box`` of ``image``."""
+    height, width = image.shape[:2]
+    x1, y1 = max(0, int(box[0] * width)), max(0, int(box[1] * height))
+    x2, y2 = min(width, int(box[2] * width)), min(height, int(box[3] * height))
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if x2 - x1 < 8 or y2 - y1 < 8:
+        return gray
+    return np.ascontiguousarray(gray[y1:y2, x1:x2])
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    store = ModelStore()
+    if args.synthetic:
+        image = np.random.default_rng(0).integers(0, 256, (1080, 1920, 3), np.uint8)
+    else:
+        image = cv2.imread(store.resolve(args.image))
+        if image is None:
+            raise SystemExit(f"Could not read {args.image}")
+    thread_counts = args.threads or list(range(1, ncnn.get_cpu_count() + 1))
+
+    print(f"Autotuning on {cpu_model()} ({ncnn.get_cpu_count()} cpus)")
+    reference, face_results = tune_face(store, args, image, thread_counts)
+    face = pick(face_results, args.face_target_ms)
+    if face is None:
+        raise SystemExit("No valid face detection configuration")
+
+    emotion = None
+    try:
+        store.resolve(args.emo_bin)
+    except FileNotFoundError:
+        print(f"Emotion weights not found ({args.emo_bin}), skipping the emotion net")
+    else:
+        gray = face_crop(image, reference[1])
+        emotion = pick(
+            tune_emotion(store, args, gray, thread_counts), args.emotion_target_ms
+        )
+
+    face_fps = loop_rate(face["latency_ms"], FaceEmotionDetector.FACE_FPS)
+    emotion_fps = FaceEmotionDetector.EMOTION_FPS
+    if emotion is not None:
+        emotion_fps = loop_rate(emotion["latency_ms"], emotion_fps)
+    emotion_fps = min(emotion_fps, face_fps)
+
+    summary = (
+        f"face {face['face_size'][0]}x{face['face_size'][1]} {face['precision']} "
+        f"{face['num_threads']} threads @ {face_fps} fps"
+    )
+    if emotion is not None:
+        summary += (
+            f", emotion {emotion['precision']} {emotion['num_threads']} threads"
+            f" @ {emotion_fps} fps"
+        )
+    tuning = {
+        "cpu": cpu_model(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "face": {k: v for k, v in face.items() if k != "valid"},
+        "emotion": emotion and {k: v for k, v in emotion.items() if k != "valid"},
+        "face_fps": face_fps,
+        "emotion_fps": emotion_fps,
+        "summary": summary,
+    }
+    print(f"Selected: {summary}")
+
+    if not args.dry_run:
+        path = save_tuning(store, args.face_bin, args.emo_bin, tuning)
+        print(f"Saved to {path}")
+    _logger.info("Script ends here")
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,11 @@
+import os
+
+
+def cache_dir():
+    """Return the per-user cache directory of fimav, creating it if needed."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "fimav")
+    os.makedirs(path, exist_ok=True)
+    return path
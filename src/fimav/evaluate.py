@@ -0,0 +1,407 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from fimav import __version__
+from fimav.processing.face_emotion_detector import FaceEmotionDetector
+from fimav.processing.model_bank import ModelBank
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+LABELS = FaceEmotionDetector.EMOTION_LABELS
+# Folder names of the FER+ dataset, in the same order as LABELS
+FERPLUS_LABELS = [
+    "neutral",
+    "happiness",
+    "surprise",
+    "sadness",
+    "anger",
+    "disgust",
+    "fear",
+    "contempt",
+]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+# Predictions of the images that could not be classified
+NO_FACE = -1
+UNREADABLE = -2
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Evaluate the face and emotion models on a directory of"
+        " labelled images, one folder per emotion (FER+ or fimav names)"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument("dataset", help="Directory with one folder per emotion")
+    parser.add_argument(
+        "--detect",
+        action="store_true",
+        help="Find the face with the face net first, as the app does (for"
+        " uncropped images); otherwise each image is the face crop",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Worker processes, each running single-threaded nets",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="Images sent to a worker at a time",
+    )
+    parser.add_argument(
+        "--max-per-class",
+        type=int,
+        default=0,
+        help="Evaluate at most this many images of each emotion (0 for all)",
+    )
+    parser.add_argument(
+        "--output", metavar="PATH", help="Also write the results to this JSON file"
+    )
+    parser.add_argument(
+        "--face-size",
+        type=int,
+        nargs=2,
+        default=(320, 240),
+        metavar=("WIDTH", "HEIGHT"),
+        help="Face net input size",
+    )
+    parser.add_argument(
+        "--face-param", default="models/face/ultraface_12.param", help="Face net"
+    )
+    parser.add_argument(
+        "--face-bin", default="models/face/ultraface_12.bin", help="Face weights"
+    )
+    parser.add_argument(
+        "--emo-param",
+        default="models/emotion/emotion_ferplus_12.param",
+        help="Emotion net",
+    )
+    parser.add_argument(
+        "--emo-bin",
+        default="models/emotion/emotion_ferplus_12.bin",
+        help="Emotion weights",
+    )
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def label_index(name):
+    """Return the emotion index of folder ``name``, None if it is not one."""
+    name = name.lower()
+    for labels in (LABELS, FERPLUS_LABELS):
+        if name in labels:
+            return labels.index(name)
+    if name.isdigit() and int(name) < len(LABELS):
+        return int(name)
+    return None
+
+
+def find_images(dataset, max_per_class=0):
+    """Return ``(path, emotion index)`` of every image under ``dataset``."""
+    items = []
+    for folder in sorted(os.listdir(dataset)):
+        path = os.path.join(dataset, folder)
+        if not os.path.isdir(path):
+            continue
+        label = label_index(folder)
+        if label is None:
+            print(f"Skipping {folder}, not an emotion")
+            continue
+        names = sorted(
+            name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if max_per_class > 0:
+            names = names[:max_per_class]
+        items.extend((os.path.join(path, name), label) for name in names)
+    return items
+
+
+class ImageSource:
+    """Stands in for the ``VideoCapture`` of the detector, one image at a time."""
+
+    pixel_format = "BGR"
+
+    def __init__(self):
+        self.frame_count = 0
+        self.latest_frame_time = None
+        self._image = None
+
+    def show(self, image):
+        self._image = image
+        self.frame_count += 1
+        self.latest_frame_time = time.monotonic()
+
+    def get_latest_frame(self):
+        return self._image
+
+    def get_latest_detection_frame(self):
+        return None
+
+
+class _Controller:
+    def update_emotion(self, emotion_idx, trace=None):
+        pass
+
+
+# Detector of each worker process, created by _init_worker
+_detector = None
+
+
+def _init_worker(model_paths, face_size):
+    """Create the worker's detector with single-threaded nets."""
+    global _detector
+    cv2.setNumThreads(1)
+    bank = ModelBank()
+    detector = FaceEmotionDetector(
+        ImageSource(),
+        _Controller(),
+        bank,
+        face_size=face_size,
+        autotune=False,
+        **model_paths,
+    )
+    # The workers share the CPUs, one thread per net each
+    options = {"num_threads": 1}
+    detector.swap_net(
+        "face",
+        bank.get_net(model_paths["face_param"], model_paths["face_bin"], options),
+        detector.face_model,
+    )
+    detector.swap_net(
+        "emotion",
+        bank.get_net(model_paths["emo_param"], model_paths["emo_bin"], options),
+        detector.emotion_model,
+    )
+    _detector = detector
+
+
+def check_models(model_paths):
+    """Load both nets once, exit with the reason when one cannot be loaded.
+
+    A worker failing in ``_init_worker`` is replaced by the pool forever, so
+    the models are checked here before any worker starts.
+    """
+    bank = ModelBank()
+    try:
+        bank.get_net(model_paths["face_param"], model_paths["face_bin"])
+        bank.get_net(model_paths["emo_param"], model_paths["emo_bin"])
+    except (RuntimeError, OSError, ValueError) as e:
+        raise SystemExit(f"Cannot load the models: {e}")
+
+
+def classify(detector, image, detect):
+    """Return the emotion of ``image`` with and without the triste boost.
+
+    Runs the detector's own face detection and emotion classification, so
+    the crop, padding and boost are those of the app.
+    """
+    if detect:
+        detector.video_capture.show(image)
+        detector.prepare_face_frame()
+        boxes, scores = detector._detect_faces()
+        if not boxes:
+            return NO_FACE, NO_FACE
+    else:
+        # The whole image is the face
+        width, height = detector.face_size
+        boxes, scores = [(0, 0, width, height)], [1.0]
+    detector.publish_detection(boxes, scores)
+
+    detector.latest_probabilities = None
+    emotion_idx = detector._classify_emotion(image)
+    probs = detector.latest_probabilities
+    if probs is None:
+        return NO_FACE, NO_FACE
+    unboosted = probs.copy()
+    unboosted[LABELS.index("triste")] /= detector.TRISTE_BOOST
+    return emotion_idx, int(np.argmax(unboosted))
+
+
+def _evaluate_batch(batch, detect):
+    """Classify a batch in a worker, return its results and busy seconds."""
+    start = time.perf_counter()
+    results = []
+    for path, label in batch:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            results.append((label, UNREADABLE, UNREADABLE))
+            continue
+        results.append((label,) + classify(_detector, image, detect))
+    return results, time.perf_counter() - start
+
+
+def confusion_matrix(results, column):
+    """Return the confusion matrix of the classified ``results``.
+
+    Rows are the true emotions, columns the ``column``-th prediction.
+    """
+    matrix = np.zeros((len(LABELS), len(LABELS)), dtype=int)
+    for result in results:
+        if result[column] >= 0:
+            matrix[result[0], result[column]] += 1
+    return matrix
+
+
+def _accuracy(matrix, row=None):
+    if row is None:
+        total, correct = matrix.sum(), np.trace(matrix)
+    else:
+        total, correct = matrix[row].sum(), matrix[row, row]
+    return correct / total if total else None
+
+
+def _percent(value, width):
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.1%}"
+
+
+def format_report(boosted, unboosted):
+    width = 7
+    lines = [
+        "Confusion matrix with the triste boost (rows: true, columns: predicted):",
+        " " * 12 + "".join(f"{label[:5]:>{width}}" for label in LABELS),
+    ]
+    for i, label in enumerate(LABELS):
+        lines.append(
+            f"{label:<12}" + "".join(f"{count:>{width}d}" for count in boosted[i])
+        )
+    lines.append("")
+    lines.append(f"{'Accuracy':<14}{'boost':>9}{'no boost':>10}{'images':>8}")
+    for i, label in enumerate(LABELS):
+        lines.append(
+            f"  {label:<12}{_percent(_accuracy(boosted, i), 9)}"
+            f"{_percent(_accuracy(unboosted, i), 10)}{boosted[i].sum():>8d}"
+        )
+    lines.append(
+        f"  {'overall':<12}{_percent(_accuracy(boosted), 9)}"
+        f"{_percent(_accuracy(unboosted), 10)}{boosted.sum():>8d}"
+    )
+    triste = LABELS.index("triste")
+    moved = boosted[:, triste].sum() - unboosted[:, triste].sum()
+    gained = boosted[triste, triste] - unboosted[triste, triste]
+    lines.append(
+        f"The triste boost turns {moved} predictions into triste, {gained} of them"
+        " correctly"
+    )
+    return "\n".join(lines)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    items = find_images(args.dataset, args.max_per_class)
+    if not items:
+        raise SystemExit(f"No labelled images in {args.dataset}")
+    batches = [
+        items[i : i + args.batch_size] for i in range(0, len(items), args.batch_size)
+    ]
+    model_paths = {
+        "face_param": args.face_param,
+        "face_bin": args.face_bin,
+        "emo_param": args.emo_param,
+        "emo_bin": args.emo_bin,
+    }
+    check_models(model_paths)
+    print(f"Evaluating {len(items)} images with {args.workers} workers")
+
+    results = []
+    busy = 0.0
+    start = time.monotonic()
+    with multiprocessing.Pool(
+        args.workers, _init_worker, (model_paths, tuple(args.face_size))
+    ) as pool:
+        jobs = [
+            pool.apply_async(_evaluate_batch, (batch, args.detect)) for batch in batches
+        ]
+        for done, job in enumerate(jobs, 1):
+            batch_results, seconds = job.get()
+            results.extend(batch_results)
+            busy += seconds
+            _logger.info(f"{done}/{len(jobs)} batches")
+    elapsed = time.monotonic() - start
+
+    boosted = confusion_matrix(results, 1)
+    unboosted = confusion_matrix(results, 2)
+    no_face = sum(1 for result in results if result[1] == NO_FACE)
+    unreadable = sum(1 for result in results if result[1] == UNREADABLE)
+    print(
+        f"{len(results)} images in {elapsed:.1f} s: {len(results) / elapsed:.1f}"
+        f" images/s, {busy / len(results) * 1000:.1f} ms per image per worker,"
+        f" {no_face} without a face, {unreadable} unreadable"
+    )
+    print(format_report(boosted, unboosted))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "labels": LABELS,
+                    "models": model_paths,
+                    "detect": args.detect,
+                    "images": len(results),
+                    "images_per_s": len(results) / elapsed,
+                    "no_face": no_face,
+                    "unreadable": unreadable,
+                    "confusion": boosted.tolist(),
+                    "confusion_without_boost": unboosted.tolist(),
+                },
+                f,
+                indent=2,
+            )
+    _logger.info("Script ends here")
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
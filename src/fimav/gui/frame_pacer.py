@@ -0,0 +1,117 @@
+import time
+
+
+class FramePacer:
+    """Paces the display loop against absolute ``time.monotonic()`` deadlines.
+
+    Each frame gets a slot of ``1 / fps`` seconds starting at
+    ``deadline``. After rendering, the loop sleeps until the next slot
+    instead of a fixed interval, so the render cost no longer slows the rate
+    down. A read that has to wait for the camera starts the slot when the
+    frame arrives, the camera then sets the pace. A frame that ends after
+    its slot counts as a missed deadline and the next slot starts right
+    away, without a burst to catch up.
+
+    After a missed deadline, a frame read instantly was waiting in the
+    capture buffer while the late frame rendered and is stale: up to
+    ``MAX_SKIPS`` of them are skipped, until a read waits for a fresh
+    frame. The
+    rate adapts to the measured render cost, between ``min_fps`` and
+    ``target_fps``, so a render never takes more than ``HEADROOM`` of a slot.
+    Failed reads are retried after an exponential backoff.
+    """
+
+    HEADROOM = 0.75
+    # Weight of the newest render in the mean render cost
+    SMOOTHING = 0.1
+    # Buffered frames dropped in a row before rendering one anyway
+    MAX_SKIPS = 2
+
+    def __init__(self, fps=30.0, min_fps=10.0, min_backoff=0.01, max_backoff=0.5):
+        self.target_fps = fps
+        self.min_fps = min(min_fps, fps)
+        self.fps = fps
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.deadline = None
+        self.render_cost = None
+        self.rendered = 0
+        self.skipped = 0
+        self.missed = 0
+        self.read_failures = 0
+        self._failures = 0
+        self._skips = 0
+        self._behind = False
+        self._started = None
+
+    @property
+    def interval(self):
+        return 1.0 / self.fps
+
+    def start(self):
+        self.deadline = self._started = time.monotonic()
+
+    def is_stale(self, read_time):
+        """Return True when the frame just read in ``read_time`` s should be dropped."""
+        if read_time >= self.interval / 4:
+            # Waited for the camera, the frame is fresh
+            self._behind = False
+            self.deadline = max(self.deadline, time.monotonic())
+        if not self._behind or self._skips >= self.MAX_SKIPS:
+            return False
+        self._skips += 1
+        self.skipped += 1
+        return True
+
+    def read_failed(self):
+        """Sleep before the next read, longer after each consecutive failure."""
+        self.read_failures += 1
+        delay = min(self.max_backoff, self.min_backoff * 2**self._failures)
+        self._failures += 1
+        time.sleep(delay)
+        self.deadline = time.monotonic()
+
+    def frame_rendered(self, cost):
+        """Account a frame rendered in ``cost`` seconds, then sleep to the next slot."""
+        self._failures = 0
+        self._skips = 0
+        self.rendered += 1
+        if self.render_cost is None:
+            self.render_cost = cost
+        else:
+            self.render_cost += self.SMOOTHING * (cost - self.render_cost)
+        due = self.deadline + self.interval
+        if self.render_cost > 0:
+            self.fps = min(
+                self.target_fps, max(self.min_fps, self.HEADROOM / self.render_cost)
+            )
+
+        now = time.monotonic()
+        self._behind = now > due
+        if self._behind:
+            self.missed += 1
+            self.deadline = now
+        else:
+            self.deadline = due
+            time.sleep(due - now)
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {
+            "fps": self.rendered / elapsed if elapsed > 0 else 0.0,
+            "target_fps": self.fps,
+            "render_ms": (self.render_cost or 0.0) * 1000,
+            "rendered": self.rendered,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "read_failures": self.read_failures,
+        }
+
+    def format_report(self):
+        stats = self.stats()
+        return (
+            f"Display: {stats['fps']:.1f} fps (target {stats['target_fps']:.1f}),"
+            f" render {stats['render_ms']:.1f} ms, {stats['rendered']} frames,"
+            f" {stats['missed']} missed deadlines, {stats['skipped']} stale frames"
+            f" skipped, {stats['read_failures']} failed reads"
+        )
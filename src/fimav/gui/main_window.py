@@ -5,23 +5,72 @@ import time
 import threading
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
-from fimav.processing.video_capture import VideoCapture
-from fimav.processing.face_emotion_detector import FaceEmotionDetector
-from fimav.processing.emotion_state_controller import EmotionStateController
+from fimav import thread_policy
+from fimav.gui.frame_pacer import FramePacer
+
+EMOTION_OVERLAY_NAMES = [
+    "heureuse",
+    "surprenante",
+    "triste",
+    "enrageante",
+    "dégoutante",
+    "apeurante",
+    "méprisante",
+]
+
+
+def render_text_image(text, font_path="Arial", font_size=32):
+    font = ImageFont.truetype(f"fonts/{font_path}.ttf", font_size)
+
+    # Dummy image to get drawing context
+    dummy_img = Image.new("RGB", (1, 1))
+    draw = ImageDraw.Draw(dummy_img)
+
+    # Get tight bounding box
+    bbox = draw.textbbox((0, 0), text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    # Add a bit of vertical padding (5–10 pixels is usually enough)
+    padding = 10
+    img = Image.new("RGB", (text_width, text_height + padding), (0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.text((0, 0), text, font=font, fill=(255, 255, 255))
+
+    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+
+
+def render_overlays(font_size=26):
+    """Render the fixed text overlays, does not need Tk so it can run early.
+
+    Returns the idle text image and the list of "next song" images, one per
+    emotion after neutral.
+    """
+    no_emotion_text_image = render_text_image(
+        "Contrôlez l'orchestre avec vos émotions !", "Arial", font_size
+    )
+
+    base_emotion_text = "La prochaine musique sera "
+    emotions_with_fonts = [
+        render_text_image(base_emotion_text + name, "Arial", font_size)
+        for name in EMOTION_OVERLAY_NAMES
+    ]
+    return no_emotion_text_image, emotions_with_fonts
 
 
 class MainWindow:
-    def __init__(self, root, face_size, width, height):
+    def __init__(self, root, pipeline, width, height, overlays=None):
         self.root = root
         self.root.title("Video Feed with Progress Bar Overlay")
 
         # Video capture setup
-        self.video_capture = VideoCapture.get_instance()
-        self.detector = FaceEmotionDetector.get_instance()
-        self.emotion_controller = EmotionStateController.get_instance()
+        self.pipeline = pipeline
+        self.video_capture = pipeline.video_capture
+        self.detector = pipeline.detector
+        self.emotion_controller = pipeline.emotion_controller
         self.width = width
         self.height = height
-        self.face_size = face_size
+        self.face_size = self.detector.face_size
 
         # Create a Canvas to hold the video frame
         self.canvas = tk.Canvas(root, width=self.width, height=self.height)
@@ -29,69 +78,83 @@ class MainWindow:
 
         # Create image item (initially empty)
         self.canvas_img = self.canvas.create_image(0, 0, anchor="nw", image=None)
+        # Kept from frame to frame and refilled, instead of new ones per frame
+        self._image = None
+        self._photo = None
+        self._render_shape = None
 
         # Streaming control
-        self.interval = 1 / 30
+        self.pacer = FramePacer(30)
+        # Longest extrapolation of the face boxes past their detection, in
+        # seconds (0 draws them where they were detected)
+        self.box_lead = 0.2
         self.is_running = False
         self.thread = None
 
-        font_size = 26
-        self.no_emotion_text_image = self.render_text_image(
-            "Contrôlez l'orchestre avec vos émotions !", "Arial", font_size
-        )
-
-        base_emotion_text = "La prochaine musique sera "
-        self.emotions_with_fonts = [
-            self.render_text_image(base_emotion_text + "heureuse", "Arial", font_size),
-            self.render_text_image(
-                base_emotion_text + "surprenante", "Arial", font_size
-            ),
-            self.render_text_image(base_emotion_text + "triste", "Arial", font_size),
-            self.render_text_image(
-                base_emotion_text + "enrageante", "Arial", font_size
-            ),
-            self.render_text_image(
-                base_emotion_text + "dégoutante", "Arial", font_size
-            ),
-            self.render_text_image(base_emotion_text + "apeurante", "Arial", font_size),
-            self.render_text_image(
-                base_emotion_text + "méprisante", "Arial", font_size
-            ),
-        ]
+        # Text overlays may have been rendered ahead of time
+        if overlays is None:
+            overlays = render_overlays()
+        self.no_emotion_text_image, self.emotions_with_fonts = overlays
+
+        # Called once the first frame is on screen
+        self.on_first_frame = None
 
         # Ensure clean shutdown
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
 
     def start(self):
-        """Starts the video stream in a separate thread."""
+        """Starts the video stream in a separate thread.
+
+        The pipeline itself (camera and detector) is started by its owner,
+        the window only displays it.
+        """
         if not self.is_running:
             self.is_running = True
-            self.video_capture.start_capture()
-            self.detector.start_processing()
 
-            self.thread = threading.Thread(target=self._update_frame, daemon=True)
+            self.thread = threading.Thread(
+                target=self._update_frame, name="display", daemon=True
+            )
             self.thread.start()
+            thread_policy.register(self.thread, "display")
 
     def stop(self):
         """Stops the video stream and thread."""
         if self.is_running:
             self.is_running = False
-            if self.video_capture is not None:
-                self.video_capture.stop_capture()
-                self.detector.stop_processing()
             if self.thread is not None:
                 self.thread.join()
             self.thread = None
 
     def _update_frame(self):
         """Fetches frames, overlays text and progress bar with OpenCV, updates the Canvas image."""
+        pacer = self.pacer
+        pacer.start()
         while self.is_running:
+            read_start = time.monotonic()
             frame = self.video_capture.get_new_frame()
             if frame is None:
                 print("Error: Failed to read frame. Skipping.")
+                pacer.read_failed()
+                continue
+            render_start = time.monotonic()
+            if pacer.is_stale(render_start - read_start):
                 continue
 
-            raw_boxes = self.detector.get_latest_detection() or []
+            # Convert once to RGB for PIL, drawing on a copy keeps the
+            # captured frame untouched for the detector. The overlay colours
+            # are the same in BGR and RGB.
+            pool = getattr(self.video_capture, "buffer_pool", None)
+            render = None
+            if pool is not None and self._render_shape is not None:
+                render = pool.checkout(self._render_shape)
+            frame = self.video_capture.to_rgb(frame, render)
+            self._render_shape = frame.shape
+
+            # Boxes of an older frame, moved to where the faces are now
+            snapshot = self.detector.get_latest_snapshot()
+            raw_boxes = snapshot.boxes_at(
+                self.video_capture.latest_frame_time, self.box_lead
+            )
             scaled_boxes = self._scale_boxes(raw_boxes)
 
             # Draw boxes
@@ -157,38 +220,33 @@ class MainWindow:
 
             frame[y : y + h, x : x + w] = text_image
 
-            # Convert BGR to RGB for PIL
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img_tk = ImageTk.PhotoImage(image=img)
+            self._show(frame)
+            if pool is not None:
+                pool.release(frame)
+
+            if self.on_first_frame is not None:
+                self.on_first_frame()
+                self.on_first_frame = None
 
+            # Sleep until the next frame is due
+            pacer.frame_rendered(time.monotonic() - render_start)
+
+    def _show(self, frame):
+        """Copy the RGB ``frame`` to the canvas image."""
+        size = (frame.shape[1], frame.shape[0])
+        if self._image is None or self._image.size != size:
+            self._image = Image.fromarray(frame)
+            self._photo = ImageTk.PhotoImage(image=self._image)
             # Update Canvas image item
-            self.canvas.itemconfig(self.canvas_img, image=img_tk)
+            self.canvas.itemconfig(self.canvas_img, image=self._photo)
             # Keep reference to avoid garbage collection
-            self.canvas.image = img_tk
-
-            # Throttle loop
-            time.sleep(self.interval)
+            self.canvas.image = self._photo
+            return
+        self._image.frombytes(memoryview(np.ascontiguousarray(frame)))
+        self._photo.paste(self._image)
 
     def render_text_image(self, text, font_path="Arial", font_size=32):
-        font = ImageFont.truetype(f"fonts/{font_path}.ttf", font_size)
-
-        # Dummy image to get drawing context
-        dummy_img = Image.new("RGB", (1, 1))
-        draw = ImageDraw.Draw(dummy_img)
-
-        # Get tight bounding box
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-
-        # Add a bit of vertical padding (5–10 pixels is usually enough)
-        padding = 10
-        img = Image.new("RGB", (text_width, text_height + padding), (0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        draw.text((0, 0), text, font=font, fill=(255, 255, 255))
-
-        return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+        return render_text_image(text, font_path, font_size)
 
     def _scale_boxes(self, raw_boxes):
         scale_x = self.width / self.face_size[0]
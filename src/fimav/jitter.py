@@ -0,0 +1,283 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+from fimav import __version__, thread_policy
+from fimav.midi.instruments import InstrumentMap
+from fimav.midi.midi_controller import MidiController
+from fimav.midi.midi_library import MidiLibrary
+from fimav.mqtt.clock_sync import ClockServer
+from fimav.mqtt.local_broker import LocalBroker
+from fimav.mqtt.mqtt_manager import (
+    DEFAULT_PASSWORD,
+    DEFAULT_USERNAME,
+    MqttManager,
+)
+from fimav.mqtt.receiver import MidiReceiver
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+SONG_NAME = "jitter.mid"
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the MIDI timing jitter of immediate and lookahead"
+        " publishing through an MQTT broker"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "--broker",
+        metavar="HOST:PORT",
+        help="Use this broker instead of the embedded stand-in",
+    )
+    parser.add_argument(
+        "--mqtt-user",
+        default=os.environ.get("FIMAV_MQTT_USER", DEFAULT_USERNAME),
+        help="MQTT user name (FIMAV_MQTT_USER)",
+    )
+    parser.add_argument(
+        "--mqtt-password",
+        default=os.environ.get("FIMAV_MQTT_PASSWORD", DEFAULT_PASSWORD),
+        help="MQTT password (FIMAV_MQTT_PASSWORD)",
+    )
+    parser.add_argument(
+        "--network-jitter-ms",
+        type=float,
+        default=10.0,
+        help="Random delay added by the stand-in broker to each message",
+    )
+    parser.add_argument(
+        "--lookahead-ms", type=float, default=200.0, help="Publishing lookahead"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="Seconds of music per run"
+    )
+    parser.add_argument(
+        "--notes-per-second", type=float, default=20.0, help="Note density"
+    )
+    parser.add_argument(
+        "--load",
+        type=int,
+        default=0,
+        help="Busy processes standing in for the inference threads",
+    )
+    parser.add_argument(
+        "--thread-policy",
+        metavar="PATH",
+        help="Also measure with this fimav-run --thread-policy, the busy"
+        " processes taking the face role",
+    )
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def write_song(path, duration, notes_per_second):
+    """Write a song of evenly spaced short notes at 120 bpm."""
+    midi_file = MidiFile(ticks_per_beat=480)
+    track = MidiTrack()
+    midi_file.tracks.append(track)
+    track.append(MetaMessage("set_tempo", tempo=500000))
+    interval = max(2, round(960 / notes_per_second))
+    for i in range(int(duration * notes_per_second)):
+        note = 48 + i % 24
+        track.append(Message("note_on", note=note, velocity=64, time=interval // 2))
+        track.append(Message("note_off", note=note, velocity=0, time=interval // 2))
+    midi_file.save(path)
+
+
+def note_onsets(path):
+    """Return the offset of every note-on of the song, in seconds."""
+    onsets, now = [], 0.0
+    for delta, message, _ in InstrumentMap().split_song(path):
+        now += delta
+        if message.type == "note_on" and message.velocity > 0:
+            onsets.append(now)
+    return np.array(onsets)
+
+
+def _busy(stop, roles):
+    """Keep a CPU busy with matrix products, as the face net would.
+
+    ``roles`` is the thread policy configuration, applied with the face
+    role; the policy is built here as it cannot be pickled to the child.
+    """
+    if roles is not None:
+        thread_policy.ThreadPolicy(roles).apply("face")
+    a = np.random.rand(128, 128).astype(np.float32)
+    while not stop.is_set():
+        a = np.tanh(a @ a)
+
+
+def start_load(count, roles=None):
+    """Start ``count`` busy processes, return the event stopping them."""
+    stop = multiprocessing.Event()
+    for _ in range(count):
+        multiprocessing.Process(target=_busy, args=(stop, roles), daemon=True).start()
+    return stop
+
+
+def run_once(host, port, credentials, midi_dir, lookahead, expected):
+    """Play the song once, return the onset errors, arrival margins and lateness.
+
+    ``credentials`` is the ``(user, password)`` of the broker. The errors
+    are empty when no note arrived.
+    """
+    username, password = credentials
+    mqtt_manager = MqttManager(host, port, username, password)
+    library = MidiLibrary(midi_dir, os.path.join(midi_dir, "index.json"))
+    controller = MidiController(mqtt_manager, midi_dir, library, lookahead=lookahead)
+    ClockServer(mqtt_manager, controller.shared_time)
+    try:
+        receiver = MidiReceiver(
+            host, port, username=username, password=password
+        ).start()
+    except OSError as e:
+        controller.close()
+        mqtt_manager.close()
+        raise SystemExit(f"Cannot connect to the MQTT broker {host}:{port}: {e}")
+    time.sleep(0.5)
+
+    controller.play_midi_file(SONG_NAME)
+    time.sleep(expected[-1] + lookahead + 0.5)
+    controller.close()
+    receiver.stop()
+    mqtt_manager.close()
+    lateness = controller.timing_jitter()
+
+    played = np.array([t for t, _ in receiver.played])
+    count = min(len(played), len(expected))
+    if count == 0:
+        return np.array([]), len(expected), np.array(receiver.margins), lateness
+    # Error of each onset relative to the first one, so both modes compare
+    errors = (played[:count] - played[0]) - (expected[:count] - expected[0])
+    return errors, len(expected) - count, np.array(receiver.margins), lateness
+
+
+def format_errors(name, errors, lost, lateness):
+    if not len(errors):
+        return f"  {name:<20} no note arrived, check the broker and credentials"
+    errors = np.abs(errors) * 1000
+    line = (
+        f"  {name:<20} p50 {np.percentile(errors, 50):6.2f} ms,"
+        f" p95 {np.percentile(errors, 95):6.2f} ms, max {errors.max():6.2f} ms,"
+        f" {lost} lost"
+    )
+    if lateness is not None:
+        line += f", sent late by p95 {lateness['p95_ms']:.2f} ms"
+    return line
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        port = int(port)
+    else:
+        jitter = args.network_jitter_ms / 1000
+
+        broker = LocalBroker(delay=lambda: random.uniform(0, jitter)).start()
+        host, port = broker.host, broker.port
+
+    with tempfile.TemporaryDirectory() as midi_dir:
+        path = os.path.join(midi_dir, SONG_NAME)
+        write_song(path, args.duration, args.notes_per_second)
+        expected = note_onsets(path)
+
+        lines = [
+            f"MIDI timing error over {len(expected)} notes ({host}:{port}),"
+            f" {args.load} busy processes:"
+        ]
+        load = start_load(args.load)
+        credentials = (args.mqtt_user, args.mqtt_password)
+        errors, lost, _, lateness = run_once(
+            host, port, credentials, midi_dir, 0.0, expected
+        )
+        lines.append(format_errors("immediate", errors, lost, lateness))
+
+        lookahead = args.lookahead_ms / 1000
+        errors, lost, margins, lateness = run_once(
+            host, port, credentials, midi_dir, lookahead, expected
+        )
+        lines.append(
+            format_errors(f"lookahead {args.lookahead_ms:g} ms", errors, lost, lateness)
+        )
+        if len(margins):
+            lines.append(
+                f"  events arrived {margins.min() * 1000:.1f} ms ahead at worst,"
+                f" {int((margins < 0).sum())} late"
+            )
+        load.set()
+
+        if args.thread_policy:
+            policy = thread_policy.ThreadPolicy.load(args.thread_policy)
+            thread_policy.install(policy)
+            load = start_load(args.load, policy.roles)
+            errors, lost, _, lateness = run_once(
+                host, port, credentials, midi_dir, 0.0, expected
+            )
+            lines.append(format_errors("immediate + policy", errors, lost, lateness))
+            load.set()
+            lines.append(policy.format_report())
+
+    if broker is not None:
+        broker.stop()
+    print("\n".join(lines))
+    _logger.info("Script ends here")
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
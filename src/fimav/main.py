@@ -1,14 +1,15 @@
 import argparse
+import importlib
 import logging
+import os
 import sys
-import tkinter as tk
 from fimav import __version__
-from fimav.processing.video_capture import VideoCapture
-from fimav.processing.face_emotion_detector import FaceEmotionDetector
-from fimav.processing.emotion_state_controller import EmotionStateController
-from fimav.gui.main_window import MainWindow
-from fimav.mqtt.mqtt_manager import MqttManager
-from fimav.midi.midi_controller import MidiController
+from fimav import thread_policy
+from fimav.processing.choices import PIXEL_FORMATS, SCHEDULING_MODES
+from fimav.startup import StartupOrchestrator
+
+# Heavy modules (OpenCV, ncnn, PIL, Tk, paho, mido) are imported by the
+# startup steps in main(), in parallel, instead of at module load.
 
 __author__ = "Eloik-dev"
 __copyright__ = "Eloik-dev"
@@ -49,7 +50,24 @@ def parse_args(args):
         "--height", type=int, default=1080, help="Initial display height"
     )
     parser.add_argument(
-        "--camera-index", type=int, default=0, help="Index of the camera to use"
+        "--display-fps",
+        type=float,
+        default=30,
+        help="Target display rate, lowered while rendering cannot keep up",
+    )
+    parser.add_argument(
+        "--box-lead",
+        type=float,
+        default=0.2,
+        help="Longest time in seconds the displayed face boxes are moved along"
+        " their motion past their detection (0 draws them where detected)",
+    )
+    parser.add_argument(
+        "--camera-index",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="Index of the camera(s) to use, the first one is displayed",
     )
     parser.add_argument(
         "--camera-width", type=int, default=1920, help="Width of the camera to use"
@@ -57,6 +75,187 @@ def parse_args(args):
     parser.add_argument(
         "--camera-height", type=int, default=1080, help="Height of the camera to use"
     )
+    parser.add_argument(
+        "--decoder",
+        default="auto",
+        help="GStreamer MJPEG decoder, 'auto' picks the fastest one installed",
+    )
+    parser.add_argument(
+        "--detection-branch",
+        action="store_true",
+        help="Scale the detector input inside GStreamer on a second branch",
+    )
+    parser.add_argument(
+        "--pixel-format",
+        choices=PIXEL_FORMATS,
+        default="BGR",
+        help="Frame format delivered by the camera, I420/NV12 skip conversions",
+    )
+    parser.add_argument(
+        "--scheduling",
+        choices=SCHEDULING_MODES,
+        default="threads",
+        help="How the detectors of several cameras share the CPU (batched runs"
+        " the face net of every camera from one thread, one frame after the"
+        " other)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker threads for per-core scheduling",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=0,
+        help="Seconds between throughput reports (0 disables them)",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Record the first camera's frames and decisions to this directory",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Trace each frame from capture to the MIDI it triggers and write the"
+        " trace to this Chrome trace-event JSON file (for Perfetto) at exit",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Sample every thread's stack and write collapsed stacks per thread to"
+        " this directory; SIGUSR1 starts another run at any time",
+    )
+    parser.add_argument(
+        "--profile-duration",
+        type=float,
+        default=30.0,
+        help="Seconds per profiling run (0 waits for SIGUSR1 for the first one)",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=0.005,
+        help="Seconds between two stack samples",
+    )
+    parser.add_argument(
+        "--buffer-pool-size",
+        type=int,
+        default=4,
+        help="Frame buffers of each size kept for reuse by the capture, detector"
+        " and display (0 allocates new arrays for every frame)",
+    )
+    parser.add_argument(
+        "--memory-report",
+        type=float,
+        default=0,
+        help="Seconds between memory reports (0 disables them, SIGUSR2 prints one"
+        " at any time)",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        type=int,
+        default=0,
+        metavar="FRAMES",
+        help="Trace Python allocations with this many frames for the memory"
+        " report's top allocators (0 disables tracing)",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=0.05,
+        help="Maximum seconds a frame may wait for batched face detection",
+    )
+    parser.add_argument(
+        "--motion-refresh",
+        type=float,
+        default=2.0,
+        help="Skip face detection on static scenes, re-detecting at least every"
+        " this many seconds (0 disables the motion gate)",
+    )
+    parser.add_argument(
+        "--emotion-cache-ttl",
+        type=float,
+        default=1.0,
+        help="Reuse the emotion of an unchanged face for up to this many seconds"
+        " (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--face-quality",
+        action="store_true",
+        help="Keep poor faces away from the emotion net with the --min-face-* and"
+        " --face-aspect limits (off by default)",
+    )
+    parser.add_argument(
+        "--min-face-size",
+        type=float,
+        default=0.12,
+        help="Smallest face height, as a share of the detector input, given to the"
+        " emotion net (0 disables this check)",
+    )
+    parser.add_argument(
+        "--min-face-score",
+        type=float,
+        default=0,
+        help="Smallest detector score of a face given to the emotion net (0 keeps"
+        " the detector's own threshold)",
+    )
+    parser.add_argument(
+        "--min-face-sharpness",
+        type=float,
+        default=0,
+        help="Smallest Laplacian variance of a face crop given to the emotion net"
+        " (0 disables this check)",
+    )
+    parser.add_argument(
+        "--face-aspect",
+        type=float,
+        nargs=2,
+        default=(0.45, 1.2),
+        metavar=("MIN", "MAX"),
+        help="Width/height ratios of the faces given to the emotion net",
+    )
+    parser.add_argument(
+        "--midi-lookahead",
+        type=float,
+        default=0,
+        help="Publish MIDI events this many seconds ahead with their play time,"
+        " for receivers synchronised on this host (0 publishes them live)",
+    )
+    parser.add_argument(
+        "--mqtt-host",
+        default=os.environ.get("FIMAV_MQTT_HOST", "localhost"),
+        help="MQTT broker host (FIMAV_MQTT_HOST)",
+    )
+    parser.add_argument(
+        "--mqtt-port",
+        type=int,
+        default=int(os.environ.get("FIMAV_MQTT_PORT", 1884)),
+        help="MQTT broker port (FIMAV_MQTT_PORT)",
+    )
+    parser.add_argument(
+        "--mqtt-user",
+        default=os.environ.get("FIMAV_MQTT_USER", "orchestrateur"),
+        help="MQTT user name (FIMAV_MQTT_USER)",
+    )
+    parser.add_argument(
+        "--mqtt-password",
+        default=os.environ.get("FIMAV_MQTT_PASSWORD", "Orchestrateur1234"),
+        help="MQTT password (FIMAV_MQTT_PASSWORD)",
+    )
+    parser.add_argument(
+        "--thread-policy",
+        metavar="PATH",
+        help="JSON file giving the CPU affinity, nice value or SCHED_FIFO priority"
+        f" of each thread role ({', '.join(thread_policy.ROLES)})",
+    )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="Print a per-phase startup timeline once the first frame is shown",
+    )
 
     return parser.parse_args(args)
 
@@ -73,6 +272,72 @@ def setup_logging(loglevel):
     )
 
 
+def _connect_mqtt(args):
+    from fimav.mqtt.mqtt_manager import MqttManager
+
+    # Connects in the background, the MIDI messages wait in its queue
+    return MqttManager(
+        args.mqtt_host, args.mqtt_port, args.mqtt_user, args.mqtt_password
+    )
+
+
+def _create_midi(mqtt_manager, lookahead):
+    from fimav.midi.midi_controller import MidiController
+
+    midi_controller = MidiController(mqtt_manager, lookahead=lookahead)
+    if lookahead > 0:
+        from fimav.mqtt.clock_sync import ClockServer
+
+        ClockServer(mqtt_manager, midi_controller.shared_time)
+    return midi_controller
+
+
+def _create_model_bank(processing):
+    return processing["model_bank"].ModelBank()
+
+
+def _load_model(processing, bank, model_paths, part):
+    """Load the ``face`` or ``emotion`` net with the options fimav-autotune chose."""
+    tuning = processing["tuning"].load_tuning(
+        bank.store, model_paths["face_bin"], model_paths["emo_bin"]
+    )
+    prefix = "face" if part == "face" else "emo"
+    return bank.get_net(
+        model_paths[f"{prefix}_param"],
+        model_paths[f"{prefix}_bin"],
+        (tuning or {}).get(part),
+    )
+
+
+def _create_buffer_pool(processing, size):
+    if size <= 0:
+        return None
+    return processing["buffer_pool"].BufferPool(size)
+
+
+def _open_camera(processing, camera_index, args, face_size, pool=None):
+    video_capture = processing["video_capture"].VideoCapture(
+        camera_index,
+        args.camera_width,
+        args.camera_height,
+        face_size,
+        args.decoder,
+        args.detection_branch,
+        args.pixel_format,
+    )
+    video_capture.buffer_pool = pool
+    video_capture.start_capture()
+    return video_capture
+
+
+def _prerender_overlays(gui):
+    return gui.render_overlays()
+
+
+def _import_modules(*names):
+    return {name.rsplit(".", 1)[-1]: importlib.import_module(name) for name in names}
+
+
 def main(args):
     args = parse_args(args)
     setup_logging(args.loglevel)
@@ -82,36 +347,220 @@ def main(args):
     face_size = (320, 240)
     print(f"Initial display size: {width}x{height}")
 
-    mqtt_manager = MqttManager()
-    midi_controller = MidiController(mqtt_manager)
+    # Installed first so every thread gets its role's settings when started
+    policy = None
+    if args.thread_policy:
+        policy = thread_policy.ThreadPolicy.load(args.thread_policy)
+        thread_policy.install(policy)
 
-    # Create and initialize the VideoCapture instance
-    VideoCapture(
-        args.camera_index,
-        args.camera_width,
-        args.camera_height,
+    model_paths = {
+        "face_param": "models/face/ultraface_12.param",
+        "face_bin": "models/face/ultraface_12.bin",
+        "emo_param": "models/emotion/emotion_ferplus_12.param",
+        "emo_bin": "models/emotion/emotion_ferplus_12.bin",
+    }
+
+    profiler = None
+    if args.profile:
+        from fimav.sampling_profiler import SamplingProfiler
+
+        profiler = SamplingProfiler(
+            args.profile,
+            args.profile_interval,
+            args.profile_duration or SamplingProfiler.DURATION,
+        )
+        profiler.install_signal()
+        if args.profile_duration > 0:
+            profiler.start()
+
+    # Everything that does not need Tk starts in parallel: imports, MQTT,
+    # model loading, camera opening and overlay rendering
+    startup = StartupOrchestrator()
+    timeline = startup.timeline
+    startup.submit(
+        "import processing",
+        lambda: _import_modules(
+            "fimav.processing.buffer_pool",
+            "fimav.processing.emotion_cache",
+            "fimav.processing.face_quality",
+            "fimav.processing.model_bank",
+            "fimav.processing.model_swap",
+            "fimav.processing.motion_gate",
+            "fimav.processing.video_capture",
+            "fimav.processing.pipeline",
+            "fimav.processing.session_recorder",
+            "fimav.processing.tuning",
+        ),
+    )
+    startup.submit(
+        "import gui", lambda: importlib.import_module("fimav.gui.main_window")
     )
+    startup.submit("mqtt connect", lambda: _connect_mqtt(args))
+    startup.submit(
+        "midi",
+        lambda mqtt_manager: _create_midi(mqtt_manager, args.midi_lookahead),
+        "mqtt connect",
+    )
+    startup.submit("model bank", _create_model_bank, "import processing")
+    for part in ("face", "emotion"):
+        startup.submit(
+            f"load {part} model",
+            lambda processing, bank, part=part: _load_model(
+                processing, bank, model_paths, part
+            ),
+            "import processing",
+            "model bank",
+        )
+    startup.submit(
+        "buffer pool",
+        lambda processing: _create_buffer_pool(processing, args.buffer_pool_size),
+        "import processing",
+    )
+    for camera_index in args.camera_index:
+        startup.submit(
+            f"open camera{camera_index}",
+            lambda processing, pool, idx=camera_index: _open_camera(
+                processing, idx, args, face_size, pool
+            ),
+            "import processing",
+            "buffer pool",
+        )
+    startup.submit("render overlays", _prerender_overlays, "import gui")
 
-    # Create and initialize the EmotionStateController
-    EmotionStateController(midi_controller)
+    # Tk must live on the main thread
+    with timeline.phase("tk init"):
+        import tkinter as tk
 
-    # Create the FaceEmotionDetector instance
-    FaceEmotionDetector(
-        width,
-        height,
-        "models/face/ultraface_12.param",
-        "models/face/ultraface_12.bin",
-        "models/emotion/emotion_ferplus_12.param",
-        "models/emotion/emotion_ferplus_12.bin",
-        face_size,
+        root = tk.Tk()
+
+    processing = startup.result("import processing")
+    model_bank = startup.result("model bank")
+    midi_controller = startup.result("midi")
+    startup.result("load face model")
+    startup.result("load emotion model")
+
+    # The first camera is read by the display loop, the others by their own
+    # capture thread
+    with timeline.phase("pipelines"):
+        Pipeline = processing["pipeline"].Pipeline
+        pipelines = [
+            Pipeline.from_capture(
+                f"camera{camera_index}",
+                startup.result(f"open camera{camera_index}"),
+                model_bank,
+                midi_controller,
+                face_size,
+                capture_thread=i > 0,
+                **model_paths,
+            )
+            for i, camera_index in enumerate(args.camera_index)
+        ]
+        if args.motion_refresh > 0:
+            for pipeline in pipelines:
+                pipeline.detector.motion_gate = processing["motion_gate"].MotionGate(
+                    refresh_interval=args.motion_refresh
+                )
+        if args.emotion_cache_ttl > 0:
+            for pipeline in pipelines:
+                pipeline.detector.emotion_cache = processing[
+                    "emotion_cache"
+                ].EmotionCache(ttl=args.emotion_cache_ttl)
+        if args.face_quality:
+            for pipeline in pipelines:
+                pipeline.detector.face_quality = processing["face_quality"].FaceQuality(
+                    min_size=args.min_face_size,
+                    aspect_range=tuple(args.face_aspect),
+                    min_score=args.min_face_score,
+                    min_sharpness=args.min_face_sharpness,
+                )
+        tracer = None
+        if args.trace:
+            from fimav.tracing import Tracer
+
+            tracer = Tracer()
+            for pipeline in pipelines:
+                pipeline.detector.tracer = tracer
+        group = processing["pipeline"].PipelineGroup(
+            pipelines,
+            args.scheduling,
+            args.workers,
+            args.report_interval,
+            max_wait=args.max_wait,
+        )
+        group.start()
+
+    # Models can be replaced live with fimav-swap-model
+    from fimav.mqtt.model_commands import ModelCommandServer
+
+    swapper = processing["model_swap"].ModelSwapper(
+        model_bank, [pipeline.detector for pipeline in pipelines]
     )
+    ModelCommandServer(startup.result("mqtt connect"), swapper)
+
+    from fimav.memory_monitor import MemoryMonitor
+
+    memory_monitor = MemoryMonitor(startup.result("buffer pool"), args.tracemalloc)
+    memory_monitor.start(args.memory_report)
+    memory_monitor.install_signal()
+
+    recorder = None
+    if args.record:
+        recorder = processing["session_recorder"].SessionRecorder(args.record)
+        recorder.attach(pipelines[0])
 
     # Instantiate and run the Tkinter MainWindow
-    root = tk.Tk()
-    window = MainWindow(root, face_size, width, height)
+    gui = startup.result("import gui")
+    with timeline.phase("window"):
+        window = gui.MainWindow(
+            root, pipelines[0], width, height, startup.result("render overlays")
+        )
+        window.box_lead = args.box_lead
+        window.pacer = gui.FramePacer(args.display_fps)
+    startup.shutdown()
+
+    def on_first_frame():
+        timeline.mark("first frame")
+        if args.startup_report:
+            print(timeline.format_report())
+
+    window.on_first_frame = on_first_frame
     window.start()
     root.mainloop()
 
+    group.stop()
+    if profiler is not None:
+        profiler.stop()
+    if recorder is not None:
+        recorder.stop()
+    midi_controller.close()
+    mqtt_manager = startup.result("mqtt connect")
+    mqtt_manager.close()
+    _logger.info(window.pacer.format_report())
+    _logger.info(group.format_report())
+    _logger.info(swapper.format_report())
+    _logger.info(mqtt_manager.format_report())
+    switch_latency = midi_controller.switch_latency()
+    if switch_latency is not None:
+        _logger.info(
+            "MIDI song switch latency: p50 %.2f ms, max %.2f ms",
+            switch_latency["p50_ms"],
+            switch_latency["max_ms"],
+        )
+    timing_jitter = midi_controller.timing_jitter()
+    if timing_jitter is not None:
+        _logger.info(
+            "MIDI send lateness: p50 %.2f ms, p95 %.2f ms, max %.2f ms",
+            timing_jitter["p50_ms"],
+            timing_jitter["p95_ms"],
+            timing_jitter["max_ms"],
+        )
+    if policy is not None:
+        _logger.info(policy.format_report())
+    if tracer is not None:
+        tracer.export(args.trace)
+        _logger.info(tracer.format_report())
+    _logger.info(memory_monitor.format_report())
+    memory_monitor.stop()
     _logger.info("Script ends here")
 
 
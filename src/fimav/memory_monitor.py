@@ -0,0 +1,127 @@
+import os
+import signal
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def rss_bytes():
+    """Return the resident set size of this process, None if unknown.
+
+    Falls back to the peak RSS where ``/proc`` is missing.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class MemoryMonitor:
+    """Reports RSS, buffer pool use and the top Python allocators.
+
+    With ``tracemalloc_frames`` > 0, ``tracemalloc`` records that many frames
+    per allocation and each report lists the lines whose allocations grew
+    the most since the previous report, which is where the hot loops still
+    churn. Tracing slows allocations down, so it is off by default.
+    """
+
+    def __init__(self, pool=None, tracemalloc_frames=0, top=10):
+        self.pool = pool
+        self.tracemalloc_frames = tracemalloc_frames
+        self.top = top
+        self.start_rss = None
+        self._snapshot = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, interval=0):
+        """Start tracing, and a report every ``interval`` seconds if > 0."""
+        self.start_rss = rss_bytes()
+        if self.tracemalloc_frames > 0:
+            tracemalloc.start(self.tracemalloc_frames)
+            self._snapshot = self._take_snapshot()
+        if interval > 0:
+            self._thread = threading.Thread(
+                target=self._report_loop,
+                args=(interval,),
+                name="memory-report",
+                daemon=True,
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def install_signal(self, signum=getattr(signal, "SIGUSR2", None)):
+        """Print a report whenever the process receives ``signum``."""
+        if signum is None:
+            return False
+        signal.signal(signum, lambda *_: print(self.format_report()))
+        return True
+
+    def _report_loop(self, interval):
+        while not self._stop_event.wait(interval):
+            print(self.format_report())
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ]
+        )
+
+    def top_allocators(self):
+        """Return the lines whose allocations grew most since the last call.
+
+        Each entry is ``(location, size_diff, count_diff)``; empty when
+        tracemalloc is off.
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self._snapshot, "lineno")
+        self._snapshot = snapshot
+        return [
+            (str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+            for stat in stats[: self.top]
+        ]
+
+    def format_report(self):
+        lines = ["Memory:"]
+        rss = rss_bytes()
+        if rss is not None:
+            line = f"  RSS {rss / 1e6:.1f} MB"
+            if self.start_rss is not None:
+                line += f" ({(rss - self.start_rss) / 1e6:+.1f} MB since start)"
+            lines.append(line)
+        if self.pool is not None:
+            lines.append("  " + self.pool.format_report())
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(
+                f"  traced {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB),"
+                " top allocators since the last report:"
+            )
+            for location, size_diff, count_diff in self.top_allocators():
+                lines.append(
+                    f"    {size_diff / 1e3:+10.1f} kB {count_diff:+7d} blocks"
+                    f"  {location}"
+                )
+        return "\n".join(lines)
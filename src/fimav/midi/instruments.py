@@ -0,0 +1,101 @@
+import json
+import re
+from mido import MidiFile, tick2second
+
+INSTRUMENTS_NAME = "instruments.json"
+# Subtopics of the orchestra topic used by fimav itself (control, clock sync)
+RESERVED_NAMES = ("control", "clock")
+
+
+def topic_segment(name):
+    """Return ``name`` as a single MQTT topic level, None when nothing is left.
+
+    Wildcards (``+``, ``#``), separators and other unusual characters become
+    ``_``, and the reserved subtopics get a ``_`` appended, so any track
+    name can be published to.
+    """
+    segment = re.sub(r"[^\w.-]", "_", str(name).strip()).strip("_")
+    if not segment:
+        return None
+    if segment.lower() in RESERVED_NAMES:
+        segment += "_"
+    return segment
+
+
+class InstrumentMap:
+    """Assigns the messages of a song to the instrument that plays them.
+
+    ``split`` is ``channel`` (one part per MIDI channel), ``track`` (one
+    part per track) or ``none`` (everything on the main topic).
+    ``instruments`` maps a channel number or a track name/number to the
+    instrument name used in the topic; unmapped parts are named
+    ``channel<N>`` or after their track. Several channels may map to the same
+    instrument. Names are made safe topic levels by :func:`topic_segment`.
+    Messages without a channel (sysex...) stay on the main topic.
+    """
+
+    SPLITS = ("channel", "track", "none")
+
+    def __init__(self, split="channel", instruments=None):
+        if split not in self.SPLITS:
+            raise ValueError(f"Unknown split: {split}")
+        self.split = split
+        self.instruments = {str(k): v for k, v in (instruments or {}).items()}
+
+    @classmethod
+    def load(cls, path):
+        """Read a map from ``path``, the default map if there is no file."""
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except OSError:
+            return cls()
+        return cls(config.get("split", "channel"), config.get("instruments"))
+
+    def instrument(self, message, track_index, track_name):
+        if self.split == "none" or not hasattr(message, "channel"):
+            return None
+        if self.split == "channel":
+            key = str(message.channel)
+            return topic_segment(self.instruments.get(key, f"channel{key}"))
+        for key in (track_name, str(track_index)):
+            if key in self.instruments:
+                return topic_segment(self.instruments[key])
+        return topic_segment(track_name) or f"track{track_index}"
+
+    def split_song(self, file_path):
+        """Return the song as ``(delta_seconds, message, instrument)`` events.
+
+        Tracks are merged on their absolute tick, as ``MidiFile`` playback
+        does, keeping the track each message came from.
+        """
+        midi_file = MidiFile(file_path)
+        timeline = []
+        for track_index, track in enumerate(midi_file.tracks):
+            # Track.name scans the track, read it once
+            track_name = track.name
+            tick = 0
+            for order, message in enumerate(track):
+                tick += message.time
+                timeline.append((tick, track_index, order, message, track_name))
+        timeline.sort(key=lambda event: event[:3])
+
+        events = []
+        tempo = 500000
+        last_tick = 0
+        pending = 0.0
+        for tick, track_index, _, message, track_name in timeline:
+            delta = 0
+            if tick > last_tick:
+                delta = tick2second(tick - last_tick, midi_file.ticks_per_beat, tempo)
+            pending += delta
+            last_tick = tick
+            if message.is_meta:
+                if message.type == "set_tempo":
+                    tempo = message.tempo
+                continue
+            instrument = self.instrument(message, track_index, track_name)
+            # Messages carry the same time as in mido playback
+            events.append((pending, message.copy(time=delta), instrument))
+            pending = 0.0
+        return events
@@ -1,50 +1,315 @@
-from mido import MidiFile
+from mido import Message
+import collections
+import itertools
+import queue
 import threading
+import time
 import os
+from fimav import thread_policy
+from fimav.midi.instruments import INSTRUMENTS_NAME, InstrumentMap
+from fimav.midi.midi_library import MidiLibrary
+
+
+class _Voice:
+    """A song being played, with the due time of its next message."""
+
+    def __init__(self, file_path, events, start, fade_in=0.0, song=None):
+        self.file_path = file_path
+        self.song = song
+        self._events = iter(events)
+        self.due = start
+        self.next = None
+        self.instrument = None
+        self.fade_in = (start, start + fade_in) if fade_in > 0 else None
+        self.fade_out = None
+        # Instrument of each (channel, note) sounding, to silence them
+        self.sounding = {}
+        # FrameTrace of the frame that started the song, until its first message
+        self.trace = None
+        self.traced_from = None
+        self.advance()
+
+    def advance(self):
+        """Move to the next message, None once the song is over."""
+        for delta, message, instrument in self._events:
+            self.due += delta
+            self.next = message
+            self.instrument = instrument
+            return
+        self.next = None
+
+    def wake_time(self):
+        """Return when the transport has to act next for this voice."""
+        if self.fade_out is not None:
+            return min(self.due, self.fade_out[1])
+        return self.due
+
+    def gain(self, now):
+        gain = 1.0
+        for fade, rising in ((self.fade_in, True), (self.fade_out, False)):
+            if fade is None:
+                continue
+            start, end = fade
+            progress = min(max((now - start) / (end - start), 0.0), 1.0)
+            gain *= progress if rising else 1.0 - progress
+        return gain
 
 
 class MidiController:
-    def __init__(self, mqtt_manager):
+    """Plays MIDI files to MQTT from a single long-lived transport thread.
+
+    Callers only queue a command (play, crossfade, stop), which returns
+    immediately. The transport waits for the next message of each playing
+    song with a timed ``get`` on the command queue, so a new command is
+    handled as soon as it arrives instead of after the current rest.
+
+    Each message is published to the topic of its instrument, as given by
+    ``instruments`` (by default ``midi/instruments.json``). Songs are split
+    once and the last ``cached_songs`` splits are kept.
+
+    With a ``lookahead`` (seconds), messages are published that much ahead
+    of time with their play-at time on the shared clock (``shared_time``),
+    so the receivers absorb the broker and network jitter. Stopping a song
+    then sends a cancel command for the events already published.
+    """
+
+    def __init__(
+        self,
+        mqtt_manager,
+        midi_dir="midi",
+        library=None,
+        instruments=None,
+        cached_songs=32,
+        lookahead=0.0,
+    ):
         self.mqtt_manager = mqtt_manager
-        self.midi_thread = None
-        self._stop_event = threading.Event()
-        self.lock = threading.Lock()
+        self.lookahead = lookahead
+        self._wall_offset = time.time() - time.perf_counter()
+        self._song_ids = itertools.count()
+        self.midi_dir = midi_dir
+        self.library = library or MidiLibrary(midi_dir)
+        self.instruments = instruments or InstrumentMap.load(
+            os.path.join(midi_dir, INSTRUMENTS_NAME)
+        )
+        self.cached_songs = cached_songs
+        self._songs = collections.OrderedDict()
+        self._commands = queue.Queue()
+        self._pending = 0
+        self._playing = False
+        self._lock = threading.Lock()
+
+        # Seconds from a play/crossfade call to the new song taking over
+        self.switch_latencies = collections.deque(maxlen=100)
+        # Seconds the transport sent each message after its send time
+        self.send_lateness = collections.deque(maxlen=2000)
 
-    def play_midi_file(self, midi_file_name):
-        file_path = f"midi/{midi_file_name}"
+        self.transport_thread = threading.Thread(
+            target=self._transport_loop, name="midi-transport", daemon=True
+        )
+        self.transport_thread.start()
+        thread_policy.register(self.transport_thread, "midi")
+
+    def _file_path(self, midi_file_name):
+        file_path = self.library.path(midi_file_name)
+        if file_path is not None:
+            return file_path
+        file_path = os.path.join(self.midi_dir, midi_file_name)
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
+        return file_path
 
-        with self.lock:
-            # Stop current thread if it's playing
-            self._stop_event.set()
-            if self.midi_thread and self.midi_thread.is_alive():
-                self.midi_thread.join()
-
-            # Clear stop flag and start new playback
-            self._stop_event.clear()
-            self.midi_thread = threading.Thread(
-                target=self._play_midi_file, args=(file_path,), daemon=True
-            )
-            self.midi_thread.start()
-
-    def _play_midi_file(self, file_path):
-        print(f"Playing MIDI: {file_path}")
-        try:
-            midi_file = MidiFile(file_path)
-            for message in midi_file.play():
-                if self._stop_event.is_set():
-                    print("Playback interrupted.")
-                    break
-                self.mqtt_manager.send_midi(message)
-        finally:
-            print("Playback finished or stopped.")
+    def _send_command(self, *command):
+        with self._lock:
+            self._pending += 1
+        self._commands.put((time.perf_counter(),) + command)
+
+    def play_midi_file(self, midi_file_name, trace=None):
+        """Stop the current song and play ``midi_file_name`` instead.
+
+        ``trace``, the ``FrameTrace`` of the frame behind the song, follows the
+        command up to the first message published.
+        """
+        self._send_command("play", self._file_path(midi_file_name), 0.0, trace)
+
+    def crossfade(self, midi_file_name, duration=2.0, trace=None):
+        """Fade the current song out while ``midi_file_name`` fades in."""
+        self._send_command("play", self._file_path(midi_file_name), duration, trace)
 
     def stop(self):
-        with self.lock:
-            self._stop_event.set()
-            if self.midi_thread and self.midi_thread.is_alive():
-                self.midi_thread.join()
-                
+        self._send_command("stop")
+
+    def close(self):
+        """Silence the current song and end the transport thread."""
+        self._send_command("quit")
+        self.transport_thread.join()
+
+    def shared_time(self):
+        """Return the time of the clock the play-at times refer to."""
+        return time.perf_counter() + self._wall_offset
+
     def is_playing(self):
-        return self.midi_thread and self.midi_thread.is_alive()
+        with self._lock:
+            return self._playing or self._pending > 0
+
+    def switch_latency(self):
+        """Return the median and worst song switch latency, in milliseconds."""
+        latencies = sorted(self.switch_latencies)
+        if not latencies:
+            return None
+        return {
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+
+    def timing_jitter(self):
+        """Return the median, 95th percentile and worst send lateness, in ms."""
+        lateness = sorted(self.send_lateness)
+        if not lateness:
+            return None
+        return {
+            "p50_ms": lateness[len(lateness) // 2] * 1000,
+            "p95_ms": lateness[int(len(lateness) * 0.95)] * 1000,
+            "max_ms": lateness[-1] * 1000,
+        }
+
+    def _transport_loop(self):
+        voices = []
+        while True:
+            timeout = None
+            if voices:
+                due = min(voice.wake_time() for voice in voices) - self.lookahead
+                timeout = max(0.0, due - time.perf_counter())
+            try:
+                command = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                command = None
+
+            if command is not None:
+                voices = self._handle(command, voices)
+                if voices is None:
+                    return
+            else:
+                voices = self._send_due(voices, time.perf_counter())
+
+            with self._lock:
+                self._playing = bool(voices)
+
+    def _handle(self, command, voices):
+        """Apply ``command``, return the voices left playing (None to quit)."""
+        issued, name, *args = command
+        try:
+            if name == "play":
+                file_path, fade, trace = args
+                now = time.perf_counter()
+                try:
+                    voice = _Voice(
+                        file_path,
+                        self._split(file_path),
+                        now + self.lookahead,
+                        fade,
+                        next(self._song_ids),
+                    )
+                except (OSError, ValueError, EOFError) as e:
+                    print(f"Could not read MIDI file {file_path}: {e}")
+                    return voices
+                if fade > 0:
+                    for old in voices:
+                        start = now + self.lookahead
+                        old.fade_out = (start, start + fade)
+                else:
+                    for old in voices:
+                        self._silence(old)
+                    voices = []
+                print(f"Playing MIDI: {file_path}")
+                self.switch_latencies.append(time.perf_counter() - issued)
+                if trace is not None:
+                    handled = time.monotonic()
+                    queued = handled - (time.perf_counter() - issued)
+                    trace.stage("midi command", queued, handled)
+                    voice.trace, voice.traced_from = trace, handled
+                return voices + [voice]
+
+            for voice in voices:
+                self._silence(voice)
+            if name == "quit":
+                return None
+            print("Playback interrupted.")
+            return []
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _split(self, file_path):
+        """Return the events of a song split by instrument, from the cache."""
+        mtime = os.stat(file_path).st_mtime_ns
+        cached = self._songs.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            self._songs.move_to_end(file_path)
+            return cached[1]
+        events = self.instruments.split_song(file_path)
+        self._songs[file_path] = (mtime, events)
+        while len(self._songs) > self.cached_songs:
+            self._songs.popitem(last=False)
+        return events
+
+    def _send_due(self, voices, now):
+        horizon = now + self.lookahead
+        playing = []
+        for voice in voices:
+            end = horizon
+            if voice.fade_out is not None:
+                end = min(end, voice.fade_out[1])
+            while voice.next is not None and voice.due <= end:
+                lateness = time.perf_counter() - (voice.due - self.lookahead)
+                self.send_lateness.append(lateness)
+                gain = voice.gain(voice.due)
+                self._send(voice, voice.next, voice.instrument, gain, voice.due)
+                voice.advance()
+            if voice.fade_out is not None and horizon >= voice.fade_out[1]:
+                # Faded out
+                self._silence(voice, voice.fade_out[1])
+            elif voice.next is None:
+                print("Playback finished or stopped.")
+                self._silence(voice, voice.due)
+            else:
+                playing.append(voice)
+        return playing
+
+    def _send(self, voice, message, instrument, gain=1.0, due=None):
+        if message.type == "note_on" and message.velocity > 0:
+            velocity = int(message.velocity * gain)
+            if velocity == 0:
+                return
+            message = message.copy(velocity=velocity)
+            voice.sounding[(message.channel, message.note)] = instrument
+        elif message.type in ("note_on", "note_off"):
+            if voice.sounding.pop((message.channel, message.note), False) is False:
+                return
+        trace, voice.trace = voice.trace, None
+        if trace is not None:
+            trace.stage("midi transport", voice.traced_from)
+        try:
+            if self.lookahead > 0:
+                play_at = (
+                    time.perf_counter() if due is None else due
+                ) + self._wall_offset
+                self.mqtt_manager.send_midi(
+                    message, instrument, play_at=play_at, song=voice.song, trace=trace
+                )
+            else:
+                self.mqtt_manager.send_midi(message, instrument, trace=trace)
+        except Exception as e:
+            print(f"Could not send MIDI message: {e}")
+
+    def _silence(self, voice, at=None):
+        """End ``voice`` at ``at``, now by default, releasing its notes."""
+        if at is None and self.lookahead > 0:
+            # Drop the events the receivers already have for later
+            try:
+                self.mqtt_manager.send_control({"cancel": voice.song})
+            except Exception as e:
+                print(f"Could not send MIDI message: {e}")
+        for (channel, note), instrument in sorted(voice.sounding.items()):
+            message = Message("note_off", channel=channel, note=note)
+            self._send(voice, message, instrument, due=at)
+        voice.next = None
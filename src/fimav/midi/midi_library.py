@@ -0,0 +1,182 @@
+import json
+import os
+import random
+from mido import MidiFile, tempo2bpm
+from fimav.cache import cache_dir
+
+# Order of the emotion net outputs (see FaceEmotionDetector.emotion_labels)
+EMOTIONS = [
+    "neutre",
+    "heureuse",
+    "surprenante",
+    "triste",
+    "enrageante",
+    "dégoutante",
+    "apeurante",
+    "méprisante",
+]
+
+# Other folder and manifest names accepted for each emotion
+EMOTION_ALIASES = {
+    "neutral": 0,
+    "happy": 1,
+    "happiness": 1,
+    "surprise": 2,
+    "sad": 3,
+    "sadness": 3,
+    "anger": 4,
+    "angry": 4,
+    "disgust": 5,
+    "fear": 6,
+    "contempt": 7,
+}
+
+MANIFEST_NAME = "manifest.json"
+
+
+def emotion_index(name):
+    """Return the emotion index of a folder or manifest tag, None if unknown."""
+    name = str(name).strip().lower()
+    if name in EMOTIONS:
+        return EMOTIONS.index(name)
+    if name.isdigit() and int(name) < len(EMOTIONS):
+        return int(name)
+    return EMOTION_ALIASES.get(name)
+
+
+def read_metadata(path):
+    """Return the duration, tempo, track, channel and event counts of a file."""
+    midi_file = MidiFile(path)
+    tempo = None
+    channels = set()
+    events = 0
+    for track in midi_file.tracks:
+        for message in track:
+            if message.is_meta:
+                if message.type == "set_tempo" and tempo is None:
+                    tempo = message.tempo
+                continue
+            events += 1
+            if hasattr(message, "channel"):
+                channels.add(message.channel)
+    return {
+        "duration": midi_file.length,
+        "bpm": tempo2bpm(tempo or 500000),
+        "tracks": len(midi_file.tracks),
+        "channels": len(channels),
+        "events": events,
+    }
+
+
+class MidiLibrary:
+    """Index of the MIDI files of ``midi_dir`` and of their emotions.
+
+    Files are found recursively. A file is tagged with the emotion named by
+    any folder on its path (``midi/heureuse/valse.mid``, ``midi/sad/...``) and
+    with the tags listed for it in ``manifest.json`` at the library root::
+
+        {"Test.mid": ["heureuse", "triste"]}
+
+    The metadata of every file is cached with its size and mtime, so only new
+    or modified files are parsed when the library is scanned again.
+    """
+
+    def __init__(self, midi_dir="midi", cache_path=None):
+        self.midi_dir = midi_dir
+        self.cache_path = cache_path or os.path.join(cache_dir(), "midi_index.json")
+        self.songs = {}
+        self._by_emotion = [[] for _ in EMOTIONS]
+        self.scan()
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.midi_dir, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except OSError:
+            return {}
+        except ValueError as e:
+            print(f"Invalid MIDI manifest: {e}")
+            return {}
+        return {os.path.normpath(name): tags for name, tags in manifest.items()}
+
+    def scan(self):
+        """Index the library, parsing only files changed since the last scan."""
+        cache = self._read_cache()
+        manifest = self._read_manifest()
+        songs = {}
+        changed = False
+
+        for root, dirs, files in os.walk(self.midi_dir):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.lower().endswith((".mid", ".midi")):
+                    continue
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, self.midi_dir)
+                stat = os.stat(path)
+                key = os.path.abspath(path)
+
+                entry = cache.get(key)
+                if (
+                    entry is None
+                    or entry["size"] != stat.st_size
+                    or entry["mtime_ns"] != stat.st_mtime_ns
+                ):
+                    try:
+                        metadata = read_metadata(path)
+                    except (OSError, ValueError, EOFError) as e:
+                        print(f"Skipping unreadable MIDI file {path}: {e}")
+                        continue
+                    entry = dict(metadata, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    cache[key] = entry
+                    changed = True
+
+                tags = os.path.dirname(name).split(os.sep) + list(
+                    manifest.get(name, [])
+                )
+                emotions = sorted(
+                    {i for i in map(emotion_index, tags) if i is not None}
+                )
+                songs[name] = dict(entry, path=path, emotions=emotions)
+
+        if changed:
+            self._write_cache(cache)
+
+        by_emotion = [[] for _ in EMOTIONS]
+        for name, song in songs.items():
+            for emotion in song["emotions"]:
+                by_emotion[emotion].append(name)
+        self.songs = songs
+        self._by_emotion = by_emotion
+        return songs
+
+    def songs_for(self, emotion_idx):
+        return self._by_emotion[emotion_idx]
+
+    def choose(self, emotion_idx):
+        """Return a random song tagged ``emotion_idx``, None when there is none."""
+        if emotion_idx is None or not 0 <= emotion_idx < len(EMOTIONS):
+            return None
+        songs = self._by_emotion[emotion_idx]
+        return random.choice(songs) if songs else None
+
+    def path(self, name):
+        """Return the path of an indexed song, None if it is not indexed."""
+        song = self.songs.get(name)
+        return song["path"] if song is not None else None
@@ -0,0 +1,71 @@
+import collections
+import itertools
+import json
+import time
+from fimav.mqtt.mqtt_manager import CLOCK_REPLY_TOPIC, CLOCK_REQUEST_TOPIC
+
+
+class ClockServer:
+    """Answers the clock requests of the receivers with this host's time.
+
+    Runs next to the ``MidiController`` so the play-at timestamps it sends
+    and the clock the receivers align on are the same.
+    """
+
+    def __init__(self, mqtt_manager, clock=time.time):
+        self.mqtt_manager = mqtt_manager
+        self.clock = clock
+        mqtt_manager.subscribe(CLOCK_REQUEST_TOPIC, self._on_request)
+
+    def _on_request(self, topic, payload):
+        try:
+            request = json.loads(payload)
+            reply = {"id": request["id"], "t0": request["t0"], "t1": self.clock()}
+            node = request["node"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self.mqtt_manager.publish(f"{CLOCK_REPLY_TOPIC}/{node}", json.dumps(reply))
+
+
+class ClockSync:
+    """Estimates the offset of the shared clock from request/reply exchanges.
+
+    For each exchange, with ``t0``/``t3`` the local send/receive times and
+    ``t1`` the server time, the offset is ``t1 - (t0 + t3) / 2``, assuming the
+    same delay both ways. The estimate comes from the exchange with the
+    shortest round trip among the last ``samples``, the least disturbed by
+    queueing in the broker.
+    """
+
+    def __init__(self, publish, node, clock=time.time, samples=8):
+        self.publish = publish
+        self.node = node
+        self.clock = clock
+        self.reply_topic = f"{CLOCK_REPLY_TOPIC}/{node}"
+        self._samples = collections.deque(maxlen=samples)
+        self._ids = itertools.count()
+        self.offset = 0.0
+        self.round_trip = None
+
+    def request(self):
+        """Send one clock request, the reply arrives on ``reply_topic``."""
+        request = {"id": next(self._ids), "node": self.node, "t0": self.clock()}
+        self.publish(CLOCK_REQUEST_TOPIC, json.dumps(request))
+
+    def on_reply(self, payload):
+        t3 = self.clock()
+        try:
+            reply = json.loads(payload)
+            t0, t1 = reply["t0"], reply["t1"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self._samples.append((t3 - t0, t1 - (t0 + t3) / 2))
+        self.round_trip, self.offset = min(self._samples)
+
+    @property
+    def synced(self):
+        return self.round_trip is not None
+
+    def now(self):
+        """Return the current time of the shared clock."""
+        return self.clock() + self.offset
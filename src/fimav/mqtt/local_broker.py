@@ -0,0 +1,241 @@
+import collections
+import socket
+import struct
+import threading
+import time
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter, topic):
+    """Return True when ``topic`` matches ``topic_filter`` (``+``/``#``)."""
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _read_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("client closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+def _read_packet(sock):
+    header = _read_exact(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header >> 4, header & 0x0F, _read_exact(sock, length)
+
+
+class _Session:
+    """A connected client, with its subscriptions and delayed send queue."""
+
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.filters = set()
+        self._outgoing = collections.deque()
+        self._last_delivery = 0.0
+        self._ready = threading.Condition()
+        self.closed = False
+
+    def send(self, data, delay=0.0):
+        """Queue ``data``, keeping the order of the packets whatever the delay."""
+        with self._ready:
+            deliver_at = max(time.monotonic() + delay, self._last_delivery)
+            self._last_delivery = deliver_at
+            self._outgoing.append((deliver_at, data))
+            self._ready.notify()
+
+    def sender_loop(self):
+        while True:
+            with self._ready:
+                while not self._outgoing and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    return
+                deliver_at, data = self._outgoing[0]
+                wait = deliver_at - time.monotonic()
+                if wait > 0:
+                    self._ready.wait(wait)
+                    continue
+                self._outgoing.popleft()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                return
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class LocalBroker:
+    """Minimal in-process MQTT 3.1.1 broker standing in for mosquitto.
+
+    Enough for benchmarks and tests on localhost: connect (credentials are
+    not checked), publish at QoS 0 to 2, subscribe/unsubscribe with
+    wildcards and ping. Messages are always delivered at QoS 0 and retained
+    messages are not kept. ``delay``, when given, is called for every
+    delivered message and returns the extra seconds to hold it, to simulate
+    network jitter; a client still gets its messages in order.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=None):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self.host, self.port = self._server.getsockname()
+        self.delay = delay
+
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.published = 0
+        self.delivered = 0
+
+    def start(self):
+        self._server.listen()
+        self._thread = threading.Thread(
+            target=self._accept_loop, name="mqtt-broker", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock)
+            with self._lock:
+                self._sessions.append(session)
+            threading.Thread(target=session.sender_loop, daemon=True).start()
+            threading.Thread(
+                target=self._client_loop, args=(session,), daemon=True
+            ).start()
+
+    def _client_loop(self, session):
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(session.sock)
+                if packet_type == DISCONNECT:
+                    break
+                self._handle(session, packet_type, flags, body)
+        except (ConnectionError, OSError, struct.error, UnicodeDecodeError):
+            pass
+        finally:
+            with self._lock:
+                if session in self._sessions:
+                    self._sessions.remove(session)
+            session.close()
+
+    def _handle(self, session, packet_type, flags, body):
+        if packet_type == CONNECT:
+            session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            (topic_length,) = struct.unpack("!H", body[:2])
+            topic = body[2 : 2 + topic_length].decode()
+            offset = 2 + topic_length
+            if qos:
+                packet_id = body[offset : offset + 2]
+                offset += 2
+                session.send(_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id))
+            self.publish(topic, body[offset:])
+        elif packet_type == PUBREL:
+            session.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            while offset < len(body):
+                (length,) = struct.unpack("!H", body[offset : offset + 2])
+                topic_filter = body[offset + 2 : offset + 2 + length].decode()
+                with self._lock:
+                    session.filters.add(topic_filter)
+                offset += 2 + length + 1
+                granted.append(0)
+            session.send(_packet(SUBACK, 0, packet_id + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id, offset = body[:2], 2
+            while offset < len(body):
+                (length,) = struct.unpack("!H", body[offset : offset + 2])
+                topic_filter = body[offset + 2 : offset + 2 + length].decode()
+                with self._lock:
+                    session.filters.discard(topic_filter)
+                offset += 2 + length
+            session.send(_packet(UNSUBACK, 0, packet_id))
+        elif packet_type == PINGREQ:
+            session.send(_packet(PINGRESP, 0, b""))
+
+    def publish(self, topic, payload):
+        """Deliver ``payload`` to every client subscribed to ``topic``."""
+        encoded = topic.encode()
+        data = _packet(PUBLISH, 0, struct.pack("!H", len(encoded)) + encoded + payload)
+        with self._lock:
+            self.published += 1
+            sessions = [
+                s
+                for s in self._sessions
+                if any(topic_matches(f, topic) for f in s.filters)
+            ]
+            self.delivered += len(sessions)
+        for session in sessions:
+            session.send(data, self.delay() if self.delay else 0.0)
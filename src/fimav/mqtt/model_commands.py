@@ -0,0 +1,62 @@
+import json
+from fimav.mqtt.mqtt_manager import MODEL_COMMAND_TOPIC, MODEL_STATUS_TOPIC
+
+
+class ModelCommandServer:
+    """Runs the model commands received on ``MODEL_COMMAND_TOPIC``.
+
+    ``{"swap": "face", "param": ..., "bin": ...}`` swaps the face (or
+    ``emotion``) model with the ``ModelSwapper`` in the background, any
+    other command only asks for a report. Model paths are resolved on this
+    host by the ``ModelStore`` and refused unless they are inside one of its
+    model directories, so a client cannot load any file. Each command is
+    answered on ``MODEL_STATUS_TOPIC`` with its ``id``, the swap result if
+    any, and the latency of every model run so far, to compare models live.
+    """
+
+    def __init__(self, mqtt_manager, swapper):
+        self.mqtt_manager = mqtt_manager
+        self.swapper = swapper
+        mqtt_manager.subscribe(MODEL_COMMAND_TOPIC, self._on_command)
+
+    def _on_command(self, topic, payload):
+        try:
+            command = json.loads(payload)
+            command_id = command.get("id")
+        except (ValueError, AttributeError):
+            return
+        if "swap" not in command:
+            self._reply(command_id)
+            return
+        try:
+            part, param, bin_path = command["swap"], command["param"], command["bin"]
+        except KeyError as e:
+            self._reply(command_id, error=f"missing {e}")
+            return
+        store = self.swapper.bank.store
+        try:
+            param, bin_path = (
+                store.resolve_contained(param),
+                store.resolve_contained(bin_path),
+            )
+        except (OSError, TypeError, ValueError) as e:
+            self._reply(command_id, error=str(e))
+            return
+        self.swapper.swap(
+            part,
+            param,
+            bin_path,
+            callback=lambda part, model, error: self._reply(
+                command_id, part=part, model=model, error=error
+            ),
+        )
+
+    def _reply(self, command_id, **status):
+        status["id"] = command_id
+        status["latency"] = {
+            model: {"runs": runs, "median_ms": median, "p95_ms": p95}
+            for model, (runs, median, p95) in self.swapper.latency_stats().items()
+        }
+        self.mqtt_manager.publish(
+            MODEL_STATUS_TOPIC, json.dumps(status), droppable=False
+        )
@@ -1,30 +1,284 @@
+import collections
+import json
+import threading
+import time
+import numpy as np
 import paho.mqtt.client as mqtt
+from fimav import thread_policy
 
 """
-    Read MIDI files, 
+    Read MIDI files,
 """
 
+TOPIC = "fimav/orchestre"
+# Song cancellations for the receivers scheduling ahead
+CONTROL_TOPIC = f"{TOPIC}/control"
+# Clock synchronisation requests, answered on CLOCK_REPLY_TOPIC/<node>
+CLOCK_REQUEST_TOPIC = f"{TOPIC}/clock/request"
+CLOCK_REPLY_TOPIC = f"{TOPIC}/clock/reply"
+# Model swap commands and their results, outside the orchestra's topics
+MODEL_COMMAND_TOPIC = "fimav/models/command"
+MODEL_STATUS_TOPIC = "fimav/models/status"
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 1884
+DEFAULT_USERNAME = "orchestrateur"
+DEFAULT_PASSWORD = "Orchestrateur1234"
+
+
+def create_client(client_id=""):
+    """Return a paho client with the 1.x callback signatures on any paho."""
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id)
+    return mqtt.Client(client_id=client_id)
+
+
+def is_release(msg):
+    """Return True for the messages ending a note, which are never dropped."""
+    return msg.type == "note_off" or (msg.type == "note_on" and msg.velocity == 0)
+
+
 class MqttManager:
-    """Simple class to manage MQTT communication."""
+    """Simple class to manage MQTT communication.
+
+    Connects in the background and reconnects with an exponential backoff
+    (``min_backoff`` doubling up to ``max_backoff`` seconds), so neither a
+    missing broker at startup nor an outage blocks the callers. Outgoing
+    messages go through a queue of at most ``max_queue`` messages, published
+    by a sender thread while connected. When the queue is full the oldest
+    note-on or other droppable message makes room, and a droppable message
+    older than ``stale_after`` seconds when its turn comes is discarded;
+    note-offs and control commands are always kept, so no note hangs, and
+    ``close`` sends them before disconnecting.
+    """
 
-    def __init__(self):
+    def __init__(
+        self,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        username=DEFAULT_USERNAME,
+        password=DEFAULT_PASSWORD,
+        max_queue=1024,
+        stale_after=0.5,
+        min_backoff=1,
+        max_backoff=30,
+    ):
         """Initialize the MQTT manager."""
-        self._client = mqtt.Client()
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.stale_after = stale_after
+        self._subscriptions = {}
+        self._topic_out = TOPIC
+
+        # (enqueued, topic, payload, droppable, trace), oldest first
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._connected = False
+        self._closed = False
+        # mid -> enqueue time, until paho reports the message written
+        self._in_flight = {}
+        self._written_early = set()
+        self._was_connected = False
+        self._latencies = collections.deque(maxlen=1000)
+        self.published = 0
+        self.dropped = {"full": 0, "stale": 0, "error": 0}
+        self.reconnects = 0
+
+        self._client = create_client()
         self._client.on_connect = self._on_connect
         self._client.on_disconnect = self._on_disconnect
-        self._client.username_pw_set("orchestrateur", "Orchestrateur1234")
-        self._client.connect("localhost", 1884)
+        self._client.on_publish = self._on_publish
+        if username is not None:
+            self._client.username_pw_set(username, password)
+        self._client.reconnect_delay_set(min_backoff, max_backoff)
+        self._client.connect_async(host, port)
         self._client.loop_start()
-        self._topic_out = "fimav/orchestre"
+        self._sender = threading.Thread(
+            target=self._sender_loop, name="mqtt-sender", daemon=True
+        )
+        self._sender.start()
+        # paho does not expose its network thread
+        for thread in (getattr(self._client, "_thread", None), self._sender):
+            if thread is not None:
+                thread_policy.register(thread, "mqtt")
 
     def _on_connect(self, __client__, __userdata__, __flags__, rc):
         """Callback when the client is connected."""
         print("Connected to MQTT broker with result code " + str(rc))
+        if rc != 0:
+            return
+        for topic in list(self._subscriptions):
+            self._client.subscribe(topic)
+        with self._ready:
+            if self._was_connected:
+                self.reconnects += 1
+            self._was_connected = self._connected = True
+            self._ready.notify()
 
     def _on_disconnect(self, __client__, __userdata__, rc):
         """Callback when the client is disconnected."""
         print("Disconnected from MQTT broker with result code " + str(rc))
+        with self._ready:
+            self._connected = False
+            # Messages paho had not written yet are lost with the connection
+            self._in_flight.clear()
+
+    def _on_publish(self, __client__, __userdata__, mid):
+        with self._ready:
+            enqueued = self._in_flight.pop(mid, None)
+            if enqueued is None:
+                # Written before the sender thread recorded it
+                self._written_early.add(mid)
+                return
+        self._latencies.append(time.monotonic() - enqueued)
+
+    def subscribe(self, topic, callback):
+        """Call ``callback(topic, payload)`` for each message on ``topic``."""
+        self._subscriptions[topic] = callback
+        self._client.message_callback_add(
+            topic, lambda client, userdata, msg: callback(msg.topic, msg.payload)
+        )
+        # Subscribed by _on_connect when not connected yet
+        if self._connected:
+            self._client.subscribe(topic)
+
+    def publish(self, topic, payload, droppable=True, trace=None):
+        """Queue ``payload`` for ``topic``, without waiting for the broker.
+
+        ``trace``, a ``FrameTrace``, is finished once the message is sent.
+        """
+        with self._ready:
+            if len(self._queue) >= self.max_queue and not self._make_room(droppable):
+                self.dropped["full"] += 1
+                return
+            self._queue.append((time.monotonic(), topic, payload, droppable, trace))
+            self._ready.notify()
+
+    def _make_room(self, droppable):
+        """Drop the oldest droppable message, False when ``droppable`` must go."""
+        for i, item in enumerate(self._queue):
+            if item[3]:
+                del self._queue[i]
+                self.dropped["full"] += 1
+                return True
+        if droppable:
+            return False
+        # Only releases queued, the oldest one goes to keep the queue bounded
+        self._queue.popleft()
+        self.dropped["full"] += 1
+        return True
+
+    def _sender_loop(self):
+        while True:
+            with self._ready:
+                while not self._closed and not (self._connected and self._queue):
+                    self._ready.wait()
+                if self._closed:
+                    return
+                item = self._queue.popleft()
+                enqueued, topic, payload, droppable, trace = item
+                if droppable and time.monotonic() - enqueued > self.stale_after:
+                    self.dropped["stale"] += 1
+                    continue
+            # Outside the lock, paho may call _on_publish from its own thread
+            info = self._client.publish(topic, payload)
+            with self._ready:
+                if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    # Lost the connection in between, retry once reconnected
+                    self._queue.appendleft(item)
+                    self._connected = False
+                    continue
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    self.dropped["error"] += 1
+                    continue
+                self.published += 1
+                if trace is not None:
+                    trace.stage("mqtt queue", enqueued)
+                    trace.finish()
+                if info.mid in self._written_early:
+                    self._written_early.discard(info.mid)
+                    self._latencies.append(time.monotonic() - enqueued)
+                else:
+                    self._in_flight[info.mid] = enqueued
+
+    def send_midi(self, msg, instrument=None, play_at=None, song=None, trace=None):
+        """Send a MIDI message as a string to the MQTT broker.
+
+        Messages of an ``instrument`` go to its own subtopic. A message with a
+        ``play_at`` time (shared clock, seconds) is sent as JSON with that
+        time and its ``song`` id, for receivers scheduling it themselves.
+        """
+        topic = self._topic_out
+        if instrument is not None:
+            topic = f"{topic}/{instrument}"
+        payload = str(msg)
+        if play_at is not None:
+            payload = json.dumps({"t": play_at, "song": song, "midi": payload})
+        self.publish(topic, payload, droppable=not is_release(msg), trace=trace)
+
+    def send_control(self, command):
+        """Send a control command (a dict) to every receiver."""
+        self.publish(CONTROL_TOPIC, json.dumps(command), droppable=False)
+
+    def flush(self, timeout=1.0):
+        """Wait until the queue is empty, True when it emptied in time."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._ready:
+                if not self._queue and not self._in_flight:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def stats(self):
+        """Return the connection state, queue depth, drops and publish latency."""
+        with self._ready:
+            stats = {
+                "connected": self._connected,
+                "queued": len(self._queue),
+                "published": self.published,
+                "dropped": dict(self.dropped),
+                "reconnects": self.reconnects,
+            }
+        latencies = np.array(self._latencies) * 1000
+        if len(latencies):
+            stats["latency_p50_ms"] = float(np.percentile(latencies, 50))
+            stats["latency_p95_ms"] = float(np.percentile(latencies, 95))
+        return stats
+
+    def format_report(self):
+        stats = self.stats()
+        report = (
+            f"MQTT {self.host}:{self.port}:"
+            f" {'connected' if stats['connected'] else 'disconnected'},"
+            f" {stats['published']} published, {stats['queued']} queued,"
+            f" {stats['dropped']['full']} dropped (queue full),"
+            f" {stats['dropped']['stale']} dropped (stale),"
+            f" {stats['reconnects']} reconnects"
+        )
+        if "latency_p50_ms" in stats:
+            report += (
+                f", publish latency p50 {stats['latency_p50_ms']:.2f} ms"
+                f" p95 {stats['latency_p95_ms']:.2f} ms"
+            )
+        return report
+
+    def close(self, timeout=1.0):
+        """Send the queued note-offs and control commands, then disconnect.
 
-    def send_midi(self, msg):
-        """Send a MIDI message as a string to the MQTT broker."""
-        self._client.publish(self._topic_out, str(msg))  
+        The droppable messages still queued are discarded, the others get
+        ``timeout`` seconds to reach the broker.
+        """
+        with self._ready:
+            kept = [item for item in self._queue if not item[3]]
+            self.dropped["stale"] += len(self._queue) - len(kept)
+            self._queue = collections.deque(kept)
+        self.flush(timeout)
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._sender.join()
+        # Disconnect while the network loop still runs to write what is left
+        self._client.disconnect()
+        self._client.loop_stop()
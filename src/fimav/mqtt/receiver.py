@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import json
+import threading
+import uuid
+import mido
+from fimav.midi.instruments import topic_segment
+from fimav.mqtt.clock_sync import ClockSync
+from fimav.mqtt.mqtt_manager import CONTROL_TOPIC, TOPIC, create_client
+
+
+class MidiReceiver:
+    """Reference orchestra node playing the MIDI events it receives.
+
+    Subscribes to the topic of ``instrument`` (every instrument when None),
+    aligns on the publisher's clock with a ``ClockSync`` and calls
+    ``output(message)`` for each event at its play-at time on the shared
+    clock. Untimestamped messages are played as they arrive.
+
+    For every note played the receiver records when it was played and when
+    it should have been, both on the shared clock, and how long before its
+    play-at time the event arrived.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=1884,
+        instrument=None,
+        node=None,
+        output=None,
+        sync_interval=2.0,
+        username=None,
+        password=None,
+    ):
+        self.host = host
+        self.port = port
+        if instrument:
+            self.topic = f"{TOPIC}/{topic_segment(instrument)}"
+        else:
+            self.topic = f"{TOPIC}/#"
+        self.node = node or uuid.uuid4().hex[:8]
+        self.output = output
+        self.sync_interval = sync_interval
+
+        self._client = create_client(f"fimav-receiver-{self.node}")
+        if username is not None:
+            self._client.username_pw_set(username, password)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self.sync = ClockSync(self._client.publish, self.node)
+
+        self._queue = []
+        self._order = itertools.count()
+        self._sounding = {}
+        self._ready = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+        # (played, play_at) on the shared clock, play_at is None on arrival
+        self.played = []
+        # Seconds between the arrival of an event and its play-at time
+        self.margins = []
+
+    def start(self):
+        self._client.connect(self.host, self.port)
+        self._client.loop_start()
+        for target, name in (
+            (self._playback_loop, "receiver-playback"),
+            (self._sync_loop, "receiver-sync"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        with self._ready:
+            self._ready.notify()
+        for thread in self._threads:
+            thread.join()
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(
+            [(self.topic, 0), (CONTROL_TOPIC, 0), (self.sync.reply_topic, 0)]
+        )
+
+    def _sync_loop(self):
+        # A quick burst to sync before the first song, then periodic updates
+        for _ in range(5):
+            self.sync.request()
+            if self._stop_event.wait(0.05):
+                return
+        while not self._stop_event.wait(self.sync_interval):
+            self.sync.request()
+
+    def _on_message(self, client, userdata, msg):
+        if msg.topic == self.sync.reply_topic:
+            self.sync.on_reply(msg.payload)
+        elif msg.topic == CONTROL_TOPIC:
+            self._on_control(msg.payload)
+        elif not msg.topic.startswith(f"{TOPIC}/clock/"):
+            self._on_event(msg.payload)
+
+    def _on_event(self, payload):
+        try:
+            text = payload.decode()
+            if text.startswith("{"):
+                event = json.loads(text)
+                play_at, song = event["t"], event.get("song")
+                message = mido.Message.from_str(event["midi"])
+            else:
+                play_at, song = None, None
+                message = mido.Message.from_str(text)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring invalid MIDI event: {e}")
+            return
+
+        if play_at is None:
+            self._play(message, None, None)
+            return
+        self.margins.append(play_at - self.sync.now())
+        with self._ready:
+            heapq.heappush(self._queue, (play_at, next(self._order), song, message))
+            self._ready.notify()
+
+    def _on_control(self, payload):
+        try:
+            song = json.loads(payload)["cancel"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._ready:
+            self._queue = [event for event in self._queue if event[2] != song]
+            heapq.heapify(self._queue)
+            released = [key for key, owner in self._sounding.items() if owner == song]
+        for channel, note in released:
+            self._play(mido.Message("note_off", channel=channel, note=note), song, None)
+
+    def _playback_loop(self):
+        while not self._stop_event.is_set():
+            with self._ready:
+                if not self._queue:
+                    self._ready.wait(0.1)
+                    continue
+                wait = self._queue[0][0] - self.sync.now()
+                if wait > 0:
+                    self._ready.wait(wait)
+                    continue
+                play_at, _, song, message = heapq.heappop(self._queue)
+            self._play(message, song, play_at)
+
+    def _play(self, message, song, play_at):
+        key = (getattr(message, "channel", None), getattr(message, "note", None))
+        with self._ready:
+            if message.type == "note_on" and message.velocity > 0:
+                self._sounding[key] = song
+                self.played.append((self.sync.now(), play_at))
+            elif message.type in ("note_on", "note_off"):
+                self._sounding.pop(key, None)
+        if self.output is not None:
+            self.output(message)
@@ -0,0 +1,383 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+from fimav import __version__
+from fimav.midi.midi_controller import MidiController
+from fimav.midi.midi_library import MidiLibrary
+from fimav.mqtt.local_broker import LocalBroker
+from fimav.mqtt.mqtt_manager import (
+    DEFAULT_PASSWORD,
+    DEFAULT_USERNAME,
+    TOPIC,
+    MqttManager,
+    create_client,
+)
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+CHANNELS = 16
+# Distinct (channel, note, velocity) triples, one per note of a song
+MAX_NOTES = CHANNELS * 127 * 128
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the MIDI throughput and delivery latency of the"
+        " orchestra topics with simulated subscriber nodes"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO, with a line per subscriber",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "--broker",
+        metavar="HOST:PORT",
+        help="Use this broker instead of the embedded stand-in",
+    )
+    parser.add_argument("--username", default=DEFAULT_USERNAME)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument(
+        "--subscribers", type=int, default=8, help="Number of simulated nodes"
+    )
+    parser.add_argument(
+        "--rates",
+        default="250,1000,4000",
+        help="Comma separated MIDI messages per second to try, one run each",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="Seconds of music per run"
+    )
+    parser.add_argument(
+        "--lookahead-ms",
+        type=float,
+        default=0.0,
+        help="Publish with this lookahead, as fimav-run --midi-lookahead",
+    )
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def note_fields(index):
+    """Return the (channel, note, velocity) identifying note ``index``."""
+    return (
+        index % CHANNELS,
+        index // (CHANNELS * 127) % 128,
+        index // CHANNELS % 127 + 1,
+    )
+
+
+def write_song(path, duration, rate):
+    """Write a song of ``rate`` messages per second spread over all channels.
+
+    Every note has its own channel, note and velocity, so a subscriber can
+    tell which message it got. Each note-on is followed by its note-off.
+    """
+    count = min(int(duration * rate) // 2, MAX_NOTES) * 2
+    midi_file = MidiFile(ticks_per_beat=960)
+    track = MidiTrack()
+    midi_file.tracks.append(track)
+    # 1 ms ticks
+    track.append(MetaMessage("set_tempo", tempo=960000))
+    last_tick = 0
+    for i in range(count):
+        tick = round(i * 1000 / rate)
+        channel, note, velocity = note_fields(i // 2)
+        kind = "note_on" if i % 2 == 0 else "note_off"
+        track.append(
+            Message(
+                kind,
+                channel=channel,
+                note=note,
+                velocity=velocity,
+                time=tick - last_tick,
+            )
+        )
+        last_tick = tick
+    midi_file.save(path)
+    return count
+
+
+def message_index(payload):
+    """Return the index of the song message in ``payload``, None if not one."""
+    text = payload.decode() if isinstance(payload, bytes) else payload
+    if text.startswith("{"):
+        try:
+            text = json.loads(text)["midi"]
+        except (ValueError, KeyError, TypeError):
+            return None
+    try:
+        message = Message.from_str(text)
+    except (ValueError, TypeError):
+        return None
+    if message.type not in ("note_on", "note_off"):
+        return None
+    note = (
+        message.note * CHANNELS * 127
+        + (message.velocity - 1) * CHANNELS
+        + message.channel
+    )
+    return note * 2 + (message.type == "note_off")
+
+
+class _TimedMqttManager(MqttManager):
+    """``MqttManager`` noting when each payload was handed to it."""
+
+    def __init__(self, *args, **kwargs):
+        self.sent = {}
+        super().__init__(*args, **kwargs)
+
+    def publish(self, topic, payload, droppable=True, trace=None):
+        self.sent[payload] = time.time()
+        super().publish(topic, payload, droppable, trace)
+
+
+def _serve_broker(conn):
+    """Run the stand-in broker until told to stop, in its own process."""
+    broker = LocalBroker().start()
+    conn.send((broker.host, broker.port))
+    conn.recv()
+    broker.stop()
+    conn.send((broker.published, broker.delivered))
+
+
+def _run_subscribers(host, port, count, username, password, conn):
+    """Connect ``count`` nodes and record the arrival time of every message.
+
+    Answers each ``collect`` request on ``conn`` with the arrivals of every
+    node since the previous one, and ends on ``stop``.
+    """
+    arrivals = [[] for _ in range(count)]
+    subscribed = multiprocessing.Semaphore(0)
+    clients = []
+    for i in range(count):
+        client = create_client(f"fimav-bench-{os.getpid()}-{i}")
+        if username is not None:
+            client.username_pw_set(username, password)
+        client.on_connect = lambda c, u, f, rc: c.subscribe(f"{TOPIC}/#")
+        client.on_subscribe = lambda c, u, mid, qos: subscribed.release()
+        client.on_message = lambda c, u, msg, i=i: arrivals[i].append(
+            (time.time(), msg.payload)
+        )
+        client.connect(host, port)
+        client.loop_start()
+        clients.append(client)
+    for _ in range(count):
+        subscribed.acquire()
+    conn.send("ready")
+
+    while conn.recv() == "collect":
+        batch, arrivals[:] = list(arrivals), [[] for _ in range(count)]
+        conn.send(batch)
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+
+
+def node_stats(arrivals, sent, count):
+    """Return the latencies (s), out-of-order and lost count of one node."""
+    latencies, indices = [], []
+    for arrival, payload in arrivals:
+        index = message_index(payload)
+        send_time = sent.get(payload.decode())
+        if index is None or send_time is None:
+            continue
+        latencies.append(arrival - send_time)
+        indices.append(index)
+    indices = np.array(indices, dtype=np.int64)
+    out_of_order = 0
+    if len(indices):
+        out_of_order = int((indices < np.maximum.accumulate(indices)).sum())
+    lost = count - len(np.unique(indices))
+    return np.array(latencies), out_of_order, lost
+
+
+def run_rate(manager, controller, nodes, song, count, duration):
+    """Play ``song`` once and return the measures of the run."""
+    manager.sent.clear()
+    before = manager.stats()
+    cpu, wall = time.process_time(), time.perf_counter()
+    controller.play_midi_file(song)
+    time.sleep(duration + 0.5)
+    while controller.is_playing():
+        time.sleep(0.05)
+    manager.flush(5.0)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+    # Collect until the deliveries stop, a saturated broker lags behind
+    arrivals = []
+    for _ in range(20):
+        time.sleep(0.5)
+        for conn in nodes:
+            conn.send("collect")
+        batches = [batch for conn in nodes for batch in conn.recv()]
+        if not arrivals:
+            arrivals = batches
+        else:
+            for received, batch in zip(arrivals, batches):
+                received.extend(batch)
+        if not any(batches):
+            break
+    per_node = [node_stats(received, manager.sent, count) for received in arrivals]
+    after = manager.stats()
+    send_times = sorted(manager.sent.values())
+    span = send_times[-1] - send_times[0] if len(send_times) > 1 else 0.0
+    return {
+        "publish_rate": (len(send_times) - 1) / span if span else 0.0,
+        "published": after["published"] - before["published"],
+        "dropped": sum(after["dropped"].values()) - sum(before["dropped"].values()),
+        "cpu": cpu / wall,
+        "nodes": per_node,
+    }
+
+
+def format_run(rate, count, run):
+    latencies = [latency for latency, _, _ in run["nodes"] if len(latency)]
+    merged = np.concatenate(latencies) * 1000 if latencies else np.zeros(1)
+    node_p95 = [np.percentile(latency, 95) * 1000 for latency in latencies] or [0.0]
+    lines = [
+        f"  {rate:>6g} msg/s: published {run['publish_rate']:7.0f} msg/s,"
+        f" CPU {run['cpu'] * 100:5.1f}%,"
+        f" latency p50 {np.percentile(merged, 50):6.2f} ms"
+        f" p95 {np.percentile(merged, 95):6.2f} ms"
+        f" p99 {np.percentile(merged, 99):6.2f} ms"
+        f" (node p95 {min(node_p95):.2f}-{max(node_p95):.2f} ms),"
+        f" {sum(ooo for _, ooo, _ in run['nodes'])} out of order,"
+        f" {sum(lost for _, _, lost in run['nodes'])} lost"
+        f" of {count * len(run['nodes'])}, {run['dropped']} dropped by the publisher"
+    ]
+    for i, (latency, out_of_order, lost) in enumerate(run["nodes"]):
+        if len(latency):
+            _logger.info(
+                "%g msg/s node %d: p50 %.2f ms, p95 %.2f ms, max %.2f ms,"
+                " %d out of order, %d lost",
+                rate,
+                i,
+                np.percentile(latency, 50) * 1000,
+                np.percentile(latency, 95) * 1000,
+                latency.max() * 1000,
+                out_of_order,
+                lost,
+            )
+    return "\n".join(lines)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    rates = [float(rate) for rate in args.rates.split(",")]
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        port = int(port)
+    else:
+        # In its own process so the publisher CPU is measured alone
+        broker, child = multiprocessing.Pipe()
+        multiprocessing.Process(
+            target=_serve_broker, args=(child,), daemon=True
+        ).start()
+        host, port = broker.recv()
+
+    # The nodes are spread over processes so they do not share one GIL
+    processes = max(1, min(args.subscribers, os.cpu_count() or 1))
+    nodes = []
+    for i in range(processes):
+        count = args.subscribers // processes + (i < args.subscribers % processes)
+        conn, child = multiprocessing.Pipe()
+        multiprocessing.Process(
+            target=_run_subscribers,
+            args=(host, port, count, args.username, args.password, child),
+            daemon=True,
+        ).start()
+        nodes.append(conn)
+    for conn in nodes:
+        conn.recv()
+
+    lookahead = args.lookahead_ms / 1000
+    manager = _TimedMqttManager(host, port, args.username, args.password)
+    lines = [
+        f"{args.subscribers} subscribers on {host}:{port},"
+        f" {args.duration:g} s per run, lookahead {args.lookahead_ms:g} ms:"
+    ]
+    with tempfile.TemporaryDirectory() as midi_dir:
+        counts = {}
+        for rate in rates:
+            counts[rate] = write_song(
+                os.path.join(midi_dir, f"bench{rate:g}.mid"), args.duration, rate
+            )
+        library = MidiLibrary(midi_dir, os.path.join(midi_dir, "index.json"))
+        controller = MidiController(manager, midi_dir, library, lookahead=lookahead)
+        manager.flush(5.0)
+        for rate in rates:
+            run = run_rate(
+                manager,
+                controller,
+                nodes,
+                f"bench{rate:g}.mid",
+                counts[rate],
+                args.duration,
+            )
+            lines.append(format_run(rate, counts[rate], run))
+        controller.close()
+
+    manager.close()
+    for conn in nodes:
+        conn.send("stop")
+    if broker is not None:
+        broker.send("stop")
+        published, delivered = broker.recv()
+        lines.append(f"  stand-in broker: {published} received, {delivered} delivered")
+    print("\n".join(lines))
+    _logger.info("Script ends here")
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,87 @@
+import collections
+import sys
+import threading
+import numpy as np
+
+# References to a free buffer while checkout() looks at it: the free list and
+# getrefcount's own argument
+_UNSHARED_REFS = 2
+
+
+class BufferPool:
+    """Reuses the large per-frame arrays instead of allocating new ones.
+
+    ``checkout(shape)`` hands out an array of that shape, ``release(array)``
+    gives it back once the caller is done with it. A released array is only
+    handed out again when nothing else references it any more, so a frame
+    still held by another thread (the detector's snapshot, a view of it...)
+    is never overwritten: releasing early is always safe, it only delays the
+    reuse. Releasing an array that did not come from the pool
+    adopts it. At most ``max_free`` arrays are kept per shape.
+    """
+
+    def __init__(self, max_free=4):
+        self.max_free = max_free
+        self._free = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.checkouts = 0
+        self.reuses = 0
+        # Ids of the arrays checked out and not released yet
+        self._out = set()
+
+    def checkout(self, shape, dtype=np.uint8):
+        """Return an array of ``shape``, with undefined content."""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            self.checkouts += 1
+            free = self._free[key]
+            for i in range(len(free)):
+                if sys.getrefcount(free[i]) <= _UNSHARED_REFS:
+                    self.reuses += 1
+                    array = free.pop(i)
+                    self._out.add(id(array))
+                    return array
+            self.allocations += 1
+        array = np.empty(shape, dtype)
+        with self._lock:
+            self.allocated_bytes += array.nbytes
+            self._out.add(id(array))
+        return array
+
+    def release(self, array):
+        """Give back an array from :meth:`checkout`."""
+        if array is None:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            self._out.discard(id(array))
+            free = self._free[key]
+            if len(free) < self.max_free and not any(a is array for a in free):
+                free.append(array)
+
+    def stats(self):
+        with self._lock:
+            free = sum(len(arrays) for arrays in self._free.values())
+            free_bytes = sum(a.nbytes for arrays in self._free.values() for a in arrays)
+            return {
+                "checkouts": self.checkouts,
+                "reuse_rate": self.reuses / self.checkouts if self.checkouts else 0.0,
+                "allocations": self.allocations,
+                "allocated_mb": self.allocated_bytes / 1e6,
+                "out": len(self._out),
+                "free": free,
+                "free_mb": free_bytes / 1e6,
+                "shapes": len(self._free),
+            }
+
+    def format_report(self):
+        stats = self.stats()
+        return (
+            f"Buffer pool: {stats['checkouts']} checkouts,"
+            f" {stats['reuse_rate']:.0%} reused, {stats['allocations']} allocations"
+            f" ({stats['allocated_mb']:.1f} MB), {stats['out']} out,"
+            f" {stats['free']} free ({stats['free_mb']:.1f} MB)"
+            f" over {stats['shapes']} shapes"
+        )
@@ -0,0 +1,9 @@
+# Option values shared by the command line and the processing modules. Kept
+# free of heavy imports so parsing the command line does not load OpenCV.
+
+# Formats a VideoCapture can deliver. I420/NV12 frames are the raw planes in
+# a single (height * 3 / 2, width) array, the Y plane first.
+PIXEL_FORMATS = ("BGR", "I420", "NV12")
+
+# How a PipelineGroup schedules the detectors of its pipelines
+SCHEDULING_MODES = ("threads", "round-robin", "per-core", "batched")
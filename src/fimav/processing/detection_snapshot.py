@@ -0,0 +1,151 @@
+class DetectionSnapshot:
+    """Result of face detection on one frame, never modified once created.
+
+    ``boxes`` are ``(x1, y1, x2, y2)`` tuples in ``face_size`` coordinates
+    with their ``scores``, ``probabilities`` the emotion probabilities of the
+    first face (None until classified). ``frame_id`` and ``timestamp`` are the
+    capture count and ``time.monotonic()`` time of the frame the boxes come
+    from, and ``frame`` that captured frame itself, to crop the faces from.
+    ``trace`` is the frame's ``FrameTrace`` when tracing, None otherwise.
+    ``velocities`` holds each box's corner speeds in pixels per second,
+    estimated against the previous snapshot, so :meth:`boxes_at` can move the
+    boxes to the time of a newer frame.
+
+    The detector replaces its snapshot as a whole, so a reader taking
+    ``detector.latest_snapshot`` once always gets the frame, boxes, scores
+    and probabilities that go together. Holding the frame keeps a
+    ``BufferPool`` from reusing it while the snapshot is in use.
+    """
+
+    __slots__ = (
+        "frame_id",
+        "timestamp",
+        "frame",
+        "trace",
+        "boxes",
+        "scores",
+        "probabilities",
+        "velocities",
+    )
+
+    # Weight of the newest measure in the smoothed velocities
+    SMOOTHING = 0.5
+
+    def __init__(
+        self,
+        frame_id=0,
+        timestamp=None,
+        frame=None,
+        trace=None,
+        boxes=(),
+        scores=(),
+        probabilities=None,
+        velocities=None,
+    ):
+        boxes = tuple(tuple(int(v) for v in box) for box in boxes or ())
+        if velocities is None:
+            velocities = ((0.0, 0.0, 0.0, 0.0),) * len(boxes)
+        if probabilities is not None:
+            probabilities = probabilities.copy()
+            probabilities.flags.writeable = False
+        object.__setattr__(self, "frame_id", frame_id)
+        object.__setattr__(self, "timestamp", timestamp)
+        object.__setattr__(self, "frame", frame)
+        object.__setattr__(self, "trace", trace)
+        object.__setattr__(self, "boxes", boxes)
+        object.__setattr__(self, "scores", tuple(float(s) for s in scores or ()))
+        object.__setattr__(self, "probabilities", probabilities)
+        object.__setattr__(self, "velocities", tuple(velocities))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DetectionSnapshot is immutable")
+
+    def __repr__(self):
+        return (
+            f"DetectionSnapshot(frame_id={self.frame_id}, timestamp={self.timestamp},"
+            f" boxes={self.boxes}, scores={self.scores})"
+        )
+
+    def follow(self, frame_id, timestamp, boxes, scores, frame=None, trace=None):
+        """Return the snapshot of a newer frame, with velocities against this one.
+
+        Each new box is matched to the previous box it overlaps most; boxes
+        without a match start still. The emotion probabilities are carried
+        over until the next classification.
+        """
+        new = DetectionSnapshot(frame_id, timestamp, frame, trace, boxes, scores)
+        if not new.boxes or not self.boxes or self.timestamp is None:
+            velocities = None
+        else:
+            dt = timestamp - self.timestamp
+            velocities = []
+            for box in new.boxes:
+                match = max(
+                    range(len(self.boxes)), key=lambda i: _iou(box, self.boxes[i])
+                )
+                if _iou(box, self.boxes[match]) <= 0:
+                    velocities.append((0.0, 0.0, 0.0, 0.0))
+                    continue
+                previous = self.velocities[match]
+                if dt <= 0:
+                    # Same frame again, nothing new to measure
+                    velocities.append(previous)
+                    continue
+                velocities.append(
+                    tuple(
+                        self.SMOOTHING * (b - p) / dt + (1 - self.SMOOTHING) * v
+                        for b, p, v in zip(box, self.boxes[match], previous)
+                    )
+                )
+        return DetectionSnapshot(
+            frame_id,
+            timestamp,
+            frame,
+            trace,
+            new.boxes,
+            new.scores,
+            self.probabilities,
+            velocities,
+        )
+
+    def with_probabilities(self, probabilities):
+        """Return this snapshot with new emotion probabilities."""
+        return DetectionSnapshot(
+            self.frame_id,
+            self.timestamp,
+            self.frame,
+            self.trace,
+            self.boxes,
+            self.scores,
+            probabilities,
+            self.velocities,
+        )
+
+    def boxes_at(self, timestamp, max_lead=0.2):
+        """Return the boxes moved to ``timestamp`` along their velocities.
+
+        Extrapolation stops ``max_lead`` seconds after the snapshot, so a
+        face lost by the detector does not drift away; 0 returns the boxes
+        where they were detected.
+        """
+        if timestamp is None or self.timestamp is None or max_lead <= 0:
+            return self.boxes
+        lead = min(max(timestamp - self.timestamp, 0.0), max_lead)
+        if lead == 0:
+            return self.boxes
+        return tuple(
+            tuple(int(round(b + v * lead)) for b, v in zip(box, velocity))
+            for box, velocity in zip(self.boxes, self.velocities)
+        )
+
+
+def _iou(a, b):
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    if inter == 0:
+        return 0.0
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union
@@ -0,0 +1,98 @@
+import collections
+import time
+import cv2
+import numpy as np
+
+
+def box_iou(a, b):
+    """Return the intersection over union of two ``(x1, y1, x2, y2)`` boxes."""
+    width = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class EmotionCache:
+    """Reuses emotion probabilities while a face crop stays the same.
+
+    An entry is the face box, a 16x16 thumbnail of its grey crop and the
+    probabilities the net gave for it. A new crop hits an entry when its box
+    overlaps the entry's by at least ``min_iou`` and the mean absolute
+    difference of the thumbnails is at most ``max_diff`` grey levels, which
+    absorbs sensor noise and the jitter of the detector's boxes but not a
+    change of expression. A new result replaces the entry of the same face
+    (the one its box overlaps). Entries expire after ``ttl`` seconds and the
+    least recently used one is dropped beyond ``max_entries``.
+    """
+
+    THUMBNAIL_SIZE = (16, 16)
+
+    def __init__(
+        self, ttl=1.0, max_entries=8, min_iou=0.6, max_diff=8.0, clock=time.monotonic
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_iou = min_iou
+        self.max_diff = max_diff
+        self.clock = clock
+
+        self._entries = collections.OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _thumbnail(self, crop):
+        return cv2.resize(
+            np.asarray(crop, dtype=np.float32),
+            self.THUMBNAIL_SIZE,
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def _expire(self, now):
+        for key in [k for k, e in self._entries.items() if now - e[3] > self.ttl]:
+            del self._entries[key]
+
+    def lookup(self, box, crop):
+        """Return the cached probabilities for ``box``/``crop``, or None."""
+        now = self.clock()
+        self._expire(now)
+        thumbnail = self._thumbnail(crop)
+
+        for key, (cached_box, cached_thumbnail, probs, _) in self._entries.items():
+            if box_iou(box, cached_box) < self.min_iou:
+                continue
+            if np.mean(np.abs(thumbnail - cached_thumbnail)) <= self.max_diff:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return probs
+        self.misses += 1
+        return None
+
+    def store(self, box, crop, probs):
+        """Remember the probabilities the net gave for ``box``/``crop``."""
+        for key in [
+            k for k, e in self._entries.items() if box_iou(box, e[0]) >= self.min_iou
+        ]:
+            del self._entries[key]
+        self._entries[self._next_id] = (
+            tuple(box),
+            self._thumbnail(crop),
+            probs,
+            self.clock(),
+        )
+        self._next_id += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / max(lookups, 1),
+            "entries": len(self._entries),
+        }
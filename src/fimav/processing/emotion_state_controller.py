@@ -1,69 +1,66 @@
 import time
-import random
+from fimav.midi.midi_library import EMOTIONS
 
 
 class EmotionStateController:
-    _instance = None
-    DELAY = 1.5
-
-    # Modifier avec des musiques joyeuses
-    happy_songs = [
-        "Test.mid",
-    ]
-
-    # Modifier avec des musiques tristes
-    sad_songs = [
-        "Test.mid",
-    ]
+    """Plays a song of the emotion held for ``DELAY`` seconds.
 
-    def __new__(cls, __midi_controller__=None):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    Songs are picked from the ``MidiLibrary`` of the MIDI controller: add
+    files to ``midi/<emotion>/`` or tag them in ``midi/manifest.json``.
+    Neutral resets the hold and does not trigger songs, and so does a frame
+    without a face (``None``) or an unknown emotion index.
+    """
 
-    def __init__(self, midi_controller=None):
-        if getattr(self, "_initialized", False):
-            return
-        if midi_controller is None:
-            raise ValueError("Must initialize with arguments first")
+    DELAY = 1.5
+    # Seconds over which a new song replaces the current one (0 cuts)
+    CROSSFADE = 0.0
 
+    def __init__(self, midi_controller, clock=time.time, library=None):
         self.midi = midi_controller
+        self.library = library or midi_controller.library
+        self.clock = clock
         self.emotion_start_time = None
         self.last_emotion = None
         self.target_emotion = None
-        self._initialized = True
 
-    @classmethod
-    def get_instance(cls):
-        """Return the singleton, or raise if not yet created."""
-        if cls._instance is None or not getattr(cls._instance, "_initialized", False):
-            raise RuntimeError("EmotionStateController has not been initialized")
-        return cls._instance
+    def update_emotion(self, emotion_idx: int, trace=None):
+        """Feed the emotion of a frame, ``trace`` being its ``FrameTrace``."""
+        start = time.monotonic()
+        reason = self._update(emotion_idx, trace)
+        if trace is not None:
+            trace.stage("decision", start, reason=reason)
 
-    def update_emotion(self, emotion_idx: int):
+    def _update(self, emotion_idx, trace):
+        """Apply ``emotion_idx`` and return the reason of the decision."""
         # reset on neutral
         if emotion_idx == 0:
             self.target_emotion = None
             self.emotion_start_time = None
-            return
+            return "neutral resets the hold"
+        if emotion_idx is None or not 0 < emotion_idx < len(EMOTIONS):
+            self.target_emotion = None
+            self.emotion_start_time = None
+            return "no emotion resets the hold"
 
         # ignore same as current song
         if self.midi.is_playing() and emotion_idx == self.last_emotion:
-            return
+            return "song of this emotion playing"
 
-        now = time.time()
+        now = self.clock()
 
         # new hold cycle
         if emotion_idx != self.target_emotion:
             self.target_emotion = emotion_idx
             self.emotion_start_time = now
-            return
+            return "hold started"
 
         # held long enough?
         if now - (self.emotion_start_time or now) >= self.DELAY:
-            self._trigger_song(emotion_idx)
+            triggered = self._trigger_song(emotion_idx, trace)
             self.target_emotion = None
             self.emotion_start_time = None
+            return "song triggered" if triggered else "no song for this emotion"
+        return "holding"
 
     def reset_last_emotion(self):
         self.last_emotion = None
@@ -74,15 +71,16 @@ class EmotionStateController:
     def get_emotion_progress(self) -> float:
         if not self.target_emotion or not self.emotion_start_time:
             return 0.0
-        elapsed = time.time() - self.emotion_start_time
+        elapsed = self.clock() - self.emotion_start_time
         return min(elapsed / self.DELAY, 1)
 
-    def _trigger_song(self, emotion_idx: int):
-        if emotion_idx == 1:
-            midi = random.choice(self.happy_songs)
-        elif emotion_idx == 3:
-            midi = random.choice(self.sad_songs)
+    def _trigger_song(self, emotion_idx: int, trace=None):
+        midi = self.library.choose(emotion_idx)
+        if midi is None:
+            return False
+        if self.CROSSFADE > 0 and self.midi.is_playing():
+            self.midi.crossfade(midi, self.CROSSFADE, trace=trace)
         else:
-            return
-        self.midi.play_midi_file(midi)
+            self.midi.play_midi_file(midi, trace=trace)
         self.last_emotion = emotion_idx
+        return True
@@ -1,54 +1,88 @@
+import collections
 import cv2
 import threading
 import numpy as np
 import ncnn
 import time
-from fimav.processing.emotion_state_controller import EmotionStateController
-from fimav.processing.video_capture import VideoCapture
+from fimav import thread_policy
+from fimav.processing.detection_snapshot import DetectionSnapshot
+from fimav.processing.model_store import model_name
+from fimav.processing.tuning import load_tuning
+from fimav.processing.video_capture import frame_size, luma_plane, resize_yuv_to_rgb
 
 
 class FaceEmotionDetector:
-    _instance = None
-
-    def __new__(
-        cls,
-        __width__,
-        __height__,
-        __face_param__="./models/face/ultraface_12.param",
-        __face_bin__="./models/face/ultraface_12.bin",
-        __emo_param__="./models/emotion/emotion_ferplus_12.param",
-        __emo_bin__="./models/emotion/emotion_ferplus_12.bin",
-        __face_size__=(320, 240),
-        __emo_size__=(64, 64),
-    ):
-
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    FACE_FPS = 20
+    EMOTION_FPS = 5
+    # Returned by _classify_emotion when the face is too poor to classify
+    SKIPPED = -1
+    # Factor applied to the "triste" probability, the net rarely picks it
+    TRISTE_BOOST = 10
+    # Outputs of the emotion net, in the FER+ order
+    EMOTION_LABELS = [
+        "neutre",
+        "heureuse",
+        "surprenante",
+        "triste",
+        "enrageante",
+        "dégoutante",
+        "apeurante",
+        "méprisante",
+    ]
 
     def __init__(
         self,
-        width,
-        height,
+        video_capture,
+        emotion_controller,
+        model_bank,
         face_param="./models/face/ultraface_12.param",
         face_bin="./models/face/ultraface_12.bin",
         emo_param="./models/emotion/emotion_ferplus_12.param",
         emo_bin="./models/emotion/emotion_ferplus_12.bin",
         face_size=(320, 240),
         emo_size=(64, 64),
+        name="camera",
+        autotune=True,
     ):
-        if getattr(self, "_initialized", False):
-            return
-        self.width = width
-        self.height = height
-        self.video_capture = VideoCapture.get_instance()
+        self.name = name
+        self.video_capture = video_capture
         self.face_size = face_size
         self.emo_size = emo_size
-
-        # Shared state
-        self.latest_detection = []
-        self.emotion_controller = EmotionStateController.get_instance()
-        self.shared_resized_frame = None
+        self.face_fps = self.FACE_FPS
+        self.emotion_fps = self.EMOTION_FPS
+        self.score_threshold = 0.7
+        self.iou_threshold = 0.3
+
+        # Shared state, the snapshot is replaced as a whole under the lock
+        self.latest_snapshot = DetectionSnapshot()
+        self._snapshot_lock = threading.Lock()
+        self.latest_probabilities = None
+        self.emotion_controller = emotion_controller
+        self._face_input = None
+        # The frame being detected, its capture count and time
+        self._frame = None
+        self._frame_id = 0
+        self._frame_time = None
+
+        # Optional MotionGate skipping the face net on static scenes
+        self.motion_gate = None
+        # Optional EmotionCache reusing results while the face is unchanged
+        self.emotion_cache = None
+        # Optional FaceQuality keeping poor crops away from the emotion net
+        self.face_quality = None
+        # Optional Tracer following each frame up to the MIDI it triggers
+        self.tracer = None
+        # Trace of the frame being detected, then the last one classified
+        self._trace = None
+        self._emotion_trace = None
+
+        # Sinks notified after each processed frame
+        self.face_sinks = []
+        self.emotion_sinks = []
+
+        # Throughput counters
+        self.face_frames = 0
+        self.emotion_frames = 0
 
         # Threads
         self.running = False
@@ -57,35 +91,35 @@ class FaceEmotionDetector:
         self._stop_face_thread = threading.Event()
         self._stop_emotion_thread = threading.Event()
 
-        # Load models
-        self.face_net = ncnn.Net()
-        self.face_net.load_param(face_param)
-        self.face_net.load_model(face_bin)
-
-        self.emo_net = ncnn.Net()
-        self.emo_net.load_param(emo_param)
-        self.emo_net.load_model(emo_bin)
+        # Settings measured on this host by fimav-autotune, if any
+        self.tuning = (
+            load_tuning(model_bank.store, face_bin, emo_bin) if autotune else None
+        )
+        face_options = emo_options = None
+        if self.tuning:
+            face_options = self.tuning["face"]
+            emo_options = self.tuning.get("emotion")
+            self.face_size = tuple(face_options["face_size"])
+            self.face_fps = self.tuning["face_fps"]
+            self.emotion_fps = self.tuning["emotion_fps"]
+            print(f"Autotune settings loaded ({self.name}): {self.tuning['summary']}")
+        # Kept for the models swapped in later
+        self.net_options = {"face": face_options, "emotion": emo_options}
+
+        # Models are shared through the bank, extractors stay per call. A
+        # ModelSwapper may replace a net and its name while running.
+        self.face_net = model_bank.get_net(face_param, face_bin, face_options)
+        self.emo_net = model_bank.get_net(emo_param, emo_bin, emo_options)
+        self.face_model = model_name(face_bin)
+        self.emotion_model = model_name(emo_bin)
+        self._net_lock = threading.Lock()
+        # Seconds per extraction, by model name
+        self.model_latency = collections.defaultdict(
+            lambda: collections.deque(maxlen=1000)
+        )
 
         # Emotion info
-        self.emotion_labels = [
-            "neutre",
-            "heureuse",
-            "surprenante",
-            "triste",
-            "enrageante",
-            "dégoutante",
-            "apeurante",
-            "méprisante",
-        ]
-
-        self._initialized = True
-
-    @classmethod
-    def get_instance(cls):
-        """Return the singleton, or raise if not yet created."""
-        if cls._instance is None or not getattr(cls._instance, "_initialized", False):
-            raise RuntimeError("FaceEmotionDetector has not been initialized")
-        return cls._instance
+        self.emotion_labels = list(self.EMOTION_LABELS)
 
     def start_processing(self):
         if self.running:
@@ -94,11 +128,17 @@ class FaceEmotionDetector:
         self._stop_face_thread.clear()
         self._stop_emotion_thread.clear()
 
-        self.face_thread = threading.Thread(target=self._face_processing_loop)
-        self.emotion_thread = threading.Thread(target=self._emotion_processing_loop)
+        self.face_thread = threading.Thread(
+            target=self._face_processing_loop, name=f"{self.name}-face"
+        )
+        self.emotion_thread = threading.Thread(
+            target=self._emotion_processing_loop, name=f"{self.name}-emotion"
+        )
 
         self.face_thread.start()
         self.emotion_thread.start()
+        thread_policy.register(self.face_thread, "face")
+        thread_policy.register(self.emotion_thread, "emotion")
 
     def stop_processing(self):
         self.running = False
@@ -111,57 +151,223 @@ class FaceEmotionDetector:
         cv2.destroyAllWindows()
 
     def _face_processing_loop(self):
-        print("Face detection thread started")
-        delay = 1.0 / 20.0  # 20 fps
+        print(f"Face detection thread started ({self.name})")
 
         while not self._stop_face_thread.is_set():
-            time.sleep(delay)
-            
-            frame = self.video_capture.get_latest_frame()
-            if frame is not None:
-                image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                resized_image = cv2.resize(image_rgb, self.face_size)
-
-                self.shared_resized_frame = resized_image
-                self.latest_detection = self._detect_faces()
-
+            time.sleep(1.0 / self.face_fps)
+            self.process_face_frame()
 
     def _emotion_processing_loop(self):
-        print("Emotion classification thread started")
-        delay = 1.0 / 5.0  # 5 fps
-        
+        print(f"Emotion classification thread started ({self.name})")
+
         while not self._stop_emotion_thread.is_set():
-            time.sleep(delay)
-            
-            if len(self.latest_detection) > 1:
-                self.emotion_controller.update_emotion(0)
-                continue
-            
-            frame = self.shared_resized_frame
-            if frame is not None:
-                self.emotion_controller.update_emotion(self._classify_emotion(frame))
+            time.sleep(1.0 / self.emotion_fps)
+            self.process_emotion()
 
-    def _detect_faces(self):
-        if self.shared_resized_frame is None:
+    def process_face_frame(self):
+        """Run face detection once on the latest captured frame.
+
+        Returns True when a frame was available and processed.
+        """
+        if self.reuse_detection():
+            return True
+        if not self.prepare_face_frame():
+            return False
+        start = time.perf_counter()
+        boxes, scores = self._detect_faces()
+        if self.motion_gate is not None:
+            self.motion_gate.record_detection(time.perf_counter() - start)
+        self.publish_detection(boxes, scores)
+        return True
+
+    def reuse_detection(self):
+        """Republish the previous boxes when the motion gate finds the scene static.
+
+        Returns True when the face net can be skipped for the latest frame.
+        """
+        if self.motion_gate is None:
+            return False
+        frame = self.video_capture.get_latest_frame()
+        if frame is None or self.motion_gate.needs_detection(
+            frame, self.video_capture.pixel_format
+        ):
+            return False
+        self._take_frame(frame)
+        snapshot = self.latest_snapshot
+        self.publish_detection(snapshot.boxes, snapshot.scores, reused=True)
+        return True
+
+    def prepare_face_frame(self):
+        """Build the face net input from the latest captured frame.
+
+        Returns False when the source has no frame yet.
+        """
+        frame = self.video_capture.get_latest_frame()
+        if frame is None:
+            return False
+
+        pixel_format = self.video_capture.pixel_format
+        # The capture pipeline may already deliver a scaled RGB frame
+        detection_frame = self.video_capture.get_latest_detection_frame()
+        if detection_frame is not None and frame_size(detection_frame) == tuple(
+            self.face_size
+        ):
+            mat = ncnn.Mat.from_pixels(
+                detection_frame, ncnn.Mat.PixelType.PIXEL_RGB, *self.face_size
+            )
+        elif pixel_format == "BGR":
+            # Colour conversion and resize in a single pass
+            mat = ncnn.Mat.from_pixels_resize(
+                frame,
+                ncnn.Mat.PixelType.PIXEL_BGR2RGB,
+                *frame_size(frame),
+                *self.face_size,
+            )
+        else:
+            pool = getattr(self.video_capture, "buffer_pool", None)
+            resized_image = resize_yuv_to_rgb(frame, pixel_format, self.face_size, pool)
+            mat = ncnn.Mat.from_pixels(
+                resized_image, ncnn.Mat.PixelType.PIXEL_RGB, *self.face_size
+            )
+            if pool is not None:
+                # from_pixels copied it
+                pool.release(resized_image)
+        mat.substract_mean_normalize([127, 127, 127], [1.0 / 128] * 3)
+
+        self._face_input = mat
+        self._take_frame(frame)
+        return True
+
+    def _take_frame(self, frame):
+        """Note which captured frame the next detection belongs to."""
+        self._frame = frame
+        self._frame_id = self.video_capture.frame_count
+        self._frame_time = self.video_capture.latest_frame_time
+        self._trace = self._trace_frame()
+
+    def _trace_frame(self):
+        """Start the trace of the latest captured frame, None when not tracing."""
+        if self.tracer is None:
             return None
+        return self.tracer.frame(self.name, self._frame_id, self._frame_time)
+
+    def publish_detection(self, boxes, scores=None, reused=False):
+        """Make ``boxes`` the latest detection and notify the face sinks."""
+        # The snapshot holds the frame and its trace from now on
+        frame, self._frame = self._frame, None
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            # Before the emotion thread can see the trace
+            trace.stage(
+                "face reused" if reused else "face detection",
+                trace.opened,
+                faces=0 if boxes is None else len(boxes),
+            )
+        with self._snapshot_lock:
+            self.latest_snapshot = self.latest_snapshot.follow(
+                self._frame_id, self._frame_time, boxes, scores, frame, trace
+            )
+        self.face_frames += 1
+
+        for sink in self.face_sinks:
+            sink(self, boxes)
+
+    def process_emotion(self):
+        """Classify the current face once and feed the state controller.
+
+        Returns True when the emotion controller was updated.
+        """
+        start = time.monotonic()
+        # Only the probabilities of this pass, for the emotion sinks
+        self.latest_probabilities = None
+        snapshot = self.latest_snapshot
+        # A frame classified again does not add to its trace
+        trace = snapshot.trace
+        if trace is self._emotion_trace:
+            trace = None
+        else:
+            self._emotion_trace = trace
+        if len(snapshot.boxes) > 1:
+            emotion_idx = 0
+        else:
+            frame = snapshot.frame
+            if frame is None:
+                return False
+            emotion_idx = self._classify_emotion(frame, snapshot)
+            if emotion_idx == self.SKIPPED:
+                if trace is not None:
+                    trace.stage("emotion", start, result="poor quality face")
+                # Leave the hold timer of the controller untouched
+                return False
+
+        if trace is not None:
+            label = (
+                self.emotion_labels[emotion_idx] if emotion_idx is not None else None
+            )
+            trace.stage("emotion", start, result=label, faces=len(snapshot.boxes))
+        self.emotion_controller.update_emotion(emotion_idx, trace)
+        self.emotion_frames += 1
+
+        for sink in self.emotion_sinks:
+            sink(self, emotion_idx)
+        return True
+
+    def create_extractor(self, part):
+        """Return an extractor of the ``face`` or ``emotion`` net and its model name.
+
+        The extractor keeps its net alive, so a net swapped meanwhile is
+        only released once the extraction is over.
+        """
+        with self._net_lock:
+            if part == "face":
+                return self.face_net.create_extractor(), self.face_model
+            return self.emo_net.create_extractor(), self.emotion_model
+
+    def swap_net(self, part, net, model):
+        """Use ``net``, named ``model``, for the next ``part`` extractions.
+
+        Returns the net it replaces.
+        """
+        with self._net_lock:
+            if part == "face":
+                old, self.face_net, self.face_model = self.face_net, net, model
+            else:
+                old, self.emo_net, self.emotion_model = self.emo_net, net, model
+        return old
+
+    def record_latency(self, model, seconds):
+        self.model_latency[model].append(seconds)
 
-        mat = ncnn.Mat.from_pixels(
-            self.shared_resized_frame, ncnn.Mat.PixelType.PIXEL_RGB, *self.face_size
+    def _detect_faces(self):
+        if self._face_input is None:
+            return None, None
+
+        ex, model = self.create_extractor("face")
+        start = time.perf_counter()
+        out0, out1 = self.extract_faces(ex)
+        self.record_latency(model, time.perf_counter() - start)
+        return self.decode_boxes(
+            out0,
+            out1,
+            score_threshold=self.score_threshold,
+            iou_threshold=self.iou_threshold,
+            return_scores=True,
         )
-        mat.substract_mean_normalize([127, 127, 127], [1.0 / 128] * 3)
 
-        ex = self.face_net.create_extractor()
-        ex.input("in0", mat)
+    def extract_faces(self, ex):
+        """Run the face net on the prepared frame with the extractor ``ex``."""
+        ex.input("in0", self._face_input)
         _, out0 = ex.extract("out0")
         _, out1 = ex.extract("out1")
+        return out0, out1
 
-        return self.decode_boxes(out0, out1, score_threshold=0.7, iou_threshold=0.3)
-
-    def _classify_emotion(self, frame: np.ndarray):
-        if self.latest_detection is None or len(self.latest_detection) == 0:
+    def _classify_emotion(self, frame: np.ndarray, snapshot=None):
+        if snapshot is None:
+            snapshot = self.latest_snapshot
+        if not snapshot.boxes:
             return
 
-        x, y, x2, y2 = self.latest_detection[0]
+        x, y, x2, y2 = snapshot.boxes[0]
         w = x2 - x
         h = y2 - y
         padding = 0.1  # 10% padding
@@ -169,39 +375,92 @@ class FaceEmotionDetector:
         y_pad = int(h * padding)
         x1 = max(0, x - x_pad)
         y1 = max(0, y - y_pad)
-        x2 = min(frame.shape[1], x + w + x_pad)
-        y2 = min(frame.shape[0], y + h + y_pad)
+        x2 = min(self.face_size[0], x + w + x_pad)
+        y2 = min(self.face_size[1], y + h + y_pad)
 
-        face = frame[y1:y2, x1:x2]
-
-        if face.size == 0:
+        if x2 <= x1 or y2 <= y1:
             return
 
-        face_bgr = cv2.cvtColor(face, cv2.COLOR_RGB2BGR)
-
-        gray = cv2.cvtColor(face_bgr, cv2.COLOR_BGR2GRAY)
-        resized = cv2.resize(gray, self.emo_size)
+        # Boxes are in face_size coordinates, crop from the full frame
+        pixel_format = self.video_capture.pixel_format
+        frame_width, frame_height = frame_size(frame, pixel_format)
+        scale_x = frame_width / self.face_size[0]
+        scale_y = frame_height / self.face_size[1]
+        roi_x = int(x1 * scale_x)
+        roi_y = int(y1 * scale_y)
+        roi_w = min(frame_width - roi_x, int((x2 - x1) * scale_x))
+        roi_h = min(frame_height - roi_y, int((y2 - y1) * scale_y))
+
+        if roi_w <= 0 or roi_h <= 0:
+            return
 
-        mat = ncnn.Mat.from_pixels(
-            resized, ncnn.Mat.PixelType.PIXEL_GRAY, *self.emo_size
+        # Crop, grey conversion and resize in a single pass. YUV frames
+        # already carry the grey image in their Y plane.
+        gray_plane = luma_plane(frame, pixel_format)
+        if gray_plane is not None:
+            source, pixel_type = gray_plane, ncnn.Mat.PixelType.PIXEL_GRAY
+        else:
+            source, pixel_type = frame, ncnn.Mat.PixelType.PIXEL_BGR2GRAY
+        mat = ncnn.Mat.from_pixels_roi_resize(
+            source,
+            pixel_type,
+            frame_width,
+            frame_height,
+            roi_x,
+            roi_y,
+            roi_w,
+            roi_h,
+            *self.emo_size,
         )
 
-        ex = self.emo_net.create_extractor()
-        ex.input("in0", mat)
-
-        _, out = ex.extract("out0")
-        scores = np.array(out)
-        probs = self.softmax(scores)
-        probs[self.emotion_labels.index("triste")] *= 10
+        crop = np.array(mat)[0]
+        if self.face_quality is not None:
+            score = snapshot.scores[0] if snapshot.scores else 1.0
+            if not self.face_quality.accept(
+                (x, y, x + w, y + h), score, crop, self.face_size
+            ):
+                return self.SKIPPED
+
+        probs = None
+        if self.emotion_cache is not None:
+            box = (x1, y1, x2, y2)
+            probs = self.emotion_cache.lookup(box, crop)
+
+        if probs is None:
+            ex, model = self.create_extractor("emotion")
+            start = time.perf_counter()
+            ex.input("in0", mat)
+
+            _, out = ex.extract("out0")
+            self.record_latency(model, time.perf_counter() - start)
+            scores = np.array(out)
+            probs = self.softmax(scores)
+            probs[self.emotion_labels.index("triste")] *= self.TRISTE_BOOST
+            if self.emotion_cache is not None:
+                self.emotion_cache.store(box, crop, probs)
+        self.latest_probabilities = probs
+        with self._snapshot_lock:
+            # The probabilities only go with the boxes they were computed for
+            if self.latest_snapshot is snapshot:
+                self.latest_snapshot = snapshot.with_probabilities(probs)
         return int(np.argmax(probs))
 
     def softmax(self, x):
         e_x = np.exp(x - np.max(x))
         return e_x / e_x.sum(axis=0)
 
-    def decode_boxes(self, scores, boxes, score_threshold=0.7, iou_threshold=0.2):
+    def decode_boxes(
+        self,
+        scores,
+        boxes,
+        score_threshold=0.7,
+        iou_threshold=0.2,
+        return_scores=False,
+    ):
         """
         Convert raw outputs into actual (x, y, w, h) bounding boxes.
+
+        With ``return_scores`` the face scores are returned as well.
         """
         # Convert NCNN mats to numpy arrays
         scores_np = np.array(scores)  # shape: (4420, 2)
@@ -230,7 +489,21 @@ class FaceEmotionDetector:
         )
 
         final_boxes = [boxes_abs[i].astype(int) for i in indices]
+        if return_scores:
+            return final_boxes, [float(filtered_scores[i]) for i in indices]
         return final_boxes
 
+    @property
+    def latest_detection(self):
+        return self.latest_snapshot.boxes
+
+    @property
+    def latest_scores(self):
+        return self.latest_snapshot.scores
+
     def get_latest_detection(self):
-        return self.latest_detection
+        return self.latest_snapshot.boxes
+
+    def get_latest_snapshot(self):
+        """Return the boxes, scores and probabilities of one frame, together."""
+        return self.latest_snapshot
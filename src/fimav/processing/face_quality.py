@@ -0,0 +1,100 @@
+import collections
+import cv2
+import numpy as np
+
+
+class FaceQuality:
+    """Rejects faces too poor for the emotion net to classify reliably.
+
+    A face passes when:
+
+    - its box height is at least ``min_size`` of the detector input height,
+    - its width/height ratio is within ``aspect_range`` (side views and
+      partly hidden faces give narrow or flat boxes),
+    - the detector scored it at least ``min_score``,
+    - it is not cut by the image border (within ``border_margin`` pixels),
+    - the Laplacian variance of its grey crop, as fed to the emotion net,
+      is at least ``min_sharpness`` (motion blur, out of focus).
+
+    The box checks run on every box at once. A ``min_size``, ``min_score``
+    or ``min_sharpness`` of 0 disables that check; by default only the
+    aspect and border checks run, the thresholds depend on the camera and
+    are set from the command line.
+    """
+
+    def __init__(
+        self,
+        min_size=0.0,
+        aspect_range=(0.45, 1.2),
+        min_score=0.0,
+        border_margin=1,
+        min_sharpness=0.0,
+    ):
+        self.min_size = min_size
+        self.aspect_range = aspect_range
+        self.min_score = min_score
+        self.border_margin = border_margin
+        self.min_sharpness = min_sharpness
+
+        self.checks = 0
+        self.rejections = collections.Counter()
+
+    def box_reasons(self, boxes, scores, face_size):
+        """Return, for each box, the first failed check or None."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        width, height = face_size
+        box_w = boxes[:, 2] - boxes[:, 0]
+        box_h = boxes[:, 3] - boxes[:, 1]
+        aspect = box_w / np.maximum(box_h, 1)
+        margin = self.border_margin
+
+        checks = (
+            ("too small", box_h < self.min_size * height),
+            (
+                "aspect",
+                (aspect < self.aspect_range[0]) | (aspect > self.aspect_range[1]),
+            ),
+            ("low score", scores < self.min_score),
+            (
+                "truncated",
+                (boxes[:, 0] < margin)
+                | (boxes[:, 1] < margin)
+                | (boxes[:, 2] > width - margin)
+                | (boxes[:, 3] > height - margin),
+            ),
+        )
+        reasons = [None] * len(boxes)
+        for reason, failed in reversed(checks):
+            for i in np.flatnonzero(failed):
+                reasons[i] = reason
+        return reasons
+
+    def sharpness(self, crop):
+        """Return the Laplacian variance of a grey crop."""
+        crop = np.asarray(crop, dtype=np.float32)
+        return float(cv2.Laplacian(crop, cv2.CV_32F).var())
+
+    def accept(self, box, score, crop, face_size):
+        """Return True when the face ``box``/``crop`` is worth classifying."""
+        self.checks += 1
+        reason = self.box_reasons([box], [score], face_size)[0]
+        if (
+            reason is None
+            and self.min_sharpness > 0
+            and self.sharpness(crop) < self.min_sharpness
+        ):
+            reason = "blurred"
+        if reason is not None:
+            self.rejections[reason] += 1
+            return False
+        return True
+
+    def stats(self):
+        rejected = sum(self.rejections.values())
+        return {
+            "checks": self.checks,
+            "rejected": rejected,
+            "reject_rate": rejected / max(self.checks, 1),
+            "reasons": dict(self.rejections),
+        }
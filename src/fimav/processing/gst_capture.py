@@ -0,0 +1,162 @@
+import functools
+import shutil
+import subprocess
+import threading
+import numpy as np
+
+try:
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+except (ImportError, ValueError):  # pragma: no cover - depends on the host
+    Gst = None
+
+
+# Preferred MJPEG decoders, hardware first
+JPEG_DECODERS = ["v4l2jpegdec", "avdec_mjpeg", "jpegdec"]
+
+# Preferred scalers for the detection branch, hardware first
+SCALERS = ["v4l2convert", "videoscale"]
+
+
+@functools.lru_cache(maxsize=None)
+def _init_gst():
+    """Initialize GStreamer on first use, return False without the bindings."""
+    if Gst is None:
+        return False
+    Gst.init(None)
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def has_element(name):
+    """Return True if the GStreamer element ``name`` is installed on this host."""
+    if _init_gst():
+        return Gst.ElementFactory.find(name) is not None
+
+    inspect = shutil.which("gst-inspect-1.0")
+    if inspect is None:
+        return False
+    try:
+        result = subprocess.run(
+            [inspect, "--exists", name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=5,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def pick_element(candidates, fallback=None):
+    """Return the first installed element of ``candidates``."""
+    for name in candidates:
+        if has_element(name):
+            return name
+    return fallback if fallback is not None else candidates[-1]
+
+
+def can_open_dual_branch():
+    """The two-appsink pipeline needs the GStreamer Python bindings."""
+    return _init_gst()
+
+
+def _sample_to_array(sample, channels=3, allocate=None):
+    """Copy the frame of ``sample`` to an array from ``allocate(shape)``."""
+    allocate = allocate or (lambda shape: np.empty(shape, np.uint8))
+    buf = sample.get_buffer()
+    structure = sample.get_caps().get_structure(0)
+    width = structure.get_value("width")
+    height = structure.get_value("height")
+    pixel_format = structure.get_value("format")
+
+    ok, info = buf.map(Gst.MapFlags.READ)
+    if not ok:
+        return None
+    try:
+        data = np.frombuffer(info.data, dtype=np.uint8)
+        if pixel_format in ("I420", "NV12"):
+            # Planar frames are returned as one (height * 3 / 2, width) array
+            rows = height * 3 // 2
+            source = data[: rows * width].reshape(rows, width)
+        else:
+            # Rows may be padded to a 4 byte stride
+            stride = data.size // height
+            frame = data.reshape(height, stride)[:, : width * channels]
+            source = frame.reshape(height, width, channels)
+        frame = allocate(source.shape)
+        np.copyto(frame, source)
+        return frame
+    finally:
+        buf.unmap(info)
+
+
+class GstDualSinkCapture:
+    """Reads a ``tee`` pipeline with a ``display`` and a ``detect`` appsink.
+
+    OpenCV only exposes a single appsink, so this drives the pipeline with
+    the GStreamer bindings. The display branch is pulled on demand like
+    ``cv2.VideoCapture.read``; the detection branch is kept up to date from
+    GStreamer's streaming thread so the latest small frame is always ready.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.pipeline = None
+        self._display_sink = None
+        self._latest_detection_frame = None
+        self._lock = threading.Lock()
+        # Optional BufferPool for the detection frames
+        self.buffer_pool = None
+
+    def open(self):
+        _init_gst()
+        self.pipeline = Gst.parse_launch(self.description)
+        self._display_sink = self.pipeline.get_by_name("display")
+        detect_sink = self.pipeline.get_by_name("detect")
+        detect_sink.set_property("emit-signals", True)
+        detect_sink.connect("new-sample", self._on_detection_sample)
+
+        result = self.pipeline.set_state(Gst.State.PLAYING)
+        return result != Gst.StateChangeReturn.FAILURE
+
+    def _on_detection_sample(self, sink):
+        sample = sink.emit("pull-sample")
+        if sample is not None:
+            pool = self.buffer_pool
+            frame = _sample_to_array(
+                sample, allocate=pool.checkout if pool is not None else None
+            )
+            with self._lock:
+                previous, self._latest_detection_frame = (
+                    self._latest_detection_frame,
+                    frame,
+                )
+            if pool is not None:
+                pool.release(previous)
+        return Gst.FlowReturn.OK
+
+    def read(self, image=None, timeout=1.0):
+        """Pull a display frame, into ``image`` when it has the frame's shape."""
+        sample = self._display_sink.emit("try-pull-sample", int(timeout * Gst.SECOND))
+        if sample is None:
+            return False, None
+
+        def allocate(shape):
+            if image is not None and image.shape == shape:
+                return image
+            return np.empty(shape, np.uint8)
+
+        frame = _sample_to_array(sample, allocate=allocate)
+        return frame is not None, frame
+
+    def latest_detection_frame(self):
+        with self._lock:
+            return self._latest_detection_frame
+
+    def release(self):
+        if self.pipeline is not None:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
@@ -0,0 +1,184 @@
+import collections
+import threading
+import time
+from fimav import thread_policy
+
+
+class FaceBatchScheduler:
+    """Runs the face net for every registered camera from one inference thread.
+
+    Each tick the scheduler waits at most ``window`` seconds for every source
+    to deliver a new frame, then runs the frames gathered, a "batch", on the
+    shared net and hands each detector back its own boxes. A source never
+    waits longer than its ``max_wait``: as soon as its frame is that old the
+    batch is flushed with whatever is ready.
+
+    This is scheduled sequential extraction, not batched inference: the
+    UltraFace ncnn model has no batch dimension, so each frame of a batch
+    still gets its own extraction and the face net's CPU cost grows linearly
+    with the number of cameras. What the scheduler saves is contention:
+    the extractions run back to back from one thread, each free to use every
+    core, instead of N detector threads fighting for them, and the cameras
+    are detected at a common, bounded latency.
+    """
+
+    def __init__(self, fps=20, window=0.01, max_wait=0.05, history=200):
+        self.fps = fps
+        self.window = window
+        self.max_wait = max_wait
+
+        self._sources = []
+        self._max_waits = {}
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=history)
+        )
+        self._slo_misses = collections.Counter()
+        self.batches = 0
+        self.batched_frames = 0
+
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def register(self, detector, max_wait=None):
+        """Add a detector whose face stage should go through the scheduler."""
+        with self._lock:
+            self._sources.append(detector)
+            self._max_waits[detector.name] = (
+                self.max_wait if max_wait is None else max_wait
+            )
+
+    def unregister(self, detector):
+        with self._lock:
+            self._sources.remove(detector)
+            self._max_waits.pop(detector.name, None)
+            self._last_seen.pop(detector.name, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="face-batch-scheduler", daemon=True
+        )
+        self._thread.start()
+        thread_policy.register(self._thread, "face")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        period = 1.0 / self.fps
+        next_tick = time.monotonic()
+
+        while not self._stop_event.is_set():
+            batch = self._collect()
+            if batch:
+                self.run_batch(batch)
+
+            next_tick += period
+            wait = next_tick - time.monotonic()
+            if wait > 0:
+                self._stop_event.wait(wait)
+            else:
+                # Running late: start the next tick now instead of bursting
+                next_tick = time.monotonic()
+
+    def _is_fresh(self, detector):
+        frame_count = detector.video_capture.frame_count
+        return frame_count and frame_count != self._last_seen.get(detector.name)
+
+    def _frame_age(self, detector, now):
+        frame_time = detector.video_capture.latest_frame_time
+        return 0.0 if frame_time is None else now - frame_time
+
+    def _collect(self):
+        """Wait for new frames from the registered sources, within the window."""
+        with self._lock:
+            sources = list(self._sources)
+        deadline = time.monotonic() + self.window
+
+        while True:
+            now = time.monotonic()
+            fresh = [d for d in sources if self._is_fresh(d)]
+            if len(fresh) == len(sources) or now >= deadline:
+                return fresh
+            # Flush early rather than break a source's latency budget
+            if any(
+                self._frame_age(d, now) >= self._max_waits.get(d.name, self.max_wait)
+                for d in fresh
+            ):
+                return fresh
+            if self._stop_event.wait(0.001):
+                return []
+
+    def run_batch(self, detectors):
+        """Detect faces for ``detectors`` and publish each result to its owner."""
+        ready = []
+        for detector in detectors:
+            self._last_seen[detector.name] = detector.video_capture.frame_count
+            if not detector.reuse_detection() and detector.prepare_face_frame():
+                ready.append(detector)
+
+        outputs = []
+        for detector in ready:
+            ex, model = detector.create_extractor("face")
+            start = time.perf_counter()
+            outputs.append(detector.extract_faces(ex))
+            elapsed = time.perf_counter() - start
+            detector.record_latency(model, elapsed)
+            if detector.motion_gate is not None:
+                detector.motion_gate.record_detection(elapsed)
+
+        now = time.monotonic()
+        for detector, (out0, out1) in zip(ready, outputs):
+            boxes, scores = detector.decode_boxes(
+                out0,
+                out1,
+                score_threshold=detector.score_threshold,
+                iou_threshold=detector.iou_threshold,
+                return_scores=True,
+            )
+            detector.publish_detection(boxes, scores)
+
+            latency = self._frame_age(detector, now)
+            self._latencies[detector.name].append(latency)
+            if latency > self._max_waits.get(detector.name, self.max_wait):
+                self._slo_misses[detector.name] += 1
+
+        self.batches += 1
+        self.batched_frames += len(ready)
+
+    def stats(self):
+        """Return per-source latency percentiles and SLO misses."""
+        stats = {}
+        with self._lock:
+            names = [d.name for d in self._sources]
+        for name in names:
+            latencies = sorted(self._latencies[name])
+            if latencies:
+                p50 = latencies[len(latencies) // 2]
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            else:
+                p50 = p95 = 0.0
+            stats[name] = {
+                "p50_ms": p50 * 1000,
+                "p95_ms": p95 * 1000,
+                "slo_misses": self._slo_misses[name],
+            }
+        return stats
+
+    def format_report(self):
+        mean_batch = self.batched_frames / self.batches if self.batches else 0.0
+        lines = [f"Face batches: {self.batches}, mean size {mean_batch:.1f}"]
+        for name, s in self.stats().items():
+            lines.append(
+                f"  {name}: latency p50 {s['p50_ms']:.1f} ms, "
+                f"p95 {s['p95_ms']:.1f} ms, SLO misses {s['slo_misses']}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,78 @@
+import threading
+from fimav.processing.model_store import ModelStore
+from fimav.processing.tuning import net_configurator
+
+
+class ModelBank:
+    """Loads each ncnn network once so several pipelines can share the weights.
+
+    An ``ncnn.Net`` can be used from many threads at once as long as every
+    caller creates its own extractor, so the bank only hands out nets and each
+    detector keeps creating its extractors per frame. Files are found and
+    verified by a ``ModelStore``.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or ModelStore()
+        self._nets = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get_net(self, param_path, bin_path, options=None):
+        """Return the shared net for ``param_path``/``bin_path``, loading it once.
+
+        ``options`` (``num_threads``, ``precision``) are applied before
+        loading; the same files loaded with other options give another net.
+        Different models load in parallel, callers asking for a model that is
+        being loaded wait for it.
+        """
+        options = {
+            key: value
+            for key, value in (options or {}).items()
+            if key in ("num_threads", "precision")
+        }
+        key = (param_path, bin_path, tuple(sorted(options.items())))
+        with self._lock:
+            net = self._nets.get(key)
+            if net is not None:
+                return net
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                net = self._nets.get(key)
+            if net is None:
+                net = self.store.load_net(
+                    param_path, bin_path, net_configurator(options)
+                )
+                with self._lock:
+                    self._nets[key] = net
+                    self._loading.pop(key, None)
+            return net
+
+    def forget(self, net):
+        """Stop handing out ``net``, return the ``(param, bin)`` it was loaded from.
+
+        The net itself lives on while anything still references it.
+        """
+        with self._lock:
+            for key, cached in list(self._nets.items()):
+                if cached is net:
+                    del self._nets[key]
+                    return key[:2]
+        return None
+
+    def uses_file(self, bin_path):
+        """Return True when a net of the bank was loaded from ``bin_path``."""
+        path = self.store.resolve(bin_path)
+        with self._lock:
+            keys = list(self._nets)
+        return any(self.store.resolve(key[1]) == path for key in keys)
+
+    def loaded_models(self):
+        with self._lock:
+            return list(self._nets.keys())
+
+    def clear(self):
+        with self._lock:
+            self._nets.clear()
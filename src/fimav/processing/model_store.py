@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import ncnn
+from fimav.cache import cache_dir
+
+# Repository checkout: src/fimav/processing -> models/
+_REPO_MODELS_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "models")
+)
+
+
+def model_name(path):
+    """Return the name of model file ``path``, its base name without extension."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class ModelIntegrityError(RuntimeError):
+    """Raised when a model file does not match its recorded checksum."""
+
+
+class ModelStore:
+    """Finds, verifies and maps the ncnn model files.
+
+    Paths such as ``models/face/ultraface_12.param`` are looked up, in order,
+    as given, in ``$FIMAV_MODELS_DIR`` and in the ``models`` directory of a
+    source checkout, so the app no longer depends on the working directory.
+
+    Each weight file is read once into a ``bytes`` buffer owned by the store.
+    The ncnn binding only loads weights from ``bytes`` (not from a mmap) and
+    references that buffer without copying it, so every net loaded from a
+    file shares this one copy; other processes get their own. The SHA-256 of
+    each file is cached with its size and mtime and only computed again when
+    they change, and a ``<file>.sha256`` sidecar, when present, is checked
+    against it.
+    """
+
+    def __init__(self, models_dir=None, cache_path=None):
+        self.search_dirs = [
+            d
+            for d in (
+                models_dir,
+                os.environ.get("FIMAV_MODELS_DIR"),
+                _REPO_MODELS_DIR,
+            )
+            if d
+        ]
+        self.cache_path = cache_path or os.path.join(cache_dir(), "models.json")
+        self._checksums = self._read_cache()
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, path):
+        """Return the absolute path of model file ``path``."""
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+
+        relative = os.path.normpath(path)
+        parts = relative.split(os.sep)
+        if parts[0] == "models":
+            relative = os.path.join(*parts[1:])
+        for directory in self.search_dirs:
+            candidate = os.path.join(directory, relative)
+            if os.path.isfile(candidate):
+                return candidate
+        raise FileNotFoundError(f"Model not found: {path}")
+
+    def resolve_contained(self, path):
+        """Resolve ``path`` only to a file inside one of the search directories.
+
+        For paths coming from outside the app: raises ``PermissionError`` when
+        the file, symbolic links followed, lies anywhere else.
+        """
+        resolved = os.path.realpath(self.resolve(path))
+        for directory in self.search_dirs:
+            directory = os.path.realpath(directory)
+            if os.path.commonpath([resolved, directory]) == directory:
+                return resolved
+        raise PermissionError(f"{path} is outside the model directories")
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._checksums, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def _verify(self, path, data):
+        """Return the SHA-256 of ``data``, read from ``path``, and check it.
+
+        The cached checksum is trusted while the size and mtime of the file
+        are unchanged, otherwise ``data`` is hashed again.
+        """
+        stat = os.stat(path)
+        cached = self._checksums.get(path)
+        if (
+            cached is not None
+            and cached["size"] == stat.st_size
+            and cached["mtime_ns"] == stat.st_mtime_ns
+        ):
+            digest = cached["sha256"]
+        else:
+            digest = hashlib.sha256(data).hexdigest()
+            self._checksums[path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest,
+            }
+            self._write_cache()
+
+        sidecar = path + ".sha256"
+        if os.path.isfile(sidecar):
+            with open(sidecar) as f:
+                expected = f.read().split()[0].lower()
+            if digest != expected:
+                raise ModelIntegrityError(f"{path} does not match {sidecar}")
+        return digest
+
+    def _map(self, path):
+        """Return ``(buffer, sha256)`` for ``path``, reading it only once."""
+        path = self.resolve(path)
+        with self._lock:
+            entry = self._weights.get(path)
+            if entry is not None:
+                return entry
+
+            with open(path, "rb") as f:
+                buffer = f.read()
+            entry = (buffer, self._verify(path, buffer))
+            self._weights[path] = entry
+            return entry
+
+    def checksum(self, path):
+        """Return the verified SHA-256 of model file ``path``."""
+        return self._map(path)[1]
+
+    def load_net(self, param_path, bin_path, configure=None):
+        """Create a net from ``param_path``/``bin_path``.
+
+        ``configure`` is called with the new net before loading, to set its
+        options (threads, precision...) which ncnn reads at load time.
+        """
+        weights, _ = self._map(bin_path)
+        with open(self.resolve(param_path)) as f:
+            param = f.read()
+
+        net = ncnn.Net()
+        if configure is not None:
+            configure(net)
+        if net.load_param_mem(param) != 0:
+            raise ValueError(f"Could not load model graph: {param_path}")
+        # ncnn references the weights, the store keeps them alive
+        net.load_model_mem(weights)
+        return net
+
+    def release(self, bin_path):
+        """Forget the buffer of ``bin_path``.
+
+        Only call this once every net loaded from the file has been dropped,
+        their layers point into the buffer.
+        """
+        with self._lock:
+            self._weights.pop(self.resolve(bin_path), None)
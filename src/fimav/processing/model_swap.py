@@ -0,0 +1,226 @@
+import statistics
+import sys
+import threading
+import time
+import numpy as np
+import ncnn
+from fimav.processing.model_store import model_name
+
+PARTS = ("face", "emotion")
+# Outputs the detector reads from each net
+_OUTPUTS = {"face": ("out0", "out1"), "emotion": ("out0",)}
+# References to a replaced net once nothing uses it: the retiring list and
+# getrefcount's own argument
+_UNUSED_REFS = 2
+
+
+class ModelSwapError(RuntimeError):
+    """Raised when a model cannot replace the running one."""
+
+
+class ModelSwapper:
+    """Replaces the face or emotion net of running detectors.
+
+    The new net is loaded through the ``ModelBank``, run ``WARMUP`` times on
+    a blank input of the detector's size, and its output shapes are compared
+    with the running net's before every detector switches to it, each under
+    its own lock. The detector threads keep running throughout, so no frame
+    is dropped: an extraction started before the swap finishes on the old
+    net, whose extractor keeps it alive. The old net is then forgotten by the
+    bank, and its weights released once no extraction references it any
+    more, or after ``RELEASE_TIMEOUT`` seconds the weights are kept.
+    """
+
+    WARMUP = 5
+    RELEASE_TIMEOUT = 10.0
+
+    def __init__(self, bank, detectors):
+        self.bank = bank
+        self.detectors = list(detectors)
+        # One swap at a time
+        self._lock = threading.Lock()
+        # (time, part, model, warm-up ms) of each swap
+        self.swaps = []
+
+    def swap(self, part, param_path, bin_path, options=None, callback=None):
+        """Swap in the background, then call ``callback(part, model, error)``.
+
+        Returns the thread doing the swap.
+        """
+
+        def run():
+            model, error = model_name(bin_path), None
+            try:
+                warmup = self.swap_now(part, param_path, bin_path, options)
+                print(f"Model swap: {part} now uses {model} (warm-up {warmup:.1f} ms)")
+            except (RuntimeError, OSError, ValueError) as e:
+                error = str(e)
+                print(f"Model swap: {part} kept its model, {model} failed: {error}")
+            if callback is not None:
+                callback(part, model, error)
+
+        thread = threading.Thread(target=run, name="model-swap", daemon=True)
+        thread.start()
+        return thread
+
+    def swap_now(self, part, param_path, bin_path, options=None):
+        """Load, warm up, verify and swap in a model, return its warm-up ms.
+
+        Each detector gets the model loaded with ``options``, by default the
+        options of its running net (its autotuned threads and precision).
+        Raises ``ModelSwapError`` when the model does not fit the running
+        one, and leaves the detectors untouched.
+        """
+        if part not in PARTS:
+            raise ModelSwapError(f"Unknown model part: {part}")
+        if not self.detectors:
+            raise ModelSwapError("No detector to swap the model of")
+        model = model_name(bin_path)
+
+        with self._lock:
+            nets, durations = [], None
+            try:
+                for detector in self.detectors:
+                    net = self.bank.get_net(
+                        param_path,
+                        bin_path,
+                        options if options is not None else detector.net_options[part],
+                    )
+                    loaded = any(net is other for other in nets)
+                    nets.append(net)
+                    if not loaded:
+                        timings = self._warm_up(part, detector, net, model)
+                        durations = durations or timings
+            except (RuntimeError, OSError, ValueError):
+                # Nothing runs the rejected nets
+                for net in nets:
+                    if not self._in_use(net):
+                        self.bank.forget(net)
+                if nets and not self.bank.uses_file(bin_path):
+                    self.bank.store.release(bin_path)
+                raise
+
+            retiring = []
+            for detector, net in zip(self.detectors, nets):
+                old = detector.swap_net(part, net, model)
+                if old is not net and not any(old is r for r in retiring):
+                    retiring.append(old)
+            del old, net, nets
+            warmup = statistics.median(durations)
+            self.swaps.append((time.time(), part, model, warmup))
+
+        keys = [self.bank.forget(old) for old in retiring]
+        threading.Thread(
+            target=self._release,
+            args=(retiring, keys),
+            name="model-release",
+            daemon=True,
+        ).start()
+        return warmup
+
+    def _warm_up(self, part, detector, net, model):
+        """Run ``net`` ``WARMUP`` times, return the ms of each run.
+
+        Raises ``ModelSwapError`` when its outputs do not match the
+        detector's running net.
+        """
+        probe = _probe_input(part, detector)
+        expected = _output_shapes(detector.create_extractor(part)[0], part, probe)
+        durations = []
+        for _ in range(self.WARMUP):
+            start = time.perf_counter()
+            shapes = _output_shapes(net.create_extractor(), part, probe)
+            durations.append((time.perf_counter() - start) * 1000)
+        if shapes != expected:
+            raise ModelSwapError(
+                f"{model} outputs {shapes}, the running {part} model {expected}"
+            )
+        return durations
+
+    def _in_use(self, net):
+        return any(
+            net is detector.face_net or net is detector.emo_net
+            for detector in self.detectors
+        )
+
+    def _release(self, retiring, keys):
+        """Release the weights of each net in ``retiring`` once it is unused."""
+        deadline = time.monotonic() + self.RELEASE_TIMEOUT
+        while retiring:
+            i = 0
+            while i < len(retiring):
+                if sys.getrefcount(retiring[i]) <= _UNUSED_REFS:
+                    del retiring[i]
+                    key = keys.pop(i)
+                    if key is not None and not self.bank.uses_file(key[1]):
+                        self.bank.store.release(key[1])
+                else:
+                    i += 1
+            if time.monotonic() > deadline:
+                print(f"Model swap: {len(retiring)} replaced nets still in use")
+                return
+            time.sleep(0.05)
+
+    def latency_stats(self):
+        """Return ``{model: (extractions, median ms, p95 ms)}`` over all detectors."""
+        samples = {}
+        for detector in self.detectors:
+            for model, latencies in list(detector.model_latency.items()):
+                samples.setdefault(model, []).extend(latencies)
+        stats = {}
+        for model, latencies in samples.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            stats[model] = (
+                len(latencies),
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.95)] * 1000,
+            )
+        return stats
+
+    def format_report(self):
+        lines = ["Model latency:"]
+        for model, (count, median, p95) in sorted(self.latency_stats().items()):
+            lines.append(
+                f"  {model:<28} {count:6d} runs, median {median:6.2f} ms,"
+                f" p95 {p95:6.2f} ms"
+            )
+        for swapped_at, part, model, warmup in self.swaps:
+            at = time.strftime("%H:%M:%S", time.localtime(swapped_at))
+            lines.append(
+                f"  swapped {part} to {model} at {at} (warm-up {warmup:.1f} ms)"
+            )
+        return "\n".join(lines)
+
+
+def _probe_input(part, detector):
+    """Return a blank input of the detector's size for ``part``."""
+    if part == "face":
+        width, height = detector.face_size
+        mat = ncnn.Mat.from_pixels(
+            np.zeros((height, width, 3), np.uint8),
+            ncnn.Mat.PixelType.PIXEL_RGB,
+            width,
+            height,
+        )
+        mat.substract_mean_normalize([127, 127, 127], [1.0 / 128] * 3)
+        return mat
+    width, height = detector.emo_size
+    return ncnn.Mat.from_pixels(
+        np.zeros((height, width), np.uint8),
+        ncnn.Mat.PixelType.PIXEL_GRAY,
+        width,
+        height,
+    )
+
+
+def _output_shapes(ex, part, mat):
+    ex.input("in0", mat)
+    shapes = []
+    for name in _OUTPUTS[part]:
+        ret, out = ex.extract(name)
+        if ret != 0:
+            raise ModelSwapError(f"The {part} model has no {name} output")
+        shapes.append(np.array(out).shape)
+    return tuple(shapes)
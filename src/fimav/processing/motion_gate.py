@@ -0,0 +1,101 @@
+import time
+import cv2
+import numpy as np
+from fimav.processing.video_capture import luma_plane
+
+
+class MotionGate:
+    """Decides whether a frame is worth running the face net on.
+
+    Each frame is reduced to a tiny grey thumbnail and compared with a
+    running-average background. When less than ``min_changed`` of the pixels
+    differ by more than ``pixel_threshold`` the scene is considered static
+    and the previous detection can be kept. A detection is still forced
+    every ``refresh_interval`` seconds, so a face that stopped moving, or
+    left slowly enough to blend into the background, is not kept forever.
+    """
+
+    def __init__(
+        self,
+        size=(32, 24),
+        pixel_threshold=12,
+        min_changed=0.01,
+        learning_rate=0.05,
+        refresh_interval=2.0,
+        clock=time.monotonic,
+    ):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.learning_rate = learning_rate
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+
+        self._background = None
+        self._last_detection = None
+
+        # Statistics
+        self.checks = 0
+        self.skipped = 0
+        self.gate_seconds = 0.0
+        self.detections = 0
+        self.detection_seconds = 0.0
+
+    def thumbnail(self, frame, pixel_format="BGR"):
+        """Return the tiny grey image the gate compares."""
+        plane = luma_plane(frame, pixel_format)
+        if plane is not None:
+            return cv2.resize(plane, self.size, interpolation=cv2.INTER_AREA)
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def needs_detection(self, frame, pixel_format="BGR"):
+        """Return True when the face net should run on ``frame``."""
+        start = time.perf_counter()
+        gray = self.thumbnail(frame, pixel_format)
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            motion = True
+        else:
+            diff = cv2.absdiff(gray.astype(np.float32), self._background)
+            changed = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            motion = changed >= self.min_changed
+            cv2.accumulateWeighted(gray, self._background, self.learning_rate)
+
+        now = self.clock()
+        due = (
+            self._last_detection is None
+            or now - self._last_detection >= self.refresh_interval
+        )
+        self.checks += 1
+        self.gate_seconds += time.perf_counter() - start
+
+        if motion or due:
+            self._last_detection = now
+            return True
+        self.skipped += 1
+        return False
+
+    def record_detection(self, seconds):
+        """Record how long a detection the gate let through took."""
+        self.detections += 1
+        self.detection_seconds += seconds
+
+    def reset(self):
+        self._background = None
+        self._last_detection = None
+
+    def stats(self):
+        """Return the skip rate and the detection time saved, in seconds.
+
+        The saving is estimated from the mean duration of the detections
+        that did run, minus the time spent in the gate itself.
+        """
+        mean_detection = self.detection_seconds / max(self.detections, 1)
+        return {
+            "checks": self.checks,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / max(self.checks, 1),
+            "saved_seconds": self.skipped * mean_detection - self.gate_seconds,
+        }
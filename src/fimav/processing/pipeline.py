@@ -0,0 +1,364 @@
+import logging
+import os
+import threading
+import time
+from fimav import thread_policy
+from fimav.processing.choices import SCHEDULING_MODES
+from fimav.processing.video_capture import VideoCapture
+from fimav.processing.face_emotion_detector import FaceEmotionDetector
+from fimav.processing.emotion_state_controller import EmotionStateController
+from fimav.processing.inference_scheduler import FaceBatchScheduler
+
+_logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """Wires one camera source to its detector, state controller and sinks.
+
+    Nothing in a pipeline is global: several pipelines can live in the same
+    process and share their ncnn weights through a common ``ModelBank``.
+    """
+
+    def __init__(
+        self,
+        name,
+        video_capture,
+        detector,
+        emotion_controller,
+        capture_thread=True,
+    ):
+        self.name = name
+        self.video_capture = video_capture
+        self.detector = detector
+        self.emotion_controller = emotion_controller
+        self.capture_thread = capture_thread
+
+        self.running = False
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._started_at = None
+        self._baseline = (0, 0, 0)
+
+    @classmethod
+    def create(
+        cls,
+        name,
+        model_bank,
+        midi_controller,
+        camera_index=0,
+        camera_width=1920,
+        camera_height=1080,
+        face_size=(320, 240),
+        capture_thread=True,
+        decoder="auto",
+        detection_branch=False,
+        pixel_format="BGR",
+        **model_paths,
+    ):
+        """Build a pipeline for one camera using the default components."""
+        video_capture = VideoCapture(
+            camera_index,
+            camera_width,
+            camera_height,
+            face_size,
+            decoder,
+            detection_branch,
+            pixel_format,
+        )
+        return cls.from_capture(
+            name,
+            video_capture,
+            model_bank,
+            midi_controller,
+            face_size,
+            capture_thread,
+            **model_paths,
+        )
+
+    @classmethod
+    def from_capture(
+        cls,
+        name,
+        video_capture,
+        model_bank,
+        midi_controller,
+        face_size=(320, 240),
+        capture_thread=True,
+        **model_paths,
+    ):
+        """Build a pipeline around an existing, possibly already open, capture."""
+        emotion_controller = EmotionStateController(midi_controller)
+        detector = FaceEmotionDetector(
+            video_capture,
+            emotion_controller,
+            model_bank,
+            face_size=face_size,
+            name=name,
+            **model_paths,
+        )
+        return cls(name, video_capture, detector, emotion_controller, capture_thread)
+
+    def add_sink(self, on_faces=None, on_emotion=None):
+        """Register callbacks receiving ``(detector, boxes)`` / ``(detector, idx)``."""
+        if on_faces is not None:
+            self.detector.face_sinks.append(on_faces)
+        if on_emotion is not None:
+            self.detector.emotion_sinks.append(on_emotion)
+
+    def start(self, threaded=True):
+        """Open the camera and, if ``threaded``, start the detector threads.
+
+        With ``threaded=False`` the caller (usually a ``PipelineGroup``) is
+        responsible for calling :meth:`step`.
+        """
+        if self.running:
+            return True
+        if not self.video_capture.start_capture():
+            return False
+
+        self.running = True
+        self._started_at = time.monotonic()
+        self._baseline = self._counters()
+        self._stop_event.clear()
+
+        if self.capture_thread:
+            self._thread = threading.Thread(
+                target=self._capture_loop, name=f"{self.name}-capture", daemon=True
+            )
+            self._thread.start()
+
+        if threaded:
+            self.detector.start_processing()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        self.detector.stop_processing()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.video_capture.stop_capture()
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            if self.video_capture.get_new_frame() is None:
+                self._stop_event.wait(0.1)
+
+    def step(self, now, next_face, next_emotion, face=True):
+        """Run whichever detector stage is due at ``now``.
+
+        With ``face=False`` only the emotion stage is run, the face stage
+        being handled elsewhere (see ``FaceBatchScheduler``).
+
+        Returns the updated ``(next_face, next_emotion)`` deadlines.
+        """
+        if not face:
+            next_face = float("inf")
+        elif now >= next_face:
+            self.detector.process_face_frame()
+            next_face = now + 1.0 / self.detector.face_fps
+        if now >= next_emotion:
+            self.detector.process_emotion()
+            next_emotion = now + 1.0 / self.detector.emotion_fps
+        return next_face, next_emotion
+
+    def _counters(self):
+        return (
+            self.video_capture.frame_count,
+            self.detector.face_frames,
+            self.detector.emotion_frames,
+        )
+
+    def stats(self):
+        """Return the frame rates measured since the pipeline was started."""
+        elapsed = max(time.monotonic() - (self._started_at or time.monotonic()), 1e-6)
+        captured, faces, emotions = (
+            now - base for now, base in zip(self._counters(), self._baseline)
+        )
+        stats = {
+            "name": self.name,
+            "captured_fps": captured / elapsed,
+            "face_fps": faces / elapsed,
+            "emotion_fps": emotions / elapsed,
+        }
+        if self.detector.motion_gate is not None:
+            stats["motion_gate"] = self.detector.motion_gate.stats()
+        if self.detector.emotion_cache is not None:
+            stats["emotion_cache"] = self.detector.emotion_cache.stats()
+        if self.detector.face_quality is not None:
+            stats["face_quality"] = self.detector.face_quality.stats()
+        return stats
+
+
+class PipelineGroup:
+    """Runs several pipelines in one process.
+
+    Scheduling modes:
+
+    - ``threads``: every detector keeps its own face/emotion threads.
+    - ``round-robin``: a single worker steps every pipeline in turn.
+    - ``per-core``: one worker per CPU core, pipelines split between them and
+      each worker pinned to its core when the platform allows it.
+    - ``batched``: a ``FaceBatchScheduler`` runs the face stage of every
+      camera from one inference thread, one extraction per frame in turn
+      (the face net has no batch input), a single worker runs the emotions.
+    """
+
+    SCHEDULING_MODES = SCHEDULING_MODES
+
+    def __init__(
+        self,
+        pipelines,
+        scheduling="threads",
+        workers=None,
+        report_interval=0,
+        batch_window=0.01,
+        max_wait=0.05,
+    ):
+        if scheduling not in self.SCHEDULING_MODES:
+            raise ValueError(f"Unknown scheduling mode: {scheduling}")
+        self.pipelines = list(pipelines)
+        self.scheduling = scheduling
+        self.report_interval = report_interval
+
+        self.batch_scheduler = None
+        if scheduling == "batched":
+            self.batch_scheduler = FaceBatchScheduler(
+                FaceEmotionDetector.FACE_FPS, batch_window, max_wait
+            )
+            for pipeline in self.pipelines:
+                self.batch_scheduler.register(pipeline.detector)
+
+        if scheduling in ("round-robin", "batched"):
+            workers = 1
+        elif workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, min(workers, len(self.pipelines) or 1))
+
+        self._threads = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._stop_event.clear()
+        threaded = self.scheduling == "threads"
+        for pipeline in self.pipelines:
+            if not pipeline.start(threaded=threaded):
+                print(f"Pipeline {pipeline.name} could not start")
+
+        if not threaded:
+            for worker_idx in range(self.workers):
+                assigned = self.pipelines[worker_idx :: self.workers]
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    args=(worker_idx, assigned),
+                    name=f"pipeline-worker-{worker_idx}",
+                    daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+                # With a batch scheduler the workers only run the emotions
+                thread_policy.register(
+                    thread, "emotion" if self.batch_scheduler is not None else "worker"
+                )
+
+        if self.batch_scheduler is not None:
+            self.batch_scheduler.start()
+
+        if self.report_interval > 0:
+            thread = threading.Thread(
+                target=self._report_loop, name="pipeline-report", daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.batch_scheduler is not None:
+            self.batch_scheduler.stop()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for pipeline in self.pipelines:
+            pipeline.stop()
+
+    def _worker_loop(self, worker_idx, pipelines):
+        if self.scheduling == "per-core" and hasattr(os, "sched_setaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+            try:
+                os.sched_setaffinity(0, {cores[worker_idx % len(cores)]})
+            except OSError as e:
+                _logger.warning("Could not pin worker %d: %s", worker_idx, e)
+
+        face = self.batch_scheduler is None
+        deadlines = {pipeline.name: (0.0, 0.0) for pipeline in pipelines}
+        while not self._stop_event.is_set():
+            due = []
+            for pipeline in pipelines:
+                if not pipeline.running:
+                    continue
+                next_face, next_emotion = deadlines[pipeline.name]
+                deadlines[pipeline.name] = pipeline.step(
+                    time.monotonic(), next_face, next_emotion, face
+                )
+                due.extend(deadlines[pipeline.name])
+
+            # A stopped pipeline keeps its past deadlines, it must not wake us
+            if due:
+                next_due = min(due)
+                wait = next_due - time.monotonic()
+                if wait > 0:
+                    self._stop_event.wait(wait)
+            else:
+                self._stop_event.wait(0.1)
+
+    def _report_loop(self):
+        while not self._stop_event.wait(self.report_interval):
+            _logger.info(self.format_report())
+
+    def stats(self):
+        per_pipeline = [pipeline.stats() for pipeline in self.pipelines]
+        total = {
+            "name": "total",
+            "captured_fps": sum(s["captured_fps"] for s in per_pipeline),
+            "face_fps": sum(s["face_fps"] for s in per_pipeline),
+            "emotion_fps": sum(s["emotion_fps"] for s in per_pipeline),
+        }
+        return per_pipeline, total
+
+    def format_report(self):
+        per_pipeline, total = self.stats()
+        lines = [f"Pipeline throughput ({self.scheduling}, {self.workers} worker(s)):"]
+        for s in per_pipeline + [total]:
+            lines.append(
+                f"  {s['name']}: capture {s['captured_fps']:.1f} fps, "
+                f"face {s['face_fps']:.1f} fps, emotion {s['emotion_fps']:.1f} fps"
+            )
+            gate = s.get("motion_gate")
+            if gate is not None:
+                lines.append(
+                    f"    motion gate: skipped {gate['skipped']}/{gate['checks']}"
+                    f" detections ({gate['skip_rate']:.0%}),"
+                    f" {gate['saved_seconds']:.2f} s of CPU saved"
+                )
+            cache = s.get("emotion_cache")
+            if cache is not None:
+                lines.append(
+                    f"    emotion cache: {cache['hits']} hit(s),"
+                    f" {cache['misses']} miss(es) ({cache['hit_rate']:.0%} hit rate)"
+                )
+            quality = s.get("face_quality")
+            if quality is not None:
+                reasons = ", ".join(
+                    f"{reason} {count}" for reason, count in quality["reasons"].items()
+                )
+                lines.append(
+                    f"    face quality: rejected {quality['rejected']}/"
+                    f"{quality['checks']} face(s) ({quality['reject_rate']:.0%})"
+                    + (f": {reasons}" if reasons else "")
+                )
+        if self.batch_scheduler is not None:
+            lines.append(self.batch_scheduler.format_report())
+        return "\n".join(lines)
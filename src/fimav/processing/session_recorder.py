@@ -0,0 +1,244 @@
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+SESSION_FILE = "session.json"
+EVENTS_FILE = "events.jsonl"
+FRAME_FILES = {"raw": "frames.raw", "jpeg": "frames.jpeg"}
+
+
+class SessionRecorder:
+    """Records what a detector saw and decided, for deterministic replays.
+
+    A session is a directory holding:
+
+    - ``frames.raw`` (fixed size frames, read back through ``np.memmap``) or
+      ``frames.jpeg`` (concatenated JPEG images),
+    - ``events.jsonl`` with one line per face detection and per emotion
+      classification, timestamped relative to the start of the recording,
+    - ``session.json`` with the frame layout and the tuning in use.
+
+    Frames are recorded at the face detection rate, the ones the detector
+    actually processed. Encoding and writing happen on a background thread so
+    the detector threads only pay for a queue put; frames and emotion events
+    are dropped (and counted apart) if the writer falls behind.
+    """
+
+    def __init__(self, path, encoding="jpeg", jpeg_quality=90, max_pending=64):
+        if encoding not in FRAME_FILES:
+            raise ValueError(f"Unknown frame encoding: {encoding}")
+        self.path = path
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.dropped_frames = 0
+        self.dropped_events = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._detector = None
+        self._t0 = None
+        self._frame_index = 0
+        self._frame_shape = None
+        self._offset = 0
+
+    def attach(self, pipeline):
+        """Start recording the detector of ``pipeline``."""
+        self.start(pipeline.detector)
+        pipeline.add_sink(on_faces=self._on_faces, on_emotion=self._on_emotion)
+
+    def start(self, detector):
+        if detector.video_capture.pixel_format != "BGR":
+            # Planar YUV frames cannot go through the JPEG encoder
+            self.encoding = "raw"
+        os.makedirs(self.path, exist_ok=True)
+        self._detector = detector
+        self._t0 = time.monotonic()
+        self._frames_file = open(
+            os.path.join(self.path, FRAME_FILES[self.encoding]), "wb"
+        )
+        self._events_file = open(os.path.join(self.path, EVENTS_FILE), "w")
+        self._thread = threading.Thread(
+            target=self._write_loop, name="session-recorder", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._frames_file.close()
+        self._events_file.close()
+        self._write_session()
+
+    def _now(self):
+        return time.monotonic() - self._t0
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if item[0] == "faces":
+                self.dropped_frames += 1
+            else:
+                self.dropped_events += 1
+
+    def _on_faces(self, detector, boxes):
+        frame = detector.latest_snapshot.frame
+        if frame is None:
+            return
+        boxes = [[int(v) for v in box] for box in boxes or []]
+        self._put(("faces", self._now(), frame, boxes))
+
+    def _on_emotion(self, detector, emotion_idx):
+        probs = detector.latest_probabilities
+        controller = detector.emotion_controller
+        self._put(
+            (
+                "emotion",
+                self._now(),
+                emotion_idx,
+                None if probs is None else [float(p) for p in probs],
+                controller.target_emotion,
+                controller.last_emotion,
+            )
+        )
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if item[0] == "faces":
+                self._write_frame(*item[1:])
+            else:
+                self._write_emotion(*item[1:])
+
+    def _write_frame(self, t, frame, boxes):
+        if self.encoding == "jpeg":
+            ok, encoded = cv2.imencode(
+                ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            )
+            if not ok:
+                return
+            data = encoded.tobytes()
+        else:
+            if self._frame_shape is not None and frame.shape != self._frame_shape:
+                # Raw frames must all have the same shape to be memory-mapped
+                self.dropped_frames += 1
+                return
+            data = frame.tobytes()
+        self._frame_shape = frame.shape
+
+        self._frames_file.write(data)
+        self._write_event(
+            {
+                "type": "faces",
+                "t": t,
+                "frame": self._frame_index,
+                "offset": self._offset,
+                "size": len(data),
+                "boxes": boxes,
+            }
+        )
+        self._offset += len(data)
+        self._frame_index += 1
+
+    def _write_emotion(self, t, emotion_idx, probs, target, last):
+        self._write_event(
+            {
+                "type": "emotion",
+                "t": t,
+                "frame": self._frame_index - 1,
+                "emotion": emotion_idx,
+                "probs": probs,
+                "target": target,
+                "last": last,
+            }
+        )
+
+    def _write_event(self, event):
+        self._events_file.write(json.dumps(event) + "\n")
+
+    def _write_session(self):
+        detector = self._detector
+        session = {
+            "encoding": self.encoding,
+            "pixel_format": detector.video_capture.pixel_format,
+            "frame_shape": list(self._frame_shape) if self._frame_shape else None,
+            "frames": self._frame_index,
+            "dropped_frames": self.dropped_frames,
+            "dropped_events": self.dropped_events,
+            "face_size": list(detector.face_size),
+            "face_fps": detector.face_fps,
+            "emotion_fps": detector.emotion_fps,
+            "score_threshold": detector.score_threshold,
+            "iou_threshold": detector.iou_threshold,
+            "delay": detector.emotion_controller.DELAY,
+        }
+        with open(os.path.join(self.path, SESSION_FILE), "w") as f:
+            json.dump(session, f, indent=2)
+
+
+class SessionReader:
+    """Gives random access to the frames and events of a recorded session."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, SESSION_FILE)) as f:
+            self.session = json.load(f)
+
+        self.face_events = []
+        self.emotion_events = []
+        with open(os.path.join(path, EVENTS_FILE)) as f:
+            for line in f:
+                event = json.loads(line)
+                if event["type"] == "faces":
+                    self.face_events.append(event)
+                else:
+                    self.emotion_events.append(event)
+
+        self.encoding = self.session["encoding"]
+        self.pixel_format = self.session["pixel_format"]
+        self.face_size = tuple(self.session["face_size"])
+
+        frames_path = os.path.join(path, FRAME_FILES[self.encoding])
+        self._frames = None
+        self._file = None
+        self._map = None
+        if not self.face_events:
+            return
+        if self.encoding == "raw":
+            shape = (len(self.face_events),) + tuple(self.session["frame_shape"])
+            self._frames = np.memmap(frames_path, dtype=np.uint8, mode="r", shape=shape)
+        else:
+            self._file = open(frames_path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.face_events)
+
+    def frame(self, index):
+        """Return frame ``index`` in the recorded pixel format."""
+        if self._frames is not None:
+            return self._frames[index]
+        event = self.face_events[index]
+        data = np.frombuffer(
+            self._map, dtype=np.uint8, count=event["size"], offset=event["offset"]
+        )
+        return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+    def close(self):
+        self._frames = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
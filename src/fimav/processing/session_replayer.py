@@ -0,0 +1,250 @@
+import time
+import numpy as np
+from fimav.midi.midi_library import MidiLibrary
+from fimav.processing.emotion_state_controller import EmotionStateController
+from fimav.processing.face_emotion_detector import FaceEmotionDetector
+from fimav.processing.video_capture import to_rgb
+
+
+class ReplayClock:
+    """Clock driven by the recorded timestamps instead of the wall clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ReplaySource:
+    """Feeds the frames of a ``SessionReader`` in place of a ``VideoCapture``."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.pixel_format = reader.pixel_format
+        self.frame_count = 0
+        self.latest_frame_time = None
+        self._latest_frame = None
+        self._index = 0
+
+    def start_capture(self):
+        self._index = 0
+        return len(self.reader) > 0
+
+    def stop_capture(self):
+        pass
+
+    def show(self, index, timestamp):
+        """Make recorded frame ``index`` the latest captured frame."""
+        self._latest_frame = self.reader.frame(index)
+        self.latest_frame_time = timestamp
+        self.frame_count += 1
+        return self._latest_frame
+
+    def get_new_frame(self):
+        if self._index >= len(self.reader):
+            return None
+        frame = self.show(self._index, time.monotonic())
+        self._index += 1
+        return frame
+
+    def get_latest_frame(self):
+        return self._latest_frame
+
+    def get_latest_detection_frame(self):
+        return None
+
+    def to_rgb(self, frame, out=None):
+        return to_rgb(frame, self.pixel_format, out)
+
+
+class ReplayMidi:
+    """Stands in for the ``MidiController`` and records the triggered songs.
+
+    A song is considered playing for ``song_length`` seconds of replay time.
+    """
+
+    def __init__(self, clock, song_length=30.0, library=None):
+        self.clock = clock
+        self.library = library or MidiLibrary()
+        self.song_length = song_length
+        self.triggers = []
+        self._playing_until = None
+
+    def play_midi_file(self, midi_file_name, trace=None):
+        self.triggers.append((self.clock(), midi_file_name))
+        self._playing_until = self.clock() + self.song_length
+
+    def crossfade(self, midi_file_name, duration=2.0, trace=None):
+        self.play_midi_file(midi_file_name)
+
+    def is_playing(self):
+        return self._playing_until is not None and self.clock() < self._playing_until
+
+    def stop(self):
+        self._playing_until = None
+
+
+def replay_session(
+    reader,
+    model_bank,
+    model_paths,
+    realtime=False,
+    tuning=None,
+    song_length=30.0,
+    library=None,
+):
+    """Run a recorded session through a fresh detector and state controller.
+
+    The controller runs on the recorded timestamps, so the decisions are the
+    same whether the replay is paced in ``realtime`` or runs at full speed.
+    ``tuning`` may override ``delay``, ``score_threshold``,
+    ``iou_threshold`` and ``emotion_fps``. Songs are picked from
+    ``library``, by default the ``midi`` directory.
+
+    Returns one result row per recorded frame.
+    """
+    session = dict(reader.session)
+    session.update(tuning or {})
+
+    clock = ReplayClock()
+    source = ReplaySource(reader)
+    midi = ReplayMidi(clock, song_length, library)
+    controller = EmotionStateController(midi, clock)
+    controller.DELAY = session["delay"]
+    detector = FaceEmotionDetector(
+        source,
+        controller,
+        model_bank,
+        face_size=reader.face_size,
+        name="replay",
+        autotune=False,
+        **model_paths,
+    )
+    detector.score_threshold = session["score_threshold"]
+    detector.iou_threshold = session["iou_threshold"]
+    detector.emotion_fps = session["emotion_fps"]
+
+    results = []
+    next_emotion = None
+    wall_start = time.monotonic()
+    t0 = reader.face_events[0]["t"] if len(reader) else 0.0
+
+    for index, event in enumerate(reader.face_events):
+        t = event["t"]
+        if realtime:
+            wait = wall_start + (t - t0) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+        clock.now = t
+        source.show(index, t)
+
+        start = time.perf_counter()
+        detector.process_face_frame()
+        row = {
+            "frame": index,
+            "t": t,
+            "boxes": [[int(v) for v in box] for box in detector.latest_detection],
+            "face_ms": (time.perf_counter() - start) * 1000,
+        }
+
+        if next_emotion is None or t >= next_emotion:
+            start = time.perf_counter()
+            detector.process_emotion()
+            probs = detector.latest_probabilities
+            row.update(
+                {
+                    "emotion_ms": (time.perf_counter() - start) * 1000,
+                    "probs": None if probs is None else [float(p) for p in probs],
+                    "target": controller.target_emotion,
+                    "last": controller.last_emotion,
+                }
+            )
+            next_emotion = t + 1.0 / detector.emotion_fps
+
+        results.append(row)
+
+    return results
+
+
+def recorded_results(reader):
+    """Return the recorded events in the same layout as ``replay_session``."""
+    results = [
+        {"frame": e["frame"], "t": e["t"], "boxes": e["boxes"]}
+        for e in reader.face_events
+    ]
+    for e in reader.emotion_events:
+        if 0 <= e["frame"] < len(results) and "probs" not in results[e["frame"]]:
+            results[e["frame"]].update(
+                {"probs": e["probs"], "target": e["target"], "last": e["last"]}
+            )
+    return results
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _song_changes(results):
+    changes = []
+    last = None
+    for row in results:
+        if "last" in row and row["last"] != last:
+            last = row["last"]
+            changes.append((row["frame"], last))
+    return changes
+
+
+def _timing(results, key):
+    values = np.array([row[key] for row in results if key in row])
+    if values.size == 0:
+        return None
+    return {"mean": float(values.mean()), "p95": float(np.percentile(values, 95))}
+
+
+def compare_results(baseline, current):
+    """Diff two result lists frame by frame.
+
+    Returns a dict with face count mismatches, the mean IoU of the first box,
+    emotion mismatches, song decisions that differ and the stage timings of
+    both runs (timings are missing for a live recording).
+    """
+    frames = min(len(baseline), len(current))
+    face_mismatches = 0
+    ious = []
+    emotion_frames = 0
+    emotion_mismatches = 0
+
+    for base, cur in zip(baseline[:frames], current[:frames]):
+        if len(base["boxes"]) != len(cur["boxes"]):
+            face_mismatches += 1
+        elif base["boxes"]:
+            ious.append(_iou(base["boxes"][0], cur["boxes"][0]))
+
+        base_probs, cur_probs = base.get("probs"), cur.get("probs")
+        if base_probs is not None and cur_probs is not None:
+            emotion_frames += 1
+            if int(np.argmax(base_probs)) != int(np.argmax(cur_probs)):
+                emotion_mismatches += 1
+
+    base_songs = _song_changes(baseline)
+    cur_songs = _song_changes(current)
+    return {
+        "frames": frames,
+        "face_count_mismatches": face_mismatches,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "emotion_frames": emotion_frames,
+        "emotion_mismatches": emotion_mismatches,
+        "baseline_song_changes": base_songs,
+        "song_changes": cur_songs,
+        "song_decisions_match": [e for _, e in base_songs] == [e for _, e in cur_songs],
+        "baseline_face_ms": _timing(baseline, "face_ms"),
+        "face_ms": _timing(current, "face_ms"),
+        "baseline_emotion_ms": _timing(baseline, "emotion_ms"),
+        "emotion_ms": _timing(current, "emotion_ms"),
+    }
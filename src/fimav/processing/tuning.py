@@ -0,0 +1,94 @@
+import json
+import os
+import platform
+from fimav.cache import cache_dir
+
+# ncnn options for each precision the autotuner tries
+PRECISIONS = {
+    "fp32": {
+        "use_fp16_packed": False,
+        "use_fp16_storage": False,
+        "use_fp16_arithmetic": False,
+        "use_bf16_storage": False,
+    },
+    "fp16": {
+        "use_fp16_packed": True,
+        "use_fp16_storage": True,
+        "use_fp16_arithmetic": True,
+        "use_bf16_storage": False,
+    },
+    "bf16": {
+        "use_fp16_packed": False,
+        "use_fp16_storage": False,
+        "use_fp16_arithmetic": False,
+        "use_bf16_storage": True,
+    },
+}
+
+
+def net_configurator(options):
+    """Return a callable setting ``options`` on a net before it is loaded.
+
+    ``options`` may hold ``num_threads`` and ``precision`` (a key of
+    ``PRECISIONS``); missing keys keep the ncnn defaults.
+    """
+
+    def configure(net):
+        if options.get("num_threads"):
+            net.opt.num_threads = options["num_threads"]
+        for name, value in PRECISIONS.get(options.get("precision"), {}).items():
+            setattr(net.opt, name, value)
+
+    return configure
+
+
+def cpu_model():
+    """Return a readable name of this host's CPU."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("model name", "Model", "Hardware"):
+                    return value.strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def tuning_path():
+    return os.path.join(cache_dir(), "autotune.json")
+
+
+def tuning_key(store, face_bin, emo_bin):
+    """Key of a tuning result: the CPU and the exact model files."""
+    checksums = []
+    for path in (face_bin, emo_bin):
+        try:
+            checksums.append(store.checksum(path)[:16])
+        except FileNotFoundError:
+            checksums.append("missing")
+    return "|".join([cpu_model(), f"{os.cpu_count()} cpus"] + checksums)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_tuning(store, face_bin, emo_bin, path=None):
+    """Return the tuning saved for this host and these models, or None."""
+    return _read(path or tuning_path()).get(tuning_key(store, face_bin, emo_bin))
+
+
+def save_tuning(store, face_bin, emo_bin, tuning, path=None):
+    path = path or tuning_path()
+    results = _read(path)
+    results[tuning_key(store, face_bin, emo_bin)] = tuning
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -1,62 +1,175 @@
 import cv2
+import time
+import numpy as np
+from fimav.processing.choices import PIXEL_FORMATS
+from fimav.processing.gst_capture import (
+    GstDualSinkCapture,
+    JPEG_DECODERS,
+    SCALERS,
+    can_open_dual_branch,
+    pick_element,
+)
 
 # Global OpenCV optimizations
 # cv2.setNumThreads(0)  # Disable OpenCV's internal threading
 # cv2.ocl.setUseOpenCL(False)  # Disable OpenCL (optional, depends on platform)
 # print(cv2.getBuildInformation())
 
+_YUV_TO_RGB = {"I420": cv2.COLOR_YUV2RGB_I420, "NV12": cv2.COLOR_YUV2RGB_NV12}
+
+
+def frame_size(frame, pixel_format="BGR"):
+    """Return the ``(width, height)`` of the picture stored in ``frame``."""
+    if pixel_format == "BGR":
+        return frame.shape[1], frame.shape[0]
+    return frame.shape[1], frame.shape[0] * 2 // 3
+
+
+def luma_plane(frame, pixel_format="BGR"):
+    """Return the Y plane of a YUV frame without copying, None for BGR."""
+    if pixel_format == "BGR":
+        return None
+    _, height = frame_size(frame, pixel_format)
+    return frame[:height]
+
+
+def to_rgb(frame, pixel_format="BGR", out=None):
+    """Convert a captured frame to RGB, in ``out`` or a new array."""
+    if pixel_format == "BGR":
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=out)
+    return cv2.cvtColor(frame, _YUV_TO_RGB[pixel_format], dst=out)
+
+
+def resize_yuv_to_rgb(frame, pixel_format, size, pool=None):
+    """Scale the planes of a YUV frame to ``size`` then convert them to RGB.
+
+    Resizing the planes first means the colour conversion only runs at the
+    target size instead of the full capture resolution. With a
+    ``BufferPool``, the work buffers come from it and the caller releases the
+    returned image to it.
+    """
+    width, height = frame_size(frame, pixel_format)
+    target_width, target_height = size
+    chroma = frame[height:]
+    shape = (target_height * 3 // 2, target_width)
+    small = pool.checkout(shape) if pool is not None else np.empty(shape, np.uint8)
+    cv2.resize(frame[:height], size, dst=small[:target_height])
+
+    chroma_size = (target_width // 2, target_height // 2)
+    if pixel_format == "I420":
+        quarter = chroma.size // 2
+        planes = chroma.reshape(-1)
+        u = planes[:quarter].reshape(height // 2, width // 2)
+        v = planes[quarter:].reshape(height // 2, width // 2)
+        small_chroma = np.concatenate(
+            [
+                cv2.resize(u, chroma_size).reshape(-1),
+                cv2.resize(v, chroma_size).reshape(-1),
+            ]
+        )
+    else:
+        uv = chroma.reshape(height // 2, width // 2, 2)
+        small_chroma = cv2.resize(uv, chroma_size).reshape(-1)
+    small[target_height:] = small_chroma.reshape(-1, target_width)
 
-class VideoCapture:
-    _instance = None
+    out = None
+    if pool is not None:
+        out = pool.checkout((target_height, target_width, 3))
+    rgb = cv2.cvtColor(small, _YUV_TO_RGB[pixel_format], dst=out)
+    if pool is not None:
+        pool.release(small)
+    return rgb
 
-    def __new__(cls, __camera_index__=0, __camera_width__=1920, __camera_height__=1080):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
 
+class VideoCapture:
     def __init__(
         self,
         camera_index=0,
         camera_width=1920,
         camera_height=1080,
+        face_size=(320, 240),
+        decoder="auto",
+        detection_branch=False,
+        pixel_format="BGR",
     ):
-        if getattr(self, "_initialized", False):
-            return
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
 
         self.camera_index = camera_index
         self.camera_width = camera_width
         self.camera_height = camera_height
+        self.face_size = face_size
+        self.decoder = decoder
+        self.detection_branch = detection_branch
+        self.pixel_format = pixel_format
         self.cap = None
         self._latest_frame = None
-        self._initialized = True
-
-    @classmethod
-    def get_instance(cls):
-        """Return the singleton, or raise if not yet created."""
-        if cls._instance is None or not getattr(cls._instance, "_initialized", False):
-            raise RuntimeError("VideoCapture has not been initialized")
-        return cls._instance
-
-    def gstreamer_pipeline(self):
-        return (
+        self.frame_count = 0
+        self.latest_frame_time = None
+        # Optional BufferPool the frames are read into
+        self.buffer_pool = None
+        self._frame_shape = None
+
+    def jpeg_decoder(self):
+        """Return the MJPEG decoder to use, preferring hardware decoders."""
+        if self.decoder != "auto":
+            return self.decoder
+        return pick_element(JPEG_DECODERS)
+
+    def gstreamer_pipeline(self, detection_branch=False):
+        source = (
             f"v4l2src device=/dev/video{self.camera_index} ! "
             f"image/jpeg, width={self.camera_width}, height={self.camera_height}, framerate=30/1 ! "
             f"jpegparse ! "
-            f"jpegdec ! "
+            f"{self.jpeg_decoder()} ! "
+        )
+        if not detection_branch:
+            return source + (
+                f"videoconvert ! "
+                f"video/x-raw, format={self.pixel_format} ! "
+                f"queue min-threshold-buffers=1 max-size-buffers=1 leaky=downstream ! "
+                f"appsink sync=false drop=true max-buffers=1"
+            )
+
+        # Full resolution frames for the display, and a branch scaled down to
+        # the detector input before any colour conversion
+        face_width, face_height = self.face_size
+        return source + (
+            f"tee name=t "
+            f"t. ! queue max-size-buffers=1 leaky=downstream ! "
             f"videoconvert ! "
-            f"video/x-raw, format=BGR ! "
-            f"queue min-threshold-buffers=1 max-size-buffers=1 leaky=downstream ! "
-            f"appsink sync=false drop=true"
+            f"video/x-raw, format={self.pixel_format} ! "
+            f"appsink name=display sync=false drop=true max-buffers=1 "
+            f"t. ! queue max-size-buffers=1 leaky=downstream ! "
+            f"{pick_element(SCALERS)} ! "
+            f"video/x-raw, width={face_width}, height={face_height} ! "
+            f"videoconvert ! "
+            f"video/x-raw, format=RGB ! "
+            f"appsink name=detect sync=false drop=true max-buffers=1"
         )
 
     def start_capture(self):
+        if self.cap is not None:
+            # Already opened, for example during startup
+            return True
+
+        if self.detection_branch:
+            if can_open_dual_branch():
+                return self._start_dual_capture()
+            print("VideoCapture: GStreamer bindings missing, using a single branch")
+
         pipeline = self.gstreamer_pipeline()
         self.cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
 
         if not self.cap.isOpened():
             print(f"Error: Could not open camera {self.camera_index}")
+            self.cap = None
             return False
 
+        if self.pixel_format != "BGR":
+            # Keep the raw planes instead of letting OpenCV convert to BGR
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
         print(
             f"Actual resolution: {self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)} x {self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)}"
         )
@@ -64,21 +177,47 @@ class VideoCapture:
 
         return True
 
+    def _start_dual_capture(self):
+        self.cap = GstDualSinkCapture(self.gstreamer_pipeline(detection_branch=True))
+        self.cap.buffer_pool = self.buffer_pool
+        if not self.cap.open():
+            print(f"Error: Could not open camera {self.camera_index}")
+            self.cap = None
+            return False
+
+        print(f"Decoder: {self.jpeg_decoder()}, detection branch at {self.face_size}")
+        return True
+
     def stop_capture(self):
         """
         Stops the video capture process and releases resources.
         """
-        if self.cap and self.cap.isOpened():
+        if isinstance(self.cap, GstDualSinkCapture):
+            self.cap.release()
+            self.cap = None
+        elif self.cap and self.cap.isOpened():
             self.cap.release()
             self.cap = None
 
     def get_new_frame(self):
-        ret, frame = self.cap.read()
+        pool = self.buffer_pool
+        image = None
+        if pool is not None and self._frame_shape is not None:
+            image = pool.checkout(self._frame_shape)
+        ret, frame = self.cap.read(image)
+        if image is not None and frame is not image:
+            pool.release(image)
         if not ret:
             print("VideoCapture: Error reading frame.")
             return None
 
-        self._latest_frame = frame
+        self._frame_shape = frame.shape
+        previous, self._latest_frame = self._latest_frame, frame
+        self.latest_frame_time = time.monotonic()
+        self.frame_count += 1
+        if pool is not None and previous is not None:
+            # Reused once the detector and the display are done with it
+            pool.release(previous)
         return frame
 
     def get_latest_frame(self):
@@ -86,3 +225,16 @@ class VideoCapture:
         Retrieves the latest captured frame atomically.
         """
         return self._latest_frame
+
+    def to_rgb(self, frame, out=None):
+        """Convert a frame of this capture to RGB, in ``out`` or a new array."""
+        return to_rgb(frame, self.pixel_format, out)
+
+    def get_latest_detection_frame(self):
+        """
+        Retrieves the latest RGB frame of the detection branch, already at
+        ``face_size``, or None when the pipeline has no detection branch.
+        """
+        if isinstance(self.cap, GstDualSinkCapture):
+            return self.cap.latest_detection_frame()
+        return None
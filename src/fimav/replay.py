@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import sys
+from fimav import __version__
+from fimav.processing.model_bank import ModelBank
+from fimav.processing.session_recorder import SessionReader
+from fimav.processing.session_replayer import (
+    compare_results,
+    recorded_results,
+    replay_session,
+)
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded session through the detector"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument("session", help="Directory written by fimav-run --record")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Pace the replay on the recorded timestamps instead of full speed",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Results JSON to compare against (default: the live recording)",
+    )
+    parser.add_argument("--output", help="Write the replay results to this JSON file")
+    parser.add_argument("--delay", type=float, help="Override the emotion hold delay")
+    parser.add_argument("--score-threshold", type=float, help="Override the face score")
+    parser.add_argument("--iou-threshold", type=float, help="Override the NMS IoU")
+    parser.add_argument("--emotion-fps", type=float, help="Override the emotion rate")
+    parser.add_argument(
+        "--face-param", default="models/face/ultraface_12.param", help="Face net"
+    )
+    parser.add_argument(
+        "--face-bin", default="models/face/ultraface_12.bin", help="Face weights"
+    )
+    parser.add_argument(
+        "--emo-param",
+        default="models/emotion/emotion_ferplus_12.param",
+        help="Emotion net",
+    )
+    parser.add_argument(
+        "--emo-bin",
+        default="models/emotion/emotion_ferplus_12.bin",
+        help="Emotion weights",
+    )
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    reader = SessionReader(args.session)
+    tuning = {
+        key: value
+        for key, value in (
+            ("delay", args.delay),
+            ("score_threshold", args.score_threshold),
+            ("iou_threshold", args.iou_threshold),
+            ("emotion_fps", args.emotion_fps),
+        )
+        if value is not None
+    }
+    model_paths = {
+        "face_param": args.face_param,
+        "face_bin": args.face_bin,
+        "emo_param": args.emo_param,
+        "emo_bin": args.emo_bin,
+    }
+
+    results = replay_session(
+        reader, ModelBank(), model_paths, realtime=args.realtime, tuning=tuning
+    )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    else:
+        baseline = recorded_results(reader)
+    reader.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"tuning": tuning, "results": results}, f)
+
+    print(json.dumps(compare_results(baseline, results), indent=2))
+    _logger.info("Script ends here")
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
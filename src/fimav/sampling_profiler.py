@@ -0,0 +1,125 @@
+import collections
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stack of every thread.
+
+    A background thread reads ``sys._current_frames()`` every ``interval``
+    seconds for ``duration`` seconds and counts the stacks per thread name,
+    so the face, emotion and display loops each get their own profile
+    without the overhead of a tracing profiler. Each run writes one
+    collapsed-stack file per thread to ``output_dir``
+    (``<run>-<thread>.folded``), the input of ``flamegraph.pl``,
+    speedscope or inferno.
+    """
+
+    DURATION = 30.0
+
+    def __init__(self, output_dir, interval=0.005, duration=DURATION):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.duration = duration
+        self._labels = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+        # Reentrant, the SIGUSR1 handler may interrupt start() on the main thread
+        self._lock = threading.RLock()
+        self._runs = 0
+
+    def start(self, duration=None):
+        """Start a run, False when one is already going."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop_event.clear()
+            self._runs += 1
+            run = f"{time.strftime('%Y%m%d-%H%M%S')}-{self._runs}"
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(run, duration or self.duration),
+                name="profiler",
+                daemon=True,
+            )
+            self._thread.start()
+        return True
+
+    def stop(self):
+        """End the current run early, its profiles are still written."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def install_signal(self, signum=getattr(signal, "SIGUSR1", None)):
+        """Start a run whenever the process receives ``signum``.
+
+        Returns False where the signal does not exist (Windows).
+        """
+        if signum is None:
+            return False
+        signal.signal(signum, lambda *_: self.start())
+        return True
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = (
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{code.co_firstlineno})"
+            )
+            self._labels[code] = label
+        return label
+
+    def sample(self, stacks, skip):
+        """Add the current stack of every thread but ``skip`` to ``stacks``."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            name = names.get(ident, f"thread-{ident}")
+            stacks[name][";".join(reversed(labels))] += 1
+
+    def _run(self, run, duration):
+        stacks = collections.defaultdict(collections.Counter)
+        started = time.monotonic()
+        deadline = started + duration
+        me = threading.get_ident()
+        sampling = 0.0
+        samples = 0
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            before = time.perf_counter()
+            self.sample(stacks, me)
+            sampling += time.perf_counter() - before
+            samples += 1
+            self._stop_event.wait(self.interval)
+        elapsed = time.monotonic() - started
+
+        paths = self.write(stacks, run)
+        print(
+            f"Profile of {elapsed:.1f} s, {samples} samples"
+            f" ({sampling / max(elapsed, 1e-9) * 100:.1f}% of a core spent sampling):"
+        )
+        for name, path in paths.items():
+            print(f"  {name}: {sum(stacks[name].values())} samples in {path}")
+
+    def write(self, stacks, run):
+        """Write a collapsed-stack file per thread, return the paths by thread."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = {}
+        for name, counter in stacks.items():
+            safe_name = re.sub(r"[^\w.-]", "_", name)
+            path = os.path.join(self.output_dir, f"{run}-{safe_name}.folded")
+            with open(path, "w") as f:
+                for stack, count in counter.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths[name] = path
+        return paths
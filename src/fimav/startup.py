@@ -0,0 +1,82 @@
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StartupTimeline:
+    """Records when each startup phase ran, and on which thread."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, start, time.perf_counter())
+
+    def mark(self, name):
+        """Record an instant, such as the first frame on screen."""
+        now = time.perf_counter()
+        self._add(name, now, now)
+
+    def _add(self, name, start, end):
+        with self._lock:
+            self.phases.append(
+                (name, threading.current_thread().name, start - self.t0, end - self.t0)
+            )
+
+    def format_report(self, width=40):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p[2])
+        total = max((end for _, _, _, end in phases), default=0.0) or 1e-6
+
+        lines = ["Startup timeline:"]
+        for name, thread, start, end in phases:
+            bar_start = min(int(start / total * width), width - 1)
+            bar_len = max(1, min(int((end - start) / total * width), width - bar_start))
+            bar = " " * bar_start + "#" * bar_len
+            lines.append(
+                f"  {name:<22} {start * 1000:8.1f} ms {(end - start) * 1000:8.1f} ms"
+                f"  |{bar:<{width}}| {thread}"
+            )
+        return "\n".join(lines)
+
+
+class StartupOrchestrator:
+    """Runs independent startup steps in parallel.
+
+    Each step names the steps it depends on and receives their results as
+    arguments. Steps are started in submission order, so a step only ever
+    waits on steps that are already running or done.
+    """
+
+    def __init__(self, timeline=None, max_workers=8):
+        self.timeline = timeline or StartupTimeline()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="startup"
+        )
+        self._futures = {}
+
+    def submit(self, name, fn, *depends_on):
+        deps = [self._futures[dep] for dep in depends_on]
+
+        def step():
+            args = [dep.result() for dep in deps]
+            with self.timeline.phase(name):
+                return fn(*args)
+
+        self._futures[name] = self._executor.submit(step)
+        return self._futures[name]
+
+    def result(self, name):
+        """Wait for step ``name`` and return its result, re-raising its error."""
+        return self._futures[name].result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
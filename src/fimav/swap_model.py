@@ -0,0 +1,192 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+from fimav import __version__
+from fimav.mqtt.mqtt_manager import (
+    MODEL_COMMAND_TOPIC,
+    MODEL_STATUS_TOPIC,
+    create_client,
+)
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (for example  ``["--help"]``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Swap the face or emotion model of a running fimav-run, or"
+        " show the latency of its models"
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"fimav {__version__}",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+    parser.add_argument(
+        "part",
+        nargs="?",
+        choices=("face", "emotion"),
+        help="Model to replace, only the latency report without it",
+    )
+    parser.add_argument("param", nargs="?", help="ncnn .param file of the new model")
+    parser.add_argument("bin", nargs="?", help="ncnn .bin file of the new model")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for fimav-run to answer",
+    )
+    parser.add_argument(
+        "--mqtt-host",
+        default=os.environ.get("FIMAV_MQTT_HOST", "localhost"),
+        help="MQTT broker host (FIMAV_MQTT_HOST)",
+    )
+    parser.add_argument(
+        "--mqtt-port",
+        type=int,
+        default=int(os.environ.get("FIMAV_MQTT_PORT", 1884)),
+        help="MQTT broker port (FIMAV_MQTT_PORT)",
+    )
+    parser.add_argument(
+        "--mqtt-user",
+        default=os.environ.get("FIMAV_MQTT_USER", "orchestrateur"),
+        help="MQTT user name (FIMAV_MQTT_USER)",
+    )
+    parser.add_argument(
+        "--mqtt-password",
+        default=os.environ.get("FIMAV_MQTT_PASSWORD", "Orchestrateur1234"),
+        help="MQTT password (FIMAV_MQTT_PASSWORD)",
+    )
+    args = parser.parse_args(args)
+    if args.part is not None and args.bin is None:
+        parser.error("a model swap needs the param and bin files")
+    return args
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def send_command(command, host, port, username, password, timeout):
+    """Send ``command`` to fimav-run and return its status, None on timeout."""
+    command = dict(command, id=uuid.uuid4().hex)
+    replies = {}
+    answered = threading.Event()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(MODEL_STATUS_TOPIC)
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        client.publish(MODEL_COMMAND_TOPIC, json.dumps(command), qos=1)
+
+    def on_message(client, userdata, msg):
+        try:
+            status = json.loads(msg.payload)
+        except ValueError:
+            return
+        if status.get("id") == command["id"]:
+            replies["status"] = status
+            answered.set()
+
+    client = create_client(f"fimav-swap-model-{command['id'][:8]}")
+    client.username_pw_set(username, password)
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.connect(host, port)
+    client.loop_start()
+    try:
+        answered.wait(timeout)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return replies.get("status")
+
+
+def format_status(status):
+    lines = []
+    if status.get("part"):
+        if status.get("error"):
+            lines.append(
+                f"{status['part']} model kept, {status['model']} failed:"
+                f" {status['error']}"
+            )
+        else:
+            lines.append(f"{status['part']} model now {status['model']}")
+    elif status.get("error"):
+        lines.append(f"Command refused: {status['error']}")
+    lines.append("Model latency:")
+    for model, latency in sorted(status["latency"].items()):
+        lines.append(
+            f"  {model:<28} {latency['runs']:6d} runs,"
+            f" median {latency['median_ms']:6.2f} ms, p95 {latency['p95_ms']:6.2f} ms"
+        )
+    return "\n".join(lines)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    command = {}
+    if args.part is not None:
+        command = {"swap": args.part, "param": args.param, "bin": args.bin}
+    _logger.info(f"Sending {command or 'a report request'}")
+    status = send_command(
+        command,
+        args.mqtt_host,
+        args.mqtt_port,
+        args.mqtt_user,
+        args.mqtt_password,
+        args.timeout,
+    )
+    if status is None:
+        print(f"No answer from fimav-run within {args.timeout:.0f} s")
+        sys.exit(1)
+    print(format_status(status))
+    if status.get("error"):
+        sys.exit(1)
+
+
+def run():
+    """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
+
+    This function can be used as entry point to create console scripts with setuptools.
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
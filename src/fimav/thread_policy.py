@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+
+# Roles given to the threads of the pipeline, with what they run
+ROLES = {
+    "face": "face detection (<camera>-face, face-batch-scheduler)",
+    "emotion": "emotion classification (<camera>-emotion, batched workers)",
+    "worker": "face detection and emotion classification (pipeline-worker-<n>)",
+    "display": "Tk frame updater (display)",
+    "midi": "MIDI transport (midi-transport)",
+    "mqtt": "MQTT network loop and sender (paho, mqtt-sender)",
+}
+
+_lock = threading.Lock()
+_threads = []
+_policy = None
+
+
+class ThreadPolicy:
+    """CPU affinity, nice value and ``SCHED_FIFO`` priority for each role.
+
+    ``roles`` maps a role to a dict with any of ``cpus`` (list of CPU
+    numbers), ``nice`` and ``fifo`` (real-time priority, 1-99). A FIFO
+    priority that is not permitted falls back to the nice value, and any
+    setting the platform lacks is skipped, so a policy never stops the
+    application. Linux applies these per thread; elsewhere nothing is done.
+
+    Every application is kept in ``applied`` as
+    ``(thread name, role, [outcome, ...])`` for :meth:`format_report`.
+    """
+
+    def __init__(self, roles):
+        unknown = set(roles) - set(ROLES)
+        if unknown:
+            raise ValueError(f"Unknown thread roles: {', '.join(sorted(unknown))}")
+        self.roles = roles
+        self.applied = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """Read a policy from a JSON file of ``{role: {setting: value}}``."""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def apply(self, role, thread=None):
+        """Apply the settings of ``role`` to ``thread``, the calling one if None.
+
+        Returns the outcome of each setting, as short strings.
+        """
+        settings = self.roles.get(role)
+        if not settings:
+            return []
+        if thread is None:
+            thread = threading.current_thread()
+        tid = thread.native_id
+        outcomes = []
+
+        cpus = settings.get("cpus")
+        if cpus is not None:
+            outcomes.append(_set_affinity(tid, cpus))
+
+        realtime = False
+        if settings.get("fifo") is not None:
+            outcomes.append(_set_fifo(tid, settings["fifo"]))
+            realtime = outcomes[-1].startswith("fifo=")
+        if settings.get("nice") is not None and not realtime:
+            outcomes.append(_set_nice(tid, settings["nice"]))
+
+        with self._lock:
+            self.applied.append((thread.name, role, outcomes))
+        return outcomes
+
+    def format_report(self):
+        with self._lock:
+            applied = list(self.applied)
+        lines = ["Thread policy:"]
+        for name, role, outcomes in applied:
+            lines.append(f"  {name:<24} {role:<8} {', '.join(outcomes)}")
+        if not applied:
+            lines.append("  no thread with a configured role")
+        return "\n".join(lines)
+
+
+def _set_affinity(tid, cpus):
+    if not hasattr(os, "sched_setaffinity"):
+        return "affinity unsupported"
+    try:
+        os.sched_setaffinity(tid, cpus)
+    except (OSError, ValueError) as e:
+        return f"affinity failed ({e})"
+    return "cpus=" + ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def _set_fifo(tid, priority):
+    if not hasattr(os, "SCHED_FIFO"):
+        return "fifo unsupported"
+    try:
+        os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(priority))
+    except PermissionError:
+        return "fifo not permitted"
+    except OSError as e:
+        return f"fifo failed ({e})"
+    return f"fifo={priority}"
+
+
+def _set_nice(tid, nice):
+    if not hasattr(os, "setpriority"):
+        return "nice unsupported"
+    try:
+        # On Linux the nice value of a thread id applies to that thread only
+        os.setpriority(os.PRIO_PROCESS, tid, nice)
+    except PermissionError:
+        return f"nice={nice} not permitted"
+    except OSError as e:
+        return f"nice failed ({e})"
+    return f"nice={nice}"
+
+
+def register(thread, role):
+    """Give ``role`` to the started ``thread``, applied once a policy is set."""
+    with _lock:
+        _threads[:] = [(t, r) for t, r in _threads if t.is_alive()]
+        _threads.append((thread, role))
+        policy = _policy
+    if policy is not None:
+        policy.apply(role, thread)
+
+
+def install(policy):
+    """Apply ``policy`` to the registered threads and the ones to come."""
+    global _policy
+    with _lock:
+        _policy = policy
+        threads = [(t, role) for t, role in _threads if t.is_alive()]
+        _threads[:] = threads
+    for thread, role in threads:
+        policy.apply(role, thread)
@@ -0,0 +1,150 @@
+import collections
+import json
+import os
+import threading
+import time
+
+
+class FrameTrace:
+    """The stages a camera frame went through, from capture to MQTT.
+
+    Created by the detector for each frame it picks up and handed along
+    with the frame's results: emotion, state controller decision, MIDI
+    command and the first MIDI message of the song it triggered. Times are
+    ``time.monotonic()`` seconds, as the capture timestamps.
+    """
+
+    def __init__(self, tracer, camera, frame_id, captured_at):
+        self.tracer = tracer
+        self.camera = camera
+        self.frame_id = frame_id
+        self.captured_at = captured_at
+        # When the detector picked the frame up
+        self.opened = time.monotonic()
+        self.stages = []
+
+    @property
+    def key(self):
+        return f"{self.camera}#{self.frame_id}"
+
+    def stage(self, name, start, end=None, **args):
+        """Record ``name`` from ``start`` to ``end`` (now) on this thread."""
+        end = time.monotonic() if end is None else end
+        self.stages.append((name, start, end, args))
+        self.tracer.span(
+            name, start, end, frame=self.frame_id, camera=self.camera, **args
+        )
+
+    def finish(self):
+        """The first MIDI message caused by this frame has left on MQTT."""
+        self.tracer.finish(self, time.monotonic())
+
+
+class Tracer:
+    """Collects frame traces and exports them as Chrome trace-event JSON.
+
+    Each stage is a complete event on the thread that ran it, with the frame
+    id in its arguments. Frames that triggered a song also get a
+    ``glass-to-sound`` async track spanning capture to MQTT publish, with a
+    slice per stage, which Perfetto and ``chrome://tracing`` show together.
+    At most ``max_events`` events are kept, the oldest are dropped.
+    """
+
+    def __init__(self, max_events=200000):
+        self.t0 = time.monotonic()
+        self._events = collections.deque(maxlen=max_events)
+        self._threads = {}
+        self._lock = threading.Lock()
+        # Seconds from capture to publish, and per stage, of finished frames
+        self.latencies = collections.deque(maxlen=1000)
+        self.stage_times = collections.defaultdict(
+            lambda: collections.deque(maxlen=1000)
+        )
+
+    def frame(self, camera, frame_id, captured_at):
+        """Start the trace of frame ``frame_id`` captured at ``captured_at``."""
+        if captured_at is None:
+            captured_at = time.monotonic()
+        return FrameTrace(self, camera, frame_id, captured_at)
+
+    def _us(self, t):
+        return round((t - self.t0) * 1e6, 1)
+
+    def span(self, name, start, end, **args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": "stage",
+            "ph": "X",
+            "ts": self._us(start),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread.native_id,
+            "args": args,
+        }
+        with self._lock:
+            self._threads[thread.native_id] = thread.name
+            self._events.append(event)
+
+    def finish(self, trace, end):
+        """Add the glass-to-sound track of ``trace``, published at ``end``."""
+        common = {"cat": "glass-to-sound", "id": trace.key, "pid": os.getpid()}
+        events = [
+            dict(
+                common,
+                name=f"frame {trace.key}",
+                ph="b",
+                ts=self._us(trace.captured_at),
+            ),
+            dict(
+                common, name="wait for detector", ph="b", ts=self._us(trace.captured_at)
+            ),
+            dict(common, name="wait for detector", ph="e", ts=self._us(trace.opened)),
+        ]
+        for name, start, stop, args in trace.stages:
+            events.append(
+                dict(common, name=name, ph="b", ts=self._us(start), args=args)
+            )
+            events.append(dict(common, name=name, ph="e", ts=self._us(stop)))
+        events.append(dict(common, name=f"frame {trace.key}", ph="e", ts=self._us(end)))
+        with self._lock:
+            self._events.extend(events)
+            self.latencies.append(end - trace.captured_at)
+            self.stage_times["wait for detector"].append(
+                trace.opened - trace.captured_at
+            )
+            for name, start, stop, _ in trace.stages:
+                self.stage_times[name].append(stop - start)
+
+    def export(self, path):
+        """Write the trace to ``path`` for Perfetto or ``chrome://tracing``."""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+
+    def format_report(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stages = {name: list(times) for name, times in self.stage_times.items()}
+        if not latencies:
+            return "Glass-to-sound: no song triggered"
+        lines = [
+            f"Glass-to-sound over {len(latencies)} triggers:"
+            f" median {latencies[len(latencies) // 2] * 1000:.1f} ms,"
+            f" max {latencies[-1] * 1000:.1f} ms"
+        ]
+        for name, times in stages.items():
+            lines.append(f"  {name:<20} mean {sum(times) / len(times) * 1000:8.2f} ms")
+        return "\n".join(lines)
@@ -0,0 +1,87 @@
+import numpy as np
+
+from fimav.processing.buffer_pool import BufferPool
+from fimav.processing.detection_snapshot import DetectionSnapshot
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+SHAPE = (48, 64, 3)
+
+
+def test_release_then_checkout_reuses_the_buffer():
+    """A released buffer nobody holds is handed out again"""
+    pool = BufferPool()
+    frame = pool.checkout(SHAPE)
+    first_id = id(frame)
+    pool.release(frame)
+    del frame
+    again = pool.checkout(SHAPE)
+    assert id(again) == first_id
+    assert pool.stats()["allocations"] == 1
+    assert pool.reuses == 1
+
+
+def test_other_shapes_and_dtypes_are_not_reused():
+    """Only a buffer of the same shape and dtype is reused"""
+    pool = BufferPool()
+    pool.release(pool.checkout(SHAPE))
+    pool.checkout((SHAPE[0], SHAPE[1]))
+    pool.checkout(SHAPE, np.float32)
+    assert pool.reuses == 0
+    assert pool.allocations == 3
+
+
+def test_frame_held_by_a_snapshot_is_not_handed_out():
+    """A released frame still held by a consumer is never overwritten"""
+    pool = BufferPool()
+    frame = pool.checkout(SHAPE)
+    frame[:] = 7
+    snapshot = DetectionSnapshot(1, 0.0, frame=frame)
+    pool.release(frame)
+    del frame
+
+    other = pool.checkout(SHAPE)
+    assert other is not snapshot.frame
+    other[:] = 0
+    assert (snapshot.frame == 7).all()
+
+    held = snapshot.frame
+    del snapshot
+    assert pool.checkout(SHAPE) is not held
+    del held
+    assert pool.reuses == 0
+    # Nothing references the first frame any more, it can be reused
+    pool.checkout(SHAPE)
+    assert pool.reuses == 1
+
+
+def test_view_held_by_a_consumer_is_not_handed_out():
+    """A numpy view keeps its base buffer out of the pool"""
+    pool = BufferPool()
+    frame = pool.checkout(SHAPE)
+    frame[:] = 7
+    crop = frame[10:20, 10:20]
+    pool.release(frame)
+    del frame
+
+    other = pool.checkout(SHAPE)
+    other[:] = 0
+    assert other.base is None and crop.base is not other
+    assert (crop == 7).all()
+
+    pool.release(other)
+    del other, crop
+    pool.checkout(SHAPE)
+    pool.checkout(SHAPE)
+    assert pool.reuses == 2
+    assert pool.allocations == 2
+
+
+def test_max_free_bounds_the_free_list():
+    """At most max_free buffers of a shape are kept"""
+    pool = BufferPool(max_free=2)
+    for frame in [pool.checkout(SHAPE) for _ in range(4)]:
+        pool.release(frame)
+    assert pool.stats()["free"] == 2
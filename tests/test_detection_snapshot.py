@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from fimav.processing.detection_snapshot import DetectionSnapshot
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+def test_follow_estimates_velocity():
+    """A box moving between frames gets its smoothed corner speeds"""
+    first = DetectionSnapshot(1, 0.0, boxes=[(100, 100, 150, 150)], scores=[0.9])
+    second = first.follow(2, 0.1, [(110, 100, 160, 150)], [0.9])
+    # Half of the measured 100 px/s, the previous velocity was 0
+    assert second.velocities == ((50.0, 0.0, 50.0, 0.0),)
+
+    third = second.follow(3, 0.2, [(120, 100, 170, 150)], [0.9])
+    assert third.velocities == ((75.0, 0.0, 75.0, 0.0),)
+
+
+def test_follow_same_time_keeps_velocity():
+    """A frame at the same time keeps the previous velocity"""
+    first = DetectionSnapshot(1, 0.0, boxes=[(100, 100, 150, 150)], scores=[0.9])
+    second = first.follow(2, 0.1, [(110, 100, 160, 150)], [0.9])
+    again = second.follow(2, 0.1, [(110, 100, 160, 150)], [0.9])
+    assert again.velocities == second.velocities
+
+
+def test_follow_unmatched_box_starts_still():
+    """A box overlapping none of the previous ones has no velocity"""
+    first = DetectionSnapshot(1, 0.0, boxes=[(100, 100, 150, 150)], scores=[0.9])
+    moving = first.follow(2, 0.1, [(110, 100, 160, 150)], [0.9])
+    second = moving.follow(3, 0.2, [(120, 100, 170, 150), (0, 0, 20, 20)], [0.9, 0.8])
+    assert second.velocities[0] != (0.0, 0.0, 0.0, 0.0)
+    assert second.velocities[1] == (0.0, 0.0, 0.0, 0.0)
+
+
+def test_follow_carries_frame_and_probabilities():
+    """The new snapshot holds its own frame and the last probabilities"""
+    frame = np.zeros((4, 4, 3), np.uint8)
+    probs = np.array([0.1, 0.9])
+    first = DetectionSnapshot(1, 0.0, boxes=[(0, 0, 10, 10)], scores=[0.9])
+    classified = first.with_probabilities(probs)
+    second = classified.follow(2, 0.1, [(0, 0, 10, 10)], [0.9], frame)
+    assert second.frame is frame
+    assert np.array_equal(second.probabilities, probs)
+    assert first.probabilities is None
+
+
+def test_boxes_at_caps_the_lead():
+    """Boxes move along their velocity for at most max_lead seconds"""
+    first = DetectionSnapshot(1, 0.0, boxes=[(100, 100, 150, 150)], scores=[0.9])
+    snapshot = first.follow(2, 0.1, [(110, 100, 160, 150)], [0.9])
+    # Velocity of 50 px/s along x
+    assert snapshot.boxes_at(0.2, max_lead=0.2) == ((115, 100, 165, 150),)
+    assert snapshot.boxes_at(5.0, max_lead=0.2) == ((120, 100, 170, 150),)
+    assert snapshot.boxes_at(0.05, max_lead=0.2) == snapshot.boxes
+    assert snapshot.boxes_at(0.2, max_lead=0) == snapshot.boxes
+
+
+def test_snapshot_is_immutable():
+    """Snapshots cannot be modified once created"""
+    snapshot = DetectionSnapshot(
+        1, 0.0, boxes=[(0, 0, 10, 10)], scores=[0.9], probabilities=np.ones(2)
+    )
+    with pytest.raises(AttributeError):
+        snapshot.boxes = ()
+    with pytest.raises(ValueError):
+        snapshot.probabilities[0] = 0.0
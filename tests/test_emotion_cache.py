@@ -0,0 +1,69 @@
+import numpy as np
+
+from fimav.processing.emotion_cache import EmotionCache
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+FACES = [(0, 0, 50, 50), (100, 0, 150, 50), (200, 0, 250, 50)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def crop(level=100):
+    return np.full((48, 48), level, np.uint8)
+
+
+def probs(index):
+    return np.eye(7)[index]
+
+
+def test_entry_hits_until_the_ttl():
+    """A stored face hits for ttl seconds, then misses"""
+    clock = FakeClock()
+    cache = EmotionCache(ttl=1.0, clock=clock)
+    cache.store(FACES[0], crop(), probs(1))
+    clock.now += 1.0
+    assert cache.lookup(FACES[0], crop()) is not None
+    # Hits do not extend the entry's life
+    clock.now += 0.1
+    assert cache.lookup(FACES[0], crop()) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 0}
+
+
+def test_changed_crop_or_moved_box_misses():
+    """Noise still hits, a new expression or a box elsewhere misses"""
+    cache = EmotionCache(clock=FakeClock())
+    cache.store(FACES[0], crop(100), probs(1))
+    assert np.array_equal(cache.lookup(FACES[0], crop(105)), probs(1))
+    assert cache.lookup(FACES[0], crop(160)) is None
+    assert cache.lookup(FACES[1], crop(100)) is None
+
+
+def test_same_face_replaces_its_entry():
+    """A new result for an overlapping box replaces the old one"""
+    cache = EmotionCache(clock=FakeClock())
+    cache.store(FACES[0], crop(), probs(1))
+    cache.store((2, 0, 52, 50), crop(), probs(3))
+    assert cache.stats()["entries"] == 1
+    assert np.array_equal(cache.lookup(FACES[0], crop()), probs(3))
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Beyond max_entries the entry looked up least recently is dropped"""
+    cache = EmotionCache(max_entries=2, clock=FakeClock())
+    cache.store(FACES[0], crop(), probs(0))
+    cache.store(FACES[1], crop(), probs(1))
+    assert cache.lookup(FACES[0], crop()) is not None
+    cache.store(FACES[2], crop(), probs(2))
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(FACES[1], crop()) is None
+    assert np.array_equal(cache.lookup(FACES[0], crop()), probs(0))
+    assert np.array_equal(cache.lookup(FACES[2], crop()), probs(2))
@@ -0,0 +1,70 @@
+import mido
+
+from fimav.midi.midi_library import EMOTIONS, MidiLibrary
+from fimav.processing.emotion_state_controller import EmotionStateController
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeMidi:
+    def __init__(self):
+        self.played = []
+
+    def is_playing(self):
+        return bool(self.played)
+
+    def play_midi_file(self, path, trace=None):
+        self.played.append(path)
+
+
+def make_controller(tmp_path):
+    folder = tmp_path / "midi" / EMOTIONS[1]
+    folder.mkdir(parents=True)
+    song = mido.MidiFile()
+    song.tracks.append(mido.MidiTrack([mido.Message("note_on", note=60)]))
+    song.save(folder / "song.mid")
+    library = MidiLibrary(str(tmp_path / "midi"), str(tmp_path / "index.json"))
+    midi, clock = FakeMidi(), FakeClock()
+    return EmotionStateController(midi, clock, library), midi, clock
+
+
+def test_no_face_resets_the_hold(tmp_path):
+    """A visitor walking away (None) neither crashes nor triggers a song"""
+    controller, midi, clock = make_controller(tmp_path)
+    controller.update_emotion(1)
+    controller.update_emotion(None)
+    clock.now += 2.0
+    controller.update_emotion(None)
+    assert midi.played == []
+    assert controller.target_emotion is None
+
+
+def test_unknown_emotion_is_ignored(tmp_path):
+    """Indices outside the emotion list never reach the library"""
+    controller, midi, clock = make_controller(tmp_path)
+    controller.update_emotion(len(EMOTIONS))
+    clock.now += 2.0
+    controller.update_emotion(len(EMOTIONS))
+    assert midi.played == []
+    assert controller.library.choose(None) is None
+    assert controller.library.choose(len(EMOTIONS)) is None
+
+
+def test_held_emotion_triggers_its_song(tmp_path):
+    """An emotion held for DELAY seconds plays one of its songs"""
+    controller, midi, clock = make_controller(tmp_path)
+    controller.update_emotion(1)
+    clock.now += controller.DELAY
+    controller.update_emotion(1)
+    assert len(midi.played) == 1
+    assert controller.last_emotion == 1
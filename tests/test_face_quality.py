@@ -0,0 +1,57 @@
+import numpy as np
+
+from fimav.processing.face_quality import FaceQuality
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+FACE_SIZE = (320, 240)
+GOOD_BOX = (100, 60, 160, 140)
+
+
+def sharp_crop():
+    crop = np.zeros((64, 64), np.uint8)
+    crop[::2, ::2] = 255
+    return crop
+
+
+def test_box_reasons_reports_the_first_failed_check():
+    """Each box gets the first check it fails, in the documented order"""
+    quality = FaceQuality(min_size=0.12, min_score=0.8)
+    boxes = [
+        GOOD_BOX,
+        (100, 60, 110, 70),  # 10 px high, under 12% of 240
+        (100, 60, 200, 100),  # 2.5 wide for 1 high
+        GOOD_BOX,  # scored 0.75
+        (0, 60, 60, 140),  # on the left border
+        (0, 0, 5, 5),  # small and truncated, small comes first
+    ]
+    scores = [0.9, 0.9, 0.9, 0.75, 0.9, 0.9]
+    assert quality.box_reasons(boxes, scores, FACE_SIZE) == [
+        None,
+        "too small",
+        "aspect",
+        "low score",
+        "truncated",
+        "too small",
+    ]
+
+
+def test_defaults_keep_the_detector_decisions():
+    """Out of the box, score, size and sharpness do not reject faces"""
+    quality = FaceQuality()
+    assert quality.box_reasons([(100, 60, 110, 72)], [0.7], FACE_SIZE) == [None]
+    assert quality.accept(GOOD_BOX, 0.7, np.zeros((64, 64), np.uint8), FACE_SIZE)
+
+
+def test_accept_counts_rejections():
+    """Blurred and low score faces are rejected and counted per reason"""
+    quality = FaceQuality(min_score=0.8, min_sharpness=100.0)
+    blurred = np.full((64, 64), 128, np.uint8)
+    assert quality.accept(GOOD_BOX, 0.9, sharp_crop(), FACE_SIZE)
+    assert not quality.accept(GOOD_BOX, 0.9, blurred, FACE_SIZE)
+    assert not quality.accept(GOOD_BOX, 0.7, sharp_crop(), FACE_SIZE)
+    stats = quality.stats()
+    assert stats["checks"] == 3
+    assert stats["reasons"] == {"blurred": 1, "low score": 1}
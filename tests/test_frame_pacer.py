@@ -0,0 +1,89 @@
+import pytest
+
+from fimav.gui import frame_pacer
+from fimav.gui.frame_pacer import FramePacer
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(frame_pacer, "time", clock)
+    return clock
+
+
+def render(pacer, clock, cost):
+    clock.now += cost
+    pacer.frame_rendered(cost)
+
+
+def test_frames_on_time_sleep_to_their_slot(clock):
+    """A frame rendered within its slot sleeps until the next one"""
+    pacer = FramePacer(fps=10.0, min_fps=10.0)
+    pacer.start()
+    for _ in range(3):
+        render(pacer, clock, 0.04)
+    assert clock.sleeps == pytest.approx([0.06, 0.06, 0.06])
+    assert clock.now == pytest.approx(100.3)
+    assert pacer.stats()["missed"] == 0
+
+
+def test_missed_deadline_is_counted_without_a_burst(clock):
+    """A late frame counts once and the next slot starts when it ended"""
+    pacer = FramePacer(fps=10.0, min_fps=10.0)
+    pacer.start()
+    render(pacer, clock, 0.05)
+    render(pacer, clock, 0.25)
+    assert pacer.missed == 1
+    assert pacer.deadline == pytest.approx(100.35)
+    assert len(clock.sleeps) == 1
+
+    # The next frame gets a full slot instead of being rushed to catch up
+    render(pacer, clock, 0.05)
+    assert pacer.missed == 1
+    assert clock.sleeps[-1] == pytest.approx(0.05)
+    assert clock.now == pytest.approx(100.45)
+
+
+def test_stale_frames_are_skipped_after_a_missed_deadline(clock):
+    """Up to MAX_SKIPS buffered frames are dropped, a fresh read ends it"""
+    pacer = FramePacer(fps=10.0, min_fps=10.0)
+    pacer.start()
+    render(pacer, clock, 0.15)
+    assert [pacer.is_stale(0.0) for _ in range(3)] == [True, True, False]
+    render(pacer, clock, 0.05)
+    assert not pacer.is_stale(0.0)
+
+    render(pacer, clock, 0.15)
+    assert pacer.is_stale(0.0)
+    # Waited for the camera, the frame is fresh
+    assert not pacer.is_stale(0.05)
+    assert not pacer.is_stale(0.0)
+    stats = pacer.stats()
+    assert (stats["missed"], stats["skipped"], stats["rendered"]) == (2, 3, 3)
+
+
+def test_slow_renders_lower_the_rate(clock):
+    """The rate drops so a render takes at most HEADROOM of a slot"""
+    pacer = FramePacer(fps=30.0, min_fps=10.0)
+    pacer.start()
+    render(pacer, clock, 0.05)
+    assert pacer.fps == pytest.approx(FramePacer.HEADROOM / 0.05)
+    render(pacer, clock, 0.5)
+    assert pacer.fps == pytest.approx(10.0)
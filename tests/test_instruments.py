@@ -0,0 +1,91 @@
+import mido
+import pytest
+
+from fimav.midi.instruments import InstrumentMap, topic_segment
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+@pytest.fixture
+def song(tmp_path):
+    """Two instrument tracks and a tempo track changing tempo mid-song"""
+    conductor = mido.MidiTrack(
+        [
+            mido.MetaMessage("set_tempo", tempo=500000, time=0),
+            mido.MetaMessage("set_tempo", tempo=250000, time=720),
+            mido.MetaMessage("set_tempo", tempo=1000000, time=300),
+        ]
+    )
+    piano = mido.MidiTrack([mido.MetaMessage("track_name", name="Piano")])
+    bass = mido.MidiTrack([mido.MetaMessage("track_name", name="Bass")])
+    for i in range(12):
+        piano.append(mido.Message("note_on", channel=0, note=60 + i, time=0))
+        piano.append(mido.Message("note_off", channel=0, note=60 + i, time=240))
+    for i in range(5):
+        bass.append(mido.Message("note_on", channel=1, note=36 + i, time=0))
+        bass.append(mido.Message("note_off", channel=1, note=36 + i, time=500 + i))
+    bass.append(mido.Message("program_change", channel=1, program=33, time=120))
+    song = mido.MidiFile(ticks_per_beat=480)
+    song.tracks.extend([conductor, piano, bass])
+    path = tmp_path / "song.mid"
+    song.save(path)
+    return str(path)
+
+
+def timeline(events):
+    """Return ``(seconds, instrument, bytes)`` from split_song events"""
+    now = 0.0
+    result = []
+    for delta, message, instrument in events:
+        now += delta
+        result.append((now, instrument, message.bytes()))
+    return result
+
+
+def playback_times(path):
+    """Return the time of each message in mido playback, per channel"""
+    now = 0.0
+    times = {}
+    for message in mido.MidiFile(path):
+        now += message.time
+        if not message.is_meta:
+            times.setdefault(message.channel, []).append((now, message.bytes()))
+    return times
+
+
+@pytest.mark.parametrize(
+    "split, names",
+    [("channel", ["channel0", "channel1"]), ("track", ["Piano", "Bass"])],
+)
+def test_split_song_keeps_mido_timing_per_instrument(song, split, names):
+    """Every instrument gets its messages at the times mido plays them"""
+    events = timeline(InstrumentMap(split).split_song(song))
+    expected = playback_times(song)
+    for channel, name in enumerate(names):
+        times = [(t, data) for t, instrument, data in events if instrument == name]
+        assert len(times) == len(expected[channel])
+        for (t, data), (mido_t, mido_data) in zip(times, expected[channel]):
+            assert data == mido_data
+            assert t == pytest.approx(mido_t, abs=1e-9)
+
+
+def test_split_song_deltas_add_up_to_the_song_length(song):
+    """Deltas are relative to the previous event, across instruments"""
+    events = InstrumentMap().split_song(song)
+    assert all(delta >= 0 for delta, _, _ in events)
+    last = max(t for times in playback_times(song).values() for t, _ in times)
+    assert sum(delta for delta, _, _ in events) == pytest.approx(last, abs=1e-9)
+
+
+def test_instrument_names_are_mapped_and_made_safe():
+    """Mapped channels share an instrument, names become one topic level"""
+    instruments = InstrumentMap("channel", {0: "strings", 1: "strings", 2: "a/b+"})
+    message = mido.Message("note_on", channel=1)
+    assert instruments.instrument(message, 0, "") == "strings"
+    assert instruments.instrument(message.copy(channel=2), 0, "") == "a_b"
+    assert instruments.instrument(message.copy(channel=3), 0, "") == "channel3"
+    assert InstrumentMap("none").instrument(message, 0, "") is None
+    assert topic_segment("Control") == "Control_"
+    assert topic_segment("#") is None
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import mido
+import pytest
+
+from fimav.midi.instruments import InstrumentMap
+from fimav.midi.midi_controller import MidiController
+from fimav.midi.midi_library import MidiLibrary
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+# 0.1 s at the default tempo of 120 bpm
+TICKS_PER_TENTH = 96
+
+
+class FakeManager:
+    def __init__(self):
+        self.sent = []
+        self.controls = []
+        self.changed = threading.Condition()
+
+    def send_midi(self, msg, instrument=None, play_at=None, song=None, trace=None):
+        with self.changed:
+            self.sent.append((msg, play_at))
+            self.changed.notify_all()
+
+    def send_control(self, command):
+        self.controls.append(command)
+
+    def wait_for(self, predicate, timeout=5.0):
+        with self.changed:
+            assert self.changed.wait_for(lambda: predicate(self.sent), timeout)
+
+
+def write_song(path, notes, channel, end):
+    """Write ``notes`` as ``(tenth, note)`` note-ons, all released at ``end``."""
+    track = mido.MidiTrack()
+    tick = 0
+    for tenth, note in notes:
+        track.append(
+            mido.Message(
+                "note_on",
+                channel=channel,
+                note=note,
+                velocity=100,
+                time=tenth * TICKS_PER_TENTH - tick,
+            )
+        )
+        tick = tenth * TICKS_PER_TENTH
+    for i, (_, note) in enumerate(notes):
+        delta = end * TICKS_PER_TENTH - tick if i == 0 else 0
+        track.append(mido.Message("note_off", channel=channel, note=note, time=delta))
+    song = mido.MidiFile(ticks_per_beat=480)
+    song.tracks.append(track)
+    song.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def songs(tmp_path):
+    # A long note, then four notes a tenth of a second apart
+    return (
+        write_song(tmp_path / "long.mid", [(0, 60)], channel=0, end=100),
+        write_song(
+            tmp_path / "short.mid",
+            [(0, 64), (1, 65), (2, 66), (3, 67)],
+            channel=1,
+            end=5,
+        ),
+    )
+
+
+def make_controller(tmp_path, lookahead=0.0):
+    manager = FakeManager()
+    library = MidiLibrary(str(tmp_path), str(tmp_path / "index.json"))
+    controller = MidiController(
+        manager, str(tmp_path), library, InstrumentMap(), lookahead=lookahead
+    )
+    return controller, manager
+
+
+def wait_idle(controller, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while controller.is_playing():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def notes_of(sent, kind):
+    return [msg.note for msg, _ in sent if msg.type == kind]
+
+
+@pytest.mark.parametrize("lookahead", [0.0, 0.3])
+def test_stop_releases_the_sounding_notes(tmp_path, songs, lookahead):
+    """Stopping sends the note-offs at once, cancelling what was sent ahead"""
+    controller, manager = make_controller(tmp_path, lookahead)
+    try:
+        controller.play_midi_file(songs[0])
+        manager.wait_for(lambda sent: notes_of(sent, "note_on") == [60])
+        controller.stop()
+        wait_idle(controller)
+        assert notes_of(manager.sent, "note_off") == [60]
+        if lookahead > 0:
+            assert manager.controls == [{"cancel": 0}]
+        else:
+            assert manager.controls == []
+        assert controller.switch_latency() is not None
+    finally:
+        controller.close()
+    assert not controller.transport_thread.is_alive()
+
+
+def test_crossfade_fades_the_songs(tmp_path, songs):
+    """The old song is released at the fade end, the new one fades in"""
+    controller, manager = make_controller(tmp_path, lookahead=0.3)
+    try:
+        controller.play_midi_file(songs[0])
+        manager.wait_for(lambda sent: notes_of(sent, "note_on") == [60])
+        controller.crossfade(songs[1], duration=0.2)
+        manager.wait_for(lambda sent: len(notes_of(sent, "note_off")) == 4)
+        wait_idle(controller)
+    finally:
+        controller.close()
+
+    by_note = {
+        (msg.type, msg.note): (msg, play_at) for msg, play_at in manager.sent[1:]
+    }
+    # Silent at the start of the fade, so never sounded nor released
+    assert ("note_on", 64) not in by_note
+    assert notes_of(manager.sent, "note_off") == [60, 65, 66, 67]
+    velocities = [by_note[("note_on", note)][0].velocity for note in (65, 66, 67)]
+    assert 0 < velocities[0] < velocities[1] <= velocities[2] == 100
+
+    # The long note ends when the fade does, 0.1 s after the second note
+    fade_end = by_note[("note_on", 65)][1] + 0.1
+    assert by_note[("note_off", 60)][1] == pytest.approx(fade_end, abs=1e-3)
+    assert manager.controls == []
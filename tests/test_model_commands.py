@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from fimav.mqtt.model_commands import ModelCommandServer
+from fimav.processing.model_store import ModelStore
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+class FakeManager:
+    def __init__(self):
+        self.published = []
+
+    def subscribe(self, topic, callback):
+        self.callback = callback
+
+    def publish(self, topic, payload, droppable=True):
+        self.published.append(json.loads(payload))
+
+
+class FakeSwapper:
+    def __init__(self, store):
+        self.bank = type("Bank", (), {"store": store})()
+        self.swaps = []
+
+    def swap(self, part, param, bin_path, callback=None):
+        self.swaps.append((part, param, bin_path))
+
+    def latency_stats(self):
+        return {}
+
+
+@pytest.fixture
+def server(tmp_path):
+    models = tmp_path / "models"
+    (models / "face").mkdir(parents=True)
+    for name in ("new.param", "new.bin"):
+        (models / "face" / name).write_bytes(b"model")
+    (tmp_path / "secret.bin").write_bytes(b"not a model")
+    store = ModelStore(str(models), str(tmp_path / "models.json"))
+    return ModelCommandServer(FakeManager(), FakeSwapper(store))
+
+
+def send(server, **command):
+    server.mqtt_manager.callback("fimav/models/command", json.dumps(command))
+
+
+def test_swap_inside_the_model_directories(server, tmp_path):
+    """Models found in the store's directories are swapped in"""
+    send(server, id="1", swap="face", param="face/new.param", bin="face/new.bin")
+    assert server.swapper.swaps == [
+        (
+            "face",
+            str(tmp_path / "models" / "face" / "new.param"),
+            str(tmp_path / "models" / "face" / "new.bin"),
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    "bin_path", ["{tmp}/secret.bin", "face/../../secret.bin", "/etc/passwd"]
+)
+def test_paths_outside_are_refused(server, tmp_path, bin_path):
+    """Any other file is refused with an error status, nothing is loaded"""
+    bin_path = bin_path.format(tmp=tmp_path)
+    send(server, id="2", swap="face", param="face/new.param", bin=bin_path)
+    assert server.swapper.swaps == []
+    assert server.mqtt_manager.published[-1]["id"] == "2"
+    assert server.mqtt_manager.published[-1]["error"]
@@ -0,0 +1,71 @@
+import hashlib
+import os
+
+import pytest
+
+from fimav.processing import model_store
+from fimav.processing.model_store import ModelIntegrityError, ModelStore
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / "models" / "net.bin"
+    path.parent.mkdir()
+    path.write_bytes(b"weights" * 100)
+    return path
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    original = hashlib.sha256
+
+    def sha256(data):
+        calls.append(len(data))
+        return original(data)
+
+    monkeypatch.setattr(model_store.hashlib, "sha256", sha256)
+    return calls
+
+
+def test_checksum_is_cached_while_the_file_is_unchanged(tmp_path, weights, monkeypatch):
+    """A file is only hashed again once its size or mtime changed"""
+    expected = hashlib.sha256(weights.read_bytes()).hexdigest()
+    calls = count_hashes(monkeypatch)
+    cache = str(tmp_path / "models.json")
+    digest = ModelStore(str(weights.parent), cache).checksum("models/net.bin")
+    assert digest == expected
+    assert len(calls) == 1
+
+    # A new store, as at the next start, trusts the cached checksum
+    assert ModelStore(str(weights.parent), cache).checksum(str(weights)) == digest
+    assert len(calls) == 1
+
+    weights.write_bytes(b"other weights")
+    os.utime(weights, ns=(0, 1))
+    store = ModelStore(str(weights.parent), cache)
+    assert store.checksum(str(weights)) != digest
+    assert len(calls) == 2
+
+
+def test_sidecar_mismatch_is_reported(tmp_path, weights):
+    """A <file>.sha256 sidecar that does not match raises ModelIntegrityError"""
+    sidecar = weights.parent / "net.bin.sha256"
+    sidecar.write_text("0" * 64 + "  net.bin\n")
+    store = ModelStore(str(weights.parent), str(tmp_path / "models.json"))
+    with pytest.raises(ModelIntegrityError):
+        store.checksum(str(weights))
+
+    sidecar.write_text(hashlib.sha256(weights.read_bytes()).hexdigest())
+    assert ModelStore(str(weights.parent), str(tmp_path / "models.json")).checksum(
+        str(weights)
+    )
+
+
+def test_missing_model_is_not_found(tmp_path):
+    store = ModelStore(str(tmp_path), str(tmp_path / "models.json"))
+    with pytest.raises(FileNotFoundError):
+        store.resolve("models/none.bin")
@@ -0,0 +1,70 @@
+import numpy as np
+
+from fimav.processing.motion_gate import MotionGate
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def scene(square=None):
+    frame = np.full((240, 320, 3), 90, np.uint8)
+    if square is not None:
+        x, y = square
+        frame[y : y + 80, x : x + 80] = 250
+    return frame
+
+
+def test_static_scene_is_skipped():
+    """Once the first frame ran the net, an unchanged scene is skipped"""
+    clock = FakeClock()
+    gate = MotionGate(clock=clock)
+    assert gate.needs_detection(scene())
+    for _ in range(5):
+        clock.now += 0.1
+        assert not gate.needs_detection(scene())
+    stats = gate.stats()
+    assert stats["checks"] == 6
+    assert stats["skipped"] == 5
+
+
+def test_motion_runs_the_detection():
+    """A visitor entering the scene lets the detection through"""
+    clock = FakeClock()
+    gate = MotionGate(clock=clock)
+    gate.needs_detection(scene())
+    clock.now += 0.1
+    assert gate.needs_detection(scene(square=(120, 80)))
+    clock.now += 0.1
+    assert gate.needs_detection(scene(square=(200, 80)))
+
+
+def test_refresh_is_forced_on_a_static_scene():
+    """A detection runs every refresh_interval even without motion"""
+    clock = FakeClock()
+    gate = MotionGate(refresh_interval=2.0, clock=clock)
+    assert gate.needs_detection(scene(square=(120, 80)))
+    clock.now += 1.9
+    assert not gate.needs_detection(scene(square=(120, 80)))
+    clock.now += 0.1
+    assert gate.needs_detection(scene(square=(120, 80)))
+    # The interval restarts from the forced detection
+    clock.now += 1.0
+    assert not gate.needs_detection(scene(square=(120, 80)))
+
+
+def test_reset_forces_the_next_detection():
+    """After a reset the gate has no background and lets the frame through"""
+    clock = FakeClock()
+    gate = MotionGate(clock=clock)
+    gate.needs_detection(scene())
+    gate.reset()
+    assert gate.needs_detection(scene())
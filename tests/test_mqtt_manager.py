@@ -0,0 +1,47 @@
+import threading
+import time
+
+import mido
+
+from fimav.mqtt.local_broker import LocalBroker
+from fimav.mqtt.mqtt_manager import TOPIC, MqttManager, create_client
+
+__author__ = "Eloik-dev"
+__copyright__ = "Eloik-dev"
+__license__ = "MIT"
+
+
+def test_close_sends_queued_note_offs():
+    """Every note-off queued before close reaches the broker"""
+    broker = LocalBroker().start()
+    received = []
+    subscribed = threading.Event()
+
+    listener = create_client("listener")
+    listener.on_connect = lambda client, *args: client.subscribe(f"{TOPIC}/#")
+    listener.on_subscribe = lambda *args: subscribed.set()
+    listener.on_message = lambda client, userdata, msg: received.append(
+        msg.payload.decode()
+    )
+    listener.connect(broker.host, broker.port)
+    listener.loop_start()
+    try:
+        assert subscribed.wait(5)
+        manager = MqttManager(broker.host, broker.port, username=None)
+        note_offs = []
+        # Queued before the connection is up, so close finds them queued
+        for note in range(60, 100):
+            manager.send_midi(mido.Message("note_on", note=note, velocity=64))
+            msg = mido.Message("note_off", note=note)
+            manager.send_midi(msg, instrument="piano")
+            note_offs.append(str(msg))
+        manager.close(timeout=5.0)
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not set(note_offs) <= set(received):
+            time.sleep(0.01)
+        assert [payload for payload in received if "note_off" in payload] == note_offs
+    finally:
+        listener.loop_stop()
+        listener.disconnect()
+        broker.stop()